@@ -0,0 +1,132 @@
+"""
+Baseline estimator r_ui = mu + bu + bi, fitted by vectorized ALS
+
+Same model and options as surprise.BaselineOnly with the 'als' method (reg_u
+= 15, reg_i = 10, n_epochs = 10), but every ALS step is one np.bincount over
+the inner user / item ids instead of a loop over the ratings:
+
+  bi = sum_u (r_ui - mu - bu) / (reg_i + |U_i|)
+  bu = sum_i (r_ui - mu - bi) / (reg_u + |I_u|)
+
+The ratings are read through a blocks() callable, so the same code fits an
+in-memory trainset or an out-of-core store of streaming.py (two passes per
+epoch); StreamingSVD(init_baseline=True) starts from these biases.
+
+  algo = BaselineALS().fit(trainset)
+  rmse = algo.evaluate_slices(testset, {'all': None, 'pop': pop_movies})
+"""
+import numpy as np
+
+from surprise import AlgoBase
+
+from model_io import lookup_ids, raw_ids, ratings_arrays
+
+
+def als_baselines(blocks, n_users, n_items, global_mean, reg_u=15, reg_i=10,
+                  n_epochs=10):
+  """(bu, bi) by alternating least squares
+
+  blocks() returns an iterable of (inner uids, inner iids, ratings) arrays
+  covering the training set; it is called twice per epoch.
+  """
+  # sum_u (r_ui - mu - bu) = sum_u r_ui - |U_i| mu - sum_u bu: the rating sums
+  # and counts are gathered once, each epoch only sums the other biases
+  bu = np.zeros(n_users)
+  bi = np.zeros(n_items)
+  sum_r_i = n_i = sum_r_u = n_u = None
+  for epoch in range(n_epochs):
+    sum_bu = np.zeros(n_items)
+    if epoch == 0:
+      sum_r_i, n_i = np.zeros(n_items), np.zeros(n_items)
+    for u, i, r in blocks():
+      if epoch == 0:
+        sum_r_i += np.bincount(i, weights=r, minlength=n_items)
+        n_i += np.bincount(i, minlength=n_items)
+      else:
+        sum_bu += np.bincount(i, weights=bu[u], minlength=n_items)
+    bi = (sum_r_i - global_mean * n_i - sum_bu) / (reg_i + n_i)
+
+    sum_bi = np.zeros(n_users)
+    if epoch == 0:
+      sum_r_u, n_u = np.zeros(n_users), np.zeros(n_users)
+    for u, i, r in blocks():
+      if epoch == 0:
+        sum_r_u += np.bincount(u, weights=r, minlength=n_users)
+        n_u += np.bincount(u, minlength=n_users)
+      sum_bi += np.bincount(u, weights=bi[i], minlength=n_users)
+    bu = (sum_r_u - global_mean * n_u - sum_bi) / (reg_u + n_u)
+  return bu, bi
+
+
+class BaselineALS(AlgoBase):
+  def __init__(self, reg_u=15, reg_i=10, n_epochs=10):
+    AlgoBase.__init__(self)
+    self.reg_u = reg_u
+    self.reg_i = reg_i
+    self.n_epochs = n_epochs
+
+  def fit(self, trainset):
+    AlgoBase.fit(self, trainset)
+    u, i, r = ratings_arrays(trainset)
+    # bincount works on intp indices; convert once rather than every pass
+    u, i = u.astype(np.intp), i.astype(np.intp)
+    r = r.astype(np.float64)
+    self.bu, self.bi = als_baselines(lambda: [(u, i, r)], trainset.n_users,
+                                     trainset.n_items, trainset.global_mean,
+                                     self.reg_u, self.reg_i, self.n_epochs)
+    self.user_raw = raw_ids(trainset, users=True)
+    self.item_raw = raw_ids(trainset, users=False)
+    self.user_order = np.argsort(self.user_raw, kind='stable')
+    self.item_order = np.argsort(self.item_raw, kind='stable')
+    return self
+
+  def estimate(self, u, i):
+    # As surprise.BaselineOnly: unknown users / items have a bias of 0
+    est = self.trainset.global_mean
+    if self.trainset.knows_user(u):
+      est += self.bu[u]
+    if self.trainset.knows_item(i):
+      est += self.bi[i]
+    return est
+
+  # Batch predictions
+  def estimate_batch(self, u, i):
+    """Estimates for arrays of inner ids (-1 means unknown), not clipped"""
+    u, i = np.asarray(u), np.asarray(i)
+    return (self.trainset.global_mean +
+            np.where(u >= 0, self.bu[np.maximum(u, 0)], 0) +
+            np.where(i >= 0, self.bi[np.maximum(i, 0)], 0))
+
+  def predict_batch(self, uids, iids, clip=True):
+    """Estimates for arrays of raw user and item ids"""
+    est = self.estimate_batch(
+      lookup_ids(self.user_raw, self.user_order, uids),
+      lookup_ids(self.item_raw, self.item_order, iids))
+    if clip:
+      lower_bound, higher_bound = self.trainset.rating_scale
+      est = np.clip(est, lower_bound, higher_bound)
+    return est
+
+  def test_batch(self, testset, clip=True):
+    """(true ratings, estimates) arrays for a list of (uid, iid, r_ui)"""
+    if len(testset) == 0:
+      return np.empty(0), np.empty(0)
+    uids, iids, r_ui = (np.asarray(col) for col in zip(*testset))
+    return r_ui.astype(np.float64), self.predict_batch(uids, iids, clip)
+
+  def evaluate_slices(self, testset, slices):
+    """RMSE on every slice of testset
+
+    slices maps a name to the raw item ids of the slice, or to None for the
+    whole testset. Empty slices have a RMSE of nan.
+    """
+    r_ui, est = self.test_batch(testset)
+    iids = np.asarray([x[1] for x in testset])
+    rmse = dict()
+    for name, items in slices.items():
+      mask = np.ones(len(iids), dtype=bool) if items is None else \
+        np.isin(iids, np.fromiter(items, dtype=iids.dtype))
+      err = r_ui[mask] - est[mask]
+      rmse[name] = float(np.sqrt(np.mean(err ** 2))) if mask.any() \
+        else float('nan')
+    return rmse
@@ -0,0 +1,261 @@
+"""
+Benchmarks of the fit / predict / evaluation hot paths of project3.py
+
+Every case is timed `--repeat` times and then run once more under tracemalloc
+to record its peak allocation. Cases that cannot fit in memory at a given
+scale (the dense R matrix, the user-user similarity matrix of kNN) are skipped
+above their `max_ratings`.
+
+  python3 bench.py --scales ml-small synth-1m --output bench_results.json
+  python3 bench.py --scales ml-small --compare bench_results.json \
+    --output bench_results_new.json
+
+With --compare the new medians are checked against a saved run and the script
+exits with status 1 if any case got slower by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+
+import sklearn
+import surprise
+from surprise import Dataset, Reader, KNNWithMeans
+from surprise.prediction_algorithms.matrix_factorization import NMF, SVD
+from surprise.model_selection import train_test_split
+from sklearn.metrics import roc_curve, auc
+
+from cf_utils import build_rating_matrix, movie_rating_stats, popular_movies
+from cf_utils import high_variance_movies, NaiveCollabFilter
+from cf_utils import calc_precision_recall
+from instrument import rss_mb
+import synth
+
+RATINGS_CSV = './ml-latest-small/ratings.csv'
+
+
+"""
+Datasets
+"""
+def synthetic_ratings(n_ratings, seed=42):
+  """Power-law ratings fitted to ml-latest-small (see synth.py)"""
+  profile = synth.fit_profile(RATINGS_CSV)
+  return synth.generate_frame(n_ratings, profile=profile, seed=seed)
+
+
+SCALES = {
+  'ml-small': lambda: pd.read_csv(RATINGS_CSV),
+  'synth-100k': lambda: synthetic_ratings(100000),
+  'synth-1m': lambda: synthetic_ratings(1000000),
+  'synth-10m': lambda: synthetic_ratings(10000000),
+}
+
+
+"""
+Cases: (name, max_ratings or None, setup(ctx) or None, fn(ctx)). ctx holds the
+data of one scale and the fitted models / predictions needed by the
+evaluation cases; setup builds them before the timed runs.
+"""
+def _fitted(ctx, name):
+  """Model fitted on ctx['trainset'] and its test predictions (untimed)"""
+  if name not in ctx['models']:
+    algo = _make_algo(name)
+    algo.fit(ctx['trainset'])
+    ctx['models'][name] = (algo, algo.test(ctx['testset']))
+  return ctx['models'][name]
+
+
+def _make_algo(name):
+  if name == 'knn':
+    sim_options = {'name': 'pearson', 'user_based': True}
+    return KNNWithMeans(k=20, sim_options=sim_options, verbose=False)
+  if name == 'nmf':
+    return NMF(n_factors=20, biased=False)
+  if name == 'svd':
+    return SVD(n_factors=50, random_state=42)
+  return NaiveCollabFilter()
+
+
+def _fit_case(name):
+  return lambda ctx: _make_algo(name).fit(ctx['trainset'])
+
+
+def _setup(name):
+  return lambda ctx: _fitted(ctx, name)
+
+
+def _test_case(name):
+  return lambda ctx: _fitted(ctx, name)[0].test(ctx['testset'])
+
+
+def _movie_stats(ctx):
+  ratings, variances = movie_rating_stats(ctx['data'].raw_ratings)
+  return popular_movies(ratings), high_variance_movies(ratings, variances)
+
+
+def _precision_recall(ctx):
+  pred = _fitted(ctx, 'knn')[1]
+  for t in (1, 10, 25):
+    calc_precision_recall(pred, t, 3)
+
+
+def _roc(ctx):
+  pred = _fitted(ctx, 'svd')[1]
+  y_true = [0 if p.r_ui < 3 else 1 for p in pred]
+  y_score = [p.est for p in pred]
+  fpr, tpr, _ = roc_curve(y_true=y_true, y_score=y_score)
+  return auc(fpr, tpr)
+
+
+CASES = [
+  ('build_R', 200000, None, lambda ctx: build_rating_matrix(ctx['df'])),
+  ('movie_stats', None, None, _movie_stats),
+  ('knn_fit', 2000000, None, _fit_case('knn')),
+  ('knn_test', 2000000, _setup('knn'), _test_case('knn')),
+  ('nmf_fit', None, None, _fit_case('nmf')),
+  ('nmf_test', None, _setup('nmf'), _test_case('nmf')),
+  ('svd_fit', None, None, _fit_case('svd')),
+  ('svd_test', None, _setup('svd'), _test_case('svd')),
+  ('naive_fit', None, None, _fit_case('naive')),
+  ('naive_test', None, _setup('naive'), _test_case('naive')),
+  ('precision_recall', 2000000, _setup('knn'), _precision_recall),
+  ('roc', None, _setup('svd'), _roc),
+]
+
+
+"""
+Measurement
+"""
+def run_case(fn, ctx, repeat):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn(ctx)
+    times.append(time.perf_counter() - start)
+
+  tracemalloc.start()
+  fn(ctx)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {
+    'times': times,
+    'min': min(times),
+    'median': float(np.median(times)),
+    'peak_mem_mb': peak / 2**20,
+    'rss_mb': rss_mb(),
+  }
+
+
+def environment():
+  try:
+    commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                            text=True, cwd=os.path.dirname(__file__) or '.'
+                            ).stdout.strip() or None
+  except OSError:
+    commit = None
+  return {
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'host': socket.gethostname(),
+    'platform': platform.platform(),
+    'processor': platform.processor(),
+    'cpu_count': os.cpu_count(),
+    'python': sys.version.split()[0],
+    'numpy': np.__version__,
+    'pandas': pd.__version__,
+    'surprise': surprise.__version__,
+    'sklearn': sklearn.__version__,
+    'git_commit': commit,
+  }
+
+
+def run_benchmarks(scales, cases, repeat):
+  results = []
+  for scale in scales:
+    df = SCALES[scale]()
+    data = Dataset.load_from_df(df[['userId', 'movieId', 'rating']],
+                                Reader(rating_scale=(0.5, 5)))
+    trainset, testset = train_test_split(data, test_size=0.1, random_state=42)
+    ctx = {'df': df, 'data': data, 'trainset': trainset, 'testset': testset,
+           'models': dict()}
+    print(f'\n{scale}: {len(df)} ratings')
+
+    for name, max_ratings, setup, fn in CASES:
+      if cases and name not in cases:
+        continue
+      result = {'dataset': scale, 'case': name, 'n_ratings': len(df)}
+      if max_ratings is not None and len(df) > max_ratings:
+        result['skipped'] = f'more than {max_ratings} ratings'
+        print(f'  {name:<18} skipped')
+      else:
+        if setup is not None:
+          setup(ctx)
+        result.update(run_case(fn, ctx, repeat))
+        print(f'  {name:<18} median {result["median"]:9.3f} s   '
+              f'peak {result["peak_mem_mb"]:9.1f} MB')
+      results.append(result)
+  return results
+
+
+def compare(results, baseline, tolerance):
+  """Print the ratio to the baseline of every case; returns the regressions"""
+  base = {(r['dataset'], r['case']): r for r in baseline['results']
+          if 'median' in r}
+  regressions = []
+  print(f'\n{"dataset":<12} {"case":<18} {"baseline":>10} {"now":>10} '
+        f'{"ratio":>7}')
+  for r in results:
+    b = base.get((r['dataset'], r['case']))
+    if b is None or 'median' not in r:
+      continue
+    ratio = r['median'] / b['median']
+    flag = ''
+    if ratio > 1 + tolerance:
+      flag = '  SLOWER'
+      regressions.append(r)
+    print(f'{r["dataset"]:<12} {r["case"]:<18} {b["median"]:10.3f} '
+          f'{r["median"]:10.3f} {ratio:7.2f}{flag}')
+  return regressions
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('--scales', nargs='+', default=['ml-small'],
+                      choices=list(SCALES))
+  parser.add_argument('--cases', nargs='+', choices=[c[0] for c in CASES],
+                      help='run only these cases')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--output', default='bench_results.json')
+  parser.add_argument('--compare', help='baseline JSON of a previous run')
+  parser.add_argument('--tolerance', type=float, default=0.10,
+                      help='allowed relative slowdown before flagging')
+  args = parser.parse_args()
+
+  # Read the baseline before anything is written: writing the results over it
+  # would compare the run with itself
+  baseline = None
+  if args.compare:
+    if os.path.abspath(args.compare) == os.path.abspath(args.output):
+      parser.error('--output must not be the --compare baseline; pass '
+                   'another --output')
+    with open(args.compare) as handle:
+      baseline = json.load(handle)
+
+  np.random.seed(42)
+  results = run_benchmarks(args.scales, args.cases, args.repeat)
+  with open(args.output, 'w') as handle:
+    json.dump({'environment': environment(), 'results': results}, handle,
+              indent=2)
+  print(f'\nResults written to {args.output}')
+
+  if baseline is not None:
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+      print(f'\n{len(regressions)} case(s) slower than the baseline')
+      sys.exit(1)
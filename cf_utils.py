@@ -0,0 +1,125 @@
+"""
+Building blocks of project3.py that other scripts (benchmarks, serving, batch
+jobs) need without running the whole project: the rating matrix R, the movie
+rating statistics used to trim the test sets, the naive filter and the
+precision / recall computation.
+"""
+import bisect  # use to keep a sorted list
+import numpy as np
+
+from surprise import AlgoBase
+from collections import defaultdict
+
+
+"""
+Rating matrix R: m users (rows) x n movies (columns), r_ij = rating of user i
+for movie j, 0 when missing. User ids are assumed to run from 1 to m.
+"""
+def build_rating_matrix(df):
+  movies = df['movieId'].unique()
+  users = df['userId'].unique()
+
+  movies_map = dict()
+  movies_inv_map = dict()
+  for (i, Id) in enumerate(movies):
+    movies_map[Id] = i
+    movies_inv_map[i] = Id
+
+  R = np.zeros([users.shape[0], movies.shape[0]])
+
+  for idx, row in df.iterrows():
+    R[int(row['userId']-1)][movies_map[row['movieId']]] =  row['rating']
+
+  return R, movies_map, movies_inv_map
+
+
+"""
+Movie statistics used to build the trimmed test sets
+"""
+def movie_rating_stats(raw_ratings):
+  """(ratings, variances): all ratings and rating variance of each movieId"""
+  # Create a dict where each movieId is a key and the values are a list
+  # of all the ratings for the movieId
+  ratings = {}
+  for row in raw_ratings:
+    # if movieId not in dict, add it
+    if row[1] not in ratings:
+      ratings[row[1]] = []
+
+    # Add ratings to movieId list
+    ratings[row[1]].append(row[2])
+
+  # Create dictionary with rating variance for each movieId
+  variances = {}
+  for movieId in ratings:
+    variances[movieId] = np.var(ratings[movieId])
+
+  return ratings, variances
+
+
+def popular_movies(ratings):
+  """Movies with more than 2 ratings"""
+  return [movie for movie in ratings if len(ratings[movie]) > 2]
+
+
+def high_variance_movies(ratings, variances):
+  """Movies with at least 5 ratings and a rating variance of at least 2"""
+  return [movieId for movieId in ratings if len(ratings[movieId]) >=5
+          and variances[movieId] >= 2]
+
+
+"""
+Naive Collaborative Filtering
+
+rij_hat = mean(u_j)
+"""
+class NaiveCollabFilter(AlgoBase):
+  def __init__(self):
+    AlgoBase.__init__(self)
+    self._m_uid = dict()
+
+  def fit(self, trainset):
+    AlgoBase.fit(self, trainset)
+    self._m_uid.clear()
+    if hasattr(trainset, 'ratings_arrays'):
+      # Array backed trainsets (CompactTrainset): one bincount per statistic
+      users, _, ratings = trainset.ratings_arrays()
+      n = np.bincount(users, minlength=trainset.n_users)
+      sums = np.bincount(users, weights=ratings, minlength=trainset.n_users)
+      rated = np.flatnonzero(n)
+      self._m_uid = dict(zip(rated.tolist(), zip(
+        (sums[rated] / n[rated]).tolist(), n[rated].tolist())))
+      return self
+    for uid, iid, rating in self.trainset.all_ratings():
+      if uid in self._m_uid:
+        m = self._m_uid[uid][0]
+        n = self._m_uid[uid][1] + 1
+        m += (rating - m) / n
+        self._m_uid[uid] = (m, n)
+      else:
+        self._m_uid[uid] = (rating, 1)
+    return self
+
+  def estimate(self, u, i):
+    return self._m_uid[u][0] if u in self._m_uid else 0
+
+
+"""
+Precision and recall of the top t predictions of every user
+"""
+def calc_precision_recall(pred, t, threshold=3.0):
+  user_ratings = defaultdict(list)
+  for uid,_,r_ui, est, _ in pred:
+    bisect.insort(user_ratings[uid], (est, r_ui))
+
+  precision, recall  = dict(), dict()
+  for uid, ratings in user_ratings.items():
+    if len(ratings) < t:
+      continue
+    # |G|
+    G = sum((r_ui >= threshold) for (_, r_ui) in ratings)
+    if int(G) == 0:
+      continue
+    StnG = sum(((est >= threshold) and (est >= threshold)) for (est, r_ui) in ratings[-t:])
+    precision[uid], recall[uid] = StnG / t, StnG / G
+  return (precision, recall)
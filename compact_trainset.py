@@ -0,0 +1,330 @@
+"""
+Compact array-backed replacement for surprise.Trainset
+
+surprise.Trainset keeps the ratings twice, as dicts of lists of (inner id,
+rating) tuples (ur and ir), which costs well over 100 bytes per rating.
+CompactTrainset keeps them as CSR (by user) and CSC (by item) int32 / float32
+arrays, 16 bytes per rating, and maps raw <-> inner ids with sorted arrays.
+
+It implements the Trainset interface used by the Surprise algorithms (ur, ir,
+all_ratings, knows_user, to_inner_uid, ...), so KNNWithMeans, NMF, SVD and
+NaiveCollabFilter fit on it unchanged. The order of the ratings matches
+surprise.Trainset exactly (inner ids in order of first appearance, ratings of
+a user / item in data order), so the SGD based models give the same results.
+
+That interface hands out Python (inner id, rating) tuples, which this class
+builds from the arrays on every pass, so it is slower than surprise.Trainset
+wherever rows are short: with 2 ratings a user, a pass of ur[u] lookups takes
+about 5x as long and one over ur.items() (converted a block of ratings at a
+time) about 2x. all_ratings() is about 2x faster. The Cython loops of
+Surprise still pay for the tuples; the code of this repo reads the arrays
+instead: ratings_arrays(), ur_arrays(u) and ir_arrays(i).
+
+Ratings are stored as float32 by default, exact for ratings on a grid of a
+few significant digits such as half stars. Other ratings are rounded to about
+7 digits, which changes the estimates slightly; pass rating_dtype=np.float64
+to keep them as they are.
+
+  from compact_trainset import CompactTrainset, kfold_split
+  trainset = CompactTrainset.from_df(df)
+  for trainset, testset in kfold_split(data, KFold(n_splits=10)):
+    algo.fit(trainset)
+"""
+import itertools
+import numpy as np
+import pandas as pd
+
+from surprise.utils import get_rng
+
+from model_io import lookup_ids
+
+
+# Ratings converted to Python objects at a time by the full passes
+_BLOCK = 65536
+
+
+class _Row:
+  """(inner id, rating) pairs of one user or item, as stored in ur / ir
+
+  len() reads no rating (NMF asks for the length of every row every epoch);
+  the pairs are built when the row is iterated.
+  """
+  __slots__ = ('indices', 'ratings')
+
+  def __init__(self, indices, ratings):
+    self.indices = indices
+    self.ratings = ratings
+
+  def __len__(self):
+    return len(self.indices)
+
+  def __iter__(self):
+    return zip(self.indices.tolist(), self.ratings.tolist())
+
+  def __getitem__(self, k):
+    if isinstance(k, slice):
+      return list(zip(self.indices[k].tolist(), self.ratings[k].tolist()))
+    return (self.indices[k].item(), self.ratings[k].item())
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+
+class _RatingsView:
+  """Read-only dict of lists view (ur / ir) of one CSR side of the trainset"""
+  __slots__ = ('indptr', 'indices', 'ratings')
+
+  def __init__(self, indptr, indices, ratings):
+    self.indptr = indptr
+    self.indices = indices
+    self.ratings = ratings
+
+  def __len__(self):
+    return len(self.indptr) - 1
+
+  def __contains__(self, key):
+    return isinstance(key, (int, np.integer)) and 0 <= key < len(self)
+
+  def __iter__(self):
+    return iter(range(len(self)))
+
+  def __getitem__(self, key):
+    # Like the defaultdict of surprise.Trainset, unknown keys have no ratings
+    if key not in self:
+      return []
+    lo, hi = self.indptr[key], self.indptr[key + 1]
+    return _Row(self.indices[lo:hi], self.ratings[lo:hi])
+
+  def keys(self):
+    return range(len(self))
+
+  def values(self):
+    return (row for _, row in self.items())
+
+  def items(self):
+    # The rows of about _BLOCK ratings are converted with one tolist() call
+    indptr = self.indptr.tolist()
+    first, n_rows = 0, len(self)
+    while first < n_rows:
+      last = int(np.searchsorted(self.indptr, indptr[first] + _BLOCK,
+                                 side='right')) - 1
+      last = min(max(last, first + 1), n_rows)
+      base = indptr[first]
+      pairs = list(zip(self.indices[base:indptr[last]].tolist(),
+                       self.ratings[base:indptr[last]].tolist()))
+      for key in range(first, last):
+        yield key, pairs[indptr[key] - base:indptr[key + 1] - base]
+      first = last
+
+
+def _csr(rows, cols, vals, n_rows):
+  """CSR arrays keeping the data order of the ratings inside every row"""
+  order = np.argsort(rows, kind='stable')
+  indptr = np.zeros(n_rows + 1, dtype=np.int64)
+  np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+  return indptr, cols[order].astype(np.int32), vals[order]
+
+
+class CompactTrainset:
+  __slots__ = ('n_users', 'n_items', 'n_ratings', 'rating_scale',
+               'user_indptr', 'user_items', 'user_ratings',
+               'item_indptr', 'item_users', 'item_ratings',
+               'user_raw', 'item_raw', 'user_order', 'item_order',
+               '_global_mean', '_raw2inner_users', '_raw2inner_items', '_ur',
+               '_ir')
+
+  def __init__(self, users, items, ratings, rating_scale,
+               rating_dtype=np.float32):
+    """Build from arrays of raw user ids, raw item ids and ratings"""
+    uid, self.user_raw = pd.factorize(np.asarray(users), sort=False)
+    iid, self.item_raw = pd.factorize(np.asarray(items), sort=False)
+    self.user_raw = np.asarray(self.user_raw)
+    self.item_raw = np.asarray(self.item_raw)
+    ratings = np.asarray(ratings, dtype=rating_dtype)
+
+    self.n_users = len(self.user_raw)
+    self.n_items = len(self.item_raw)
+    self.n_ratings = len(ratings)
+    self.rating_scale = rating_scale
+    self.user_indptr, self.user_items, self.user_ratings = \
+      _csr(uid, iid, ratings, self.n_users)
+    self.item_indptr, self.item_users, self.item_ratings = \
+      _csr(iid, uid, ratings, self.n_items)
+    self.user_order = np.argsort(self.user_raw, kind='stable')
+    self.item_order = np.argsort(self.item_raw, kind='stable')
+    self._global_mean = None
+    self._raw2inner_users = None
+    self._raw2inner_items = None
+    self._ur = _RatingsView(self.user_indptr, self.user_items,
+                            self.user_ratings)
+    self._ir = _RatingsView(self.item_indptr, self.item_users,
+                            self.item_ratings)
+
+  @classmethod
+  def from_df(cls, df, rating_scale=(0.5, 5),
+              columns=('userId', 'movieId', 'rating'),
+              rating_dtype=np.float32):
+    u, i, r = columns
+    return cls(df[u].values, df[i].values, df[r].values, rating_scale,
+               rating_dtype)
+
+  @classmethod
+  def from_dataset(cls, data, rating_dtype=np.float32):
+    """Full trainset of a surprise Dataset, like data.build_full_trainset()"""
+    users, items, ratings = _raw_columns(data.raw_ratings)
+    return cls(users, items, ratings, data.reader.rating_scale, rating_dtype)
+
+  # Arrays
+  def ratings_arrays(self):
+    """(inner uid, inner iid, rating) arrays in all_ratings() order"""
+    users = np.repeat(np.arange(self.n_users, dtype=np.int32),
+                      np.diff(self.user_indptr))
+    return users, self.user_items, self.user_ratings
+
+  def ur_arrays(self, u):
+    """(inner iids, ratings) array views of the ratings of user u"""
+    lo, hi = self.user_indptr[u], self.user_indptr[u + 1]
+    return self.user_items[lo:hi], self.user_ratings[lo:hi]
+
+  def ir_arrays(self, i):
+    """(inner uids, ratings) array views of the ratings of item i"""
+    lo, hi = self.item_indptr[i], self.item_indptr[i + 1]
+    return self.item_users[lo:hi], self.item_ratings[lo:hi]
+
+  def nbytes(self):
+    return sum(getattr(self, name).nbytes for name in self.__slots__
+               if isinstance(getattr(self, name, None), np.ndarray))
+
+  @property
+  def ur(self):
+    return self._ur
+
+  @property
+  def ir(self):
+    return self._ir
+
+  @property
+  def global_mean(self):
+    if self._global_mean is None:
+      self._global_mean = float(np.mean(self.user_ratings, dtype=np.float64))
+    return self._global_mean
+
+  # Id maps
+  def to_inner_uids(self, ruids):
+    return lookup_ids(self.user_raw, self.user_order, ruids)
+
+  def to_inner_iids(self, riids):
+    return lookup_ids(self.item_raw, self.item_order, riids)
+
+  def to_inner_uid(self, ruid):
+    # Dicts over the (few) users and items keep the per prediction lookups
+    # of AlgoBase.predict cheap
+    if self._raw2inner_users is None:
+      self._raw2inner_users = dict(zip(self.user_raw.tolist(),
+                                       range(self.n_users)))
+    try:
+      return self._raw2inner_users[ruid]
+    except KeyError:
+      raise ValueError('User ' + str(ruid) + ' is not part of the trainset.')
+
+  def to_inner_iid(self, riid):
+    if self._raw2inner_items is None:
+      self._raw2inner_items = dict(zip(self.item_raw.tolist(),
+                                       range(self.n_items)))
+    try:
+      return self._raw2inner_items[riid]
+    except KeyError:
+      raise ValueError('Item ' + str(riid) + ' is not part of the trainset.')
+
+  def to_raw_uid(self, iuid):
+    try:
+      return self.user_raw[iuid].item()
+    except IndexError:
+      raise ValueError(str(iuid) + ' is not a valid inner id.')
+
+  def to_raw_iid(self, iiid):
+    try:
+      return self.item_raw[iiid].item()
+    except IndexError:
+      raise ValueError(str(iiid) + ' is not a valid inner id.')
+
+  def knows_user(self, uid):
+    return isinstance(uid, (int, np.integer)) and 0 <= uid < self.n_users
+
+  def knows_item(self, iid):
+    return isinstance(iid, (int, np.integer)) and 0 <= iid < self.n_items
+
+  # Iteration, as in surprise.Trainset
+  def all_ratings(self):
+    users, items, ratings = self.ratings_arrays()
+    return itertools.chain.from_iterable(
+      zip(users[lo:lo + _BLOCK].tolist(), items[lo:lo + _BLOCK].tolist(),
+          ratings[lo:lo + _BLOCK].tolist())
+      for lo in range(0, self.n_ratings, _BLOCK))
+
+  def all_users(self):
+    return range(self.n_users)
+
+  def all_items(self):
+    return range(self.n_items)
+
+  def build_testset(self):
+    users, items, ratings = self.ratings_arrays()
+    return list(zip(self.user_raw[users].tolist(),
+                    self.item_raw[items].tolist(), ratings.tolist()))
+
+  def build_anti_testset(self, fill=None):
+    fill = self.global_mean if fill is None else float(fill)
+    anti_testset = []
+    all_items = np.arange(self.n_items)
+    for u in range(self.n_users):
+      seen = self.user_items[self.user_indptr[u]:self.user_indptr[u + 1]]
+      unseen = np.setdiff1d(all_items, seen, assume_unique=True)
+      ruid = self.user_raw[u].item()
+      anti_testset += [(ruid, riid, fill)
+                       for riid in self.item_raw[unseen].tolist()]
+    return anti_testset
+
+
+def _raw_columns(raw_ratings):
+  """Arrays of raw user ids, raw item ids and ratings of a raw_ratings list"""
+  users, items, ratings, _ = zip(*raw_ratings)
+  return np.asarray(users), np.asarray(items), np.asarray(ratings)
+
+
+def kfold_split(data, kf, rating_dtype=np.float32):
+  """kf.split(data) with CompactTrainset trainsets
+
+  kf is a surprise KFold; the folds are the same as those of kf.split(data)
+  (same shuffling and random_state), and the testsets are the usual lists of
+  (uid, iid, r_ui) tuples.
+  """
+  n = len(data.raw_ratings)
+  if kf.n_splits > n or kf.n_splits < 2:
+    raise ValueError('Incorrect value for n_splits={}. Must be >=2 and less '
+                     'than the number of ratings'.format(n))
+  users, items, ratings = _raw_columns(data.raw_ratings)
+  rating_scale = data.reader.rating_scale
+
+  indices = np.arange(n)
+  if kf.shuffle:
+    get_rng(kf.random_state).shuffle(indices)
+
+  start, stop = 0, 0
+  for fold_i in range(kf.n_splits):
+    start = stop
+    stop += n // kf.n_splits
+    if fold_i < n % kf.n_splits:
+      stop += 1
+
+    train = np.concatenate([indices[:start], indices[stop:]])
+    trainset = CompactTrainset(users[train], items[train], ratings[train],
+                               rating_scale, rating_dtype)
+    testset = [(data.raw_ratings[i][0], data.raw_ratings[i][1],
+                data.raw_ratings[i][2]) for i in indices[start:stop]]
+    yield trainset, testset
+
+
+def split_folds(kf, data, compact=False):
+  """kf.split(data), or kfold_split(data, kf) when compact is set"""
+  return kfold_split(data, kf) if compact else kf.split(data)
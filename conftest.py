@@ -0,0 +1,27 @@
+"""Small synthetic ratings shared by the tests"""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope='session')
+def ratings_df():
+  """About 2300 half-star ratings of 60 users on 120 movies"""
+  rng = np.random.default_rng(0)
+  n_users, n_items, n = 60, 120, 2400
+  df = pd.DataFrame({'userId': rng.integers(n_users, size=n) + 1,
+                     'movieId': rng.integers(n_items, size=n) * 7 + 1})
+  df = df.drop_duplicates().reset_index(drop=True)
+  user_bias = rng.normal(0, 0.5, n_users + 1)[df['userId']]
+  item_bias = rng.normal(0, 0.5, n_items * 7 + 2)[df['movieId']]
+  noise = rng.normal(0, 0.7, len(df))
+  df['rating'] = np.clip(np.round(2 * (3.5 + user_bias + item_bias + noise)) /
+                         2, 0.5, 5)
+  return df
+
+
+@pytest.fixture(scope='session')
+def data(ratings_df):
+  from surprise import Dataset, Reader
+  return Dataset.load_from_df(ratings_df[['userId', 'movieId', 'rating']],
+                              Reader(rating_scale=(0.5, 5)))
@@ -0,0 +1,202 @@
+"""
+Resumable batch export of the top-N recommendations of every user
+
+The users of a model artifact (model_io.py, any kind) are split into blocks
+of block_size inner ids. Every block is scored with top_n_batch (seen items
+excluded) and written to its own part file:
+
+  jsonl : part-00000.jsonl, one {"uid": .., "items": [[iid, est], ..]} a line
+  npz   : part-00000.npz, columns uid (B,), iid (B, n), est (B, n); lists
+          shorter than n are padded with est nan (and iid -1)
+
+A part is written next to its final name and renamed into place, so a part
+file that exists is complete: a crashed or killed run started again skips
+the blocks already written and removes the temporary files it left.
+manifest.json pins the model version, n, format and block size of the
+export; resuming with other settings is an error. Blocks are spread over
+`workers` processes, which share the memory mapped model. They open the
+version directory the model path pointed to when the export started, so a
+model saved meanwhile never gets into it. Memory is bounded by one
+(block_size, n_items) score matrix a worker; the default block size keeps it
+at 2**24 scores.
+
+  python3 export.py ./models/mf ./exports/mf --n 10 --workers 4
+  python3 export.py ./models/mf ./exports/mf --n 10 --workers 4   # resumes
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from model_io import load_model
+
+MANIFEST_FILE = 'manifest.json'
+FORMATS = ('jsonl', 'npz')
+BLOCK_SCORES = 2**24
+
+_model = None
+
+
+def part_path(out_dir, block, fmt):
+  return os.path.join(out_dir, f'part-{block:05d}.{fmt}')
+
+
+def _write_part(path, uids, lists, n, fmt, item_dtype):
+  tmp_path = f'{path}.tmp-{os.getpid()}'
+  if fmt == 'jsonl':
+    with open(tmp_path, 'w') as handle:
+      for uid, items in zip(uids.tolist(), lists):
+        handle.write(json.dumps({'uid': uid, 'items': items}) + '\n')
+  else:
+    pad = -1 if item_dtype.kind in 'iuf' else ''
+    iids = np.full((len(uids), n), pad, dtype=item_dtype)
+    est = np.full((len(uids), n), np.nan)
+    for row, items in enumerate(lists):
+      if items:
+        iids[row, :len(items)], est[row, :len(items)] = zip(*items)
+    with open(tmp_path, 'wb') as handle:
+      np.savez(handle, uid=uids, iid=iids, est=est)
+  os.replace(tmp_path, path)
+
+
+def _init_worker(model_path, version):
+  global _model
+  _model = load_model(model_path)
+  if _model.version != version:
+    raise ValueError(f'{model_path} holds model {_model.version}, the export '
+                     f'is of model {version}')
+
+
+def _export_block(task):
+  """Score and write one block; returns (block, users, stage seconds)"""
+  block, out_dir, n, block_size, fmt = task
+  start = time.perf_counter()
+  uids = _model.user_raw[block * block_size:(block + 1) * block_size]
+  lists = _model.top_n_batch(uids, n)
+  scored = time.perf_counter()
+  _write_part(part_path(out_dir, block, fmt), uids, lists, n, fmt,
+              _model.item_raw.dtype)
+  return block, len(uids), {'score': scored - start,
+                            'write': time.perf_counter() - scored}
+
+
+def _check_manifest(out_dir, manifest):
+  path = os.path.join(out_dir, MANIFEST_FILE)
+  if os.path.exists(path):
+    with open(path) as handle:
+      old = json.load(handle)
+    if old != manifest:
+      raise ValueError(f'{out_dir} holds an export of other settings '
+                       f'({old}); remove it or choose another directory')
+  else:
+    with open(path + '.tmp', 'w') as handle:
+      json.dump(manifest, handle, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export_top_n(model_path, out_dir, n=10, block_size=None, workers=1,
+                 fmt='jsonl', verbose=True):
+  """Write the top-n lists of every user of the artifact at model_path
+
+  block_size defaults to BLOCK_SCORES // n_items users, a score matrix of
+  about 128 MB (a worker peaks at about 3 times that while ranking).
+  Returns a dict of counts and users/sec per stage ('score', 'write') and
+  for the whole run ('total'). Stage rates are per worker; blocks written by
+  an earlier run are counted in skipped_blocks.
+  """
+  if fmt not in FORMATS:
+    raise ValueError(f'unknown format {fmt}')
+  start = time.perf_counter()
+  # The version directory, which a later save does not change
+  model_path = os.path.realpath(model_path)
+  model = load_model(model_path)
+  block_size = block_size or max(1, BLOCK_SCORES // model.n_items)
+  n_blocks = -(-model.n_users // block_size)
+  os.makedirs(out_dir, exist_ok=True)
+  _check_manifest(out_dir, {'version': model.version, 'kind': model.kind,
+                            'n': n, 'block_size': block_size, 'format': fmt,
+                            'n_users': model.n_users, 'n_blocks': n_blocks})
+  for name in os.listdir(out_dir):
+    if name.startswith('part-') and '.tmp-' in name:
+      os.remove(os.path.join(out_dir, name))  # left by a killed run
+  todo = [b for b in range(n_blocks)
+          if not os.path.exists(part_path(out_dir, b, fmt))]
+  tasks = [(b, out_dir, n, block_size, fmt) for b in todo]
+
+  seconds = {'score': 0.0, 'write': 0.0}
+  n_exported = 0
+
+  def done(result):
+    nonlocal n_exported
+    block, users, stages = result
+    n_exported += users
+    for stage, sec in stages.items():
+      seconds[stage] += sec
+    if verbose:
+      print(f'block {block} of {n_blocks}: {users} users in '
+            f'{sum(stages.values()):.2f} s')
+
+  if workers > 1 and len(tasks) > 1:
+    # A worker that dies (e.g. out of memory) fails the run with
+    # BrokenProcessPool instead of hanging it; the blocks done are kept
+    with ProcessPoolExecutor(min(workers, len(tasks)),
+                             initializer=_init_worker,
+                             initargs=(model_path, model.version)) as pool:
+      for future in as_completed([pool.submit(_export_block, task)
+                                  for task in tasks]):
+        done(future.result())
+  else:
+    _init_worker(model_path, model.version)
+    for task in tasks:
+      done(_export_block(task))
+
+  total = time.perf_counter() - start
+  stats = {'users': n_exported, 'blocks': len(todo),
+           'skipped_blocks': n_blocks - len(todo), 'seconds': total}
+  for stage, sec in seconds.items():
+    stats[f'{stage}_users_per_s'] = n_exported / sec if sec else None
+  stats['total_users_per_s'] = n_exported / total if total else None
+  return stats
+
+
+def read_export(out_dir):
+  """Yield (raw uid, [(raw iid, est)]) of an export, in user order"""
+  with open(os.path.join(out_dir, MANIFEST_FILE)) as handle:
+    manifest = json.load(handle)
+  for block in range(manifest['n_blocks']):
+    path = part_path(out_dir, block, manifest['format'])
+    if manifest['format'] == 'jsonl':
+      with open(path) as handle:
+        for line in handle:
+          row = json.loads(line)
+          yield row['uid'], [tuple(item) for item in row['items']]
+    else:
+      with np.load(path) as part:
+        for uid, iids, est in zip(part['uid'].tolist(), part['iid'],
+                                  part['est']):
+          ok = ~np.isnan(est)
+          yield uid, list(zip(iids[ok].tolist(), est[ok].tolist()))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('model', help='model artifact directory')
+  parser.add_argument('out_dir')
+  parser.add_argument('--n', type=int, default=10)
+  parser.add_argument('--block-size', type=int,
+                      help='users per block (default: 2**24 / n_items)')
+  parser.add_argument('--workers', type=int, default=os.cpu_count())
+  parser.add_argument('--format', choices=FORMATS, default='jsonl')
+  args = parser.parse_args()
+
+  stats = export_top_n(args.model, args.out_dir, args.n, args.block_size,
+                       args.workers, args.format)
+  print(f'\n{stats["users"]} users in {stats["blocks"]} blocks '
+        f'({stats["skipped_blocks"]} already exported), '
+        f'{stats["seconds"]:.1f} s')
+  for stage in ('score', 'write', 'total'):
+    rate = stats[f'{stage}_users_per_s']
+    if rate is not None:
+      print(f'  {stage:6s} {rate:10.0f} users/s')
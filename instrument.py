@@ -0,0 +1,235 @@
+"""
+Stage timing and memory instrumentation for the experiment loops
+
+  tracer = Tracer('trace')
+  tags = dict(model='knn', param=k, fold=fold)
+  with tracer.stage('fit', **tags):
+    algo.fit(trainset)
+
+  @tracer.timed('load')
+  def load(): ...
+
+  for fold, (trainset, testset) in enumerate(
+      tracer.iterate('split', kf.split(data), model='knn', param=k)):
+    ...
+
+  tracer.summary()
+  tracer.close()
+
+Every stage records its wall time, the peak of the memory traced by
+tracemalloc while it ran (when memory=True, off by default) and the peak RSS
+sampled by a background thread. Stages are appended to <prefix>.jsonl as they
+finish and written as a Chrome trace (chrome://tracing, Perfetto) to
+<prefix>.chrome.json on close().
+"""
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from collections import defaultdict
+
+
+def rss_mb():
+  """Resident set size of this process in MB (None where /proc is missing)"""
+  try:
+    with open('/proc/self/statm') as handle:
+      return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+  except OSError:
+    return None
+
+
+class _Frame:
+  __slots__ = ('name', 'tags', 'start', 'rss_start', 'rss_peak', 'mem_start',
+               'mem_peak')
+
+  def __init__(self, name, tags):
+    self.name = name
+    self.tags = tags
+    self.start = time.perf_counter()
+    self.rss_start = self.rss_peak = rss_mb()
+    self.mem_start = self.mem_peak = 0
+
+
+class Tracer:
+  """Record per-(model, param, fold, stage) timings and memory peaks
+
+  prefix=None keeps the events in memory only. memory=True traces Python
+  allocations (numpy included) with tracemalloc, which slows the experiment
+  loops down 5-8x: run it as a separate pass, not with the timings.
+  rss_interval is the RSS sampling period in seconds (None disables the
+  sampler).
+  """
+  def __init__(self, prefix='trace', memory=False, rss_interval=0.01):
+    self.prefix = prefix
+    self.memory = memory
+    self.events = []
+    self._stack = []
+    self._lock = threading.Lock()
+    self._t0 = time.perf_counter()
+    self._jsonl = open(prefix + '.jsonl', 'w') if prefix else None
+    if memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+    self._stop = threading.Event()
+    self._sampler = None
+    if rss_interval and rss_mb() is not None:
+      self._sampler = threading.Thread(target=self._sample_rss,
+                                       args=(rss_interval,), daemon=True)
+      self._sampler.start()
+
+  def _sample_rss(self, interval):
+    while not self._stop.wait(interval):
+      rss = rss_mb()
+      with self._lock:
+        for frame in self._stack:
+          frame.rss_peak = max(frame.rss_peak, rss)
+
+  # Stages
+  def _enter(self, name, tags):
+    frame = _Frame(name, tags)
+    if self.memory:
+      current, peak = tracemalloc.get_traced_memory()
+      # reset_peak() below hides the running peak from the enclosing stage
+      if self._stack:
+        self._stack[-1].mem_peak = max(self._stack[-1].mem_peak, peak)
+      tracemalloc.reset_peak()
+      frame.mem_start = frame.mem_peak = current
+    with self._lock:
+      self._stack.append(frame)
+    return frame
+
+  def _exit(self, frame):
+    end = time.perf_counter()
+    with self._lock:
+      self._stack.pop()
+    event = {
+      'stage': frame.name,
+      **frame.tags,
+      'start': frame.start - self._t0,
+      'duration': end - frame.start,
+      'depth': len(self._stack),
+    }
+    if self.memory:
+      frame.mem_peak = max(frame.mem_peak, tracemalloc.get_traced_memory()[1])
+      if self._stack:
+        self._stack[-1].mem_peak = max(self._stack[-1].mem_peak,
+                                       frame.mem_peak)
+      event['traced_peak_mb'] = (frame.mem_peak - frame.mem_start) / 2**20
+    if frame.rss_start is not None:
+      rss = rss_mb()
+      event['rss_mb'] = rss
+      event['rss_peak_mb'] = max(frame.rss_peak, rss)
+    self.events.append(event)
+    if self._jsonl:
+      self._jsonl.write(json.dumps(event) + '\n')
+      self._jsonl.flush()
+    return event
+
+  def stage(self, name, **tags):
+    """Context manager timing the enclosed block as stage `name`"""
+    return _Stage(self, name, tags)
+
+  def timed(self, name=None, **tags):
+    """Decorator timing every call of a function"""
+    def decorator(fn):
+      @functools.wraps(fn)
+      def wrapper(*args, **kwargs):
+        with self.stage(name or fn.__name__, **tags):
+          return fn(*args, **kwargs)
+      return wrapper
+    return decorator
+
+  def iterate(self, name, iterable, **tags):
+    """Yield from iterable, timing each next() as stage `name`
+
+    The fold tag is the index of the item, so wrapping kf.split(data) times
+    the split of every fold.
+    """
+    iterator = iter(iterable)
+    fold = 0
+    while True:
+      frame = self._enter(name, {**tags, 'fold': fold})
+      try:
+        item = next(iterator)
+      except StopIteration:
+        with self._lock:
+          self._stack.pop()
+        return
+      self._exit(frame)
+      yield item
+      fold += 1
+
+  # Reports
+  def summary(self, keys=('model', 'stage')):
+    """Print the total time of every (model, stage) and its share of the run"""
+    total = defaultdict(float)
+    count = defaultdict(int)
+    worst = defaultdict(float)
+    peak = defaultdict(float)
+    for event in self.events:
+      key = tuple(event.get(k) for k in keys)
+      total[key] += event['duration']
+      count[key] += 1
+      worst[key] = max(worst[key], event['duration'])
+      peak[key] = max(peak[key], event.get('rss_peak_mb') or 0)
+    # Only top level stages add up to the run time
+    run_time = sum(e['duration'] for e in self.events if e['depth'] == 0)
+
+    header = ''.join(f'{k:<16}' for k in keys)
+    print(f'\n{header}{"calls":>7} {"total s":>10} {"mean s":>9} '
+          f'{"max s":>9} {"% run":>6} {"peak RSS MB":>12}')
+    for key in sorted(total, key=total.get, reverse=True):
+      share = 100 * total[key] / run_time if run_time else 0
+      cols = ''.join(f'{str(k):<16}' for k in key)
+      print(f'{cols}{count[key]:>7} {total[key]:>10.3f} '
+            f'{total[key] / count[key]:>9.4f} {worst[key]:>9.4f} '
+            f'{share:>6.1f} {peak[key]:>12.1f}')
+
+  def write_chrome_trace(self, path):
+    """Write the events in the Chrome trace event format"""
+    trace = []
+    for event in self.events:
+      args = {k: v for k, v in event.items()
+              if k not in ('stage', 'start', 'duration', 'depth')}
+      label = ' '.join(f'{k}={event[k]}' for k in ('model', 'param', 'fold')
+                       if k in event)
+      trace.append({
+        'name': event['stage'],
+        'cat': str(event.get('model', '')),
+        'ph': 'X',
+        'ts': 1e6 * event['start'],
+        'dur': 1e6 * event['duration'],
+        'pid': os.getpid(),
+        'tid': 0,
+        'args': {'label': label, **args},
+      })
+    with open(path, 'w') as handle:
+      json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, handle)
+
+  def close(self):
+    self._stop.set()
+    if self._sampler is not None:
+      self._sampler.join()
+    if self._jsonl:
+      self._jsonl.close()
+      self._jsonl = None
+      self.write_chrome_trace(self.prefix + '.chrome.json')
+    if self.memory and tracemalloc.is_tracing():
+      tracemalloc.stop()
+
+
+class _Stage:
+  def __init__(self, tracer, name, tags):
+    self.tracer = tracer
+    self.name = name
+    self.tags = tags
+
+  def __enter__(self):
+    self.frame = self.tracer._enter(self.name, self.tags)
+    return self.frame
+
+  def __exit__(self, exc_type, exc, tb):
+    self.tracer._exit(self.frame)
+    return False
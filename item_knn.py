@@ -0,0 +1,195 @@
+"""
+Item-based kNN with a precomputed table of the top-k neighbors of every movie
+
+The similarities of all item pairs are computed offline, a block of items at a
+time, as sparse products of the centered rating matrix:
+
+  pearson_baseline : Pearson correlation of the deviations r_ui - b_ui from
+                     the baseline b_ui = mu + bu + bi, over the common users,
+                     shrunk towards 0 by (n - 1) / (n - 1 + shrinkage) as in
+                     Surprise
+  cosine           : cosine of the columns of R centered by the user means
+
+Only the k most similar items (with a positive similarity) of every item are
+kept, in a CSR table sorted by decreasing similarity. Predictions are gathers
+over that table,
+
+  r_ui = b_ui + sum(s_ij * (r_uj - b_uj)) / sum(s_ij)
+
+over the neighbors j of i rated by u (b_ui are the ALS baselines of
+baseline.py), and "movies like X" is a slice of it.
+The fitted model is saved as a model_io artifact of kind item_knn, so
+load_model() and serve.py (/similar) use it like any other model.
+
+  python3 item_knn.py --save ./models/item_knn --like 1 --n 10
+"""
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from model_io import ModelArtifact, artifact_meta, write_artifact, to_csr
+from model_io import raw_ids, ratings_arrays
+from baseline import als_baselines
+
+RATINGS_CSV = './ml-latest-small/ratings.csv'
+MOVIES_CSV = './ml-latest-small/movies.csv'
+
+
+def _top_k(sim, k, lo):
+  """CSR rows (indices, sims) of the k best positive entries of each column"""
+  n = sim.shape[0]
+  # An item is not its own neighbor
+  sim[lo + np.arange(sim.shape[1]), np.arange(sim.shape[1])] = 0
+  k = min(k, n)
+  top = np.argpartition(-sim, k - 1, axis=0)[:k]
+  top_sims = np.take_along_axis(sim, top, axis=0)
+  order = np.argsort(-top_sims, axis=0, kind='stable')
+  top = np.take_along_axis(top, order, axis=0).T
+  top_sims = np.take_along_axis(top_sims, order, axis=0).T
+  keep = top_sims > 0
+  return keep.sum(axis=1), top[keep], top_sims[keep]
+
+
+class ItemKNN:
+  """Fit the neighbor table of every item from a trainset
+
+  k is the number of neighbors kept per item; a prediction needs at least
+  min_k of them rated by the user. Pearson similarities computed on fewer
+  than min_support common users are 0. block_size items are compared with
+  every other item at a time (default: about 4M similarities per block).
+  """
+  def __init__(self, k=40, min_k=1, sim='pearson_baseline', shrinkage=100,
+               min_support=1, block_size=None, verbose=False):
+    if sim not in ('pearson_baseline', 'cosine'):
+      raise ValueError(f'unknown similarity {sim}')
+    self.k = k
+    self.min_k = min_k
+    self.sim = sim
+    self.shrinkage = shrinkage
+    self.min_support = min_support
+    self.block_size = block_size
+    self.verbose = verbose
+
+  def fit(self, trainset):
+    u, i, r = ratings_arrays(trainset)
+    u, i = u.astype(np.int64), i.astype(np.int64)
+    r = r.astype(np.float64)
+    n_users, n_items = trainset.n_users, trainset.n_items
+    mu = float(np.mean(r))
+    bu, bi = als_baselines(lambda: [(u, i, r)], n_users, n_items, mu)
+
+    if self.sim == 'pearson_baseline':
+      dev = r - (mu + bu[u] + bi[i])
+    else:
+      dev = r - (np.bincount(u, weights=r, minlength=n_users) /
+                 np.bincount(u, minlength=n_users))[u]
+    X = sp.csr_matrix((dev, (u, i)), shape=(n_users, n_items))
+    nb_counts, nb_indices, nb_sims = self._neighbors(X)
+
+    nb_indptr = np.zeros(n_items + 1, dtype=np.int64)
+    np.cumsum(nb_counts, out=nb_indptr[1:])
+    arrays = {'bu': bu, 'bi': bi, 'nb_indptr': nb_indptr,
+              'nb_indices': nb_indices.astype(np.int32),
+              'nb_sims': nb_sims.astype(np.float32)}
+    arrays['user_raw'] = raw_ids(trainset, users=True)
+    arrays['item_raw'] = raw_ids(trainset, users=False)
+    arrays['user_order'] = np.argsort(arrays['user_raw'], kind='stable')
+    arrays['item_order'] = np.argsort(arrays['item_raw'], kind='stable')
+    arrays['ur_indptr'], arrays['ur_indices'], arrays['ur_ratings'] = \
+      to_csr(u, i, r, n_users)
+
+    self.meta = artifact_meta('item_knn', n_users, n_items, len(r), mu,
+                              trainset.rating_scale)
+    self.meta.update(k=self.k, min_k=self.min_k, sim=self.sim)
+    self.model = ModelArtifact(None, self.meta, arrays)
+    return self
+
+  def _neighbors(self, X):
+    n_items = X.shape[1]
+    block_size = self.block_size or max(1, 2**22 // n_items)
+    Xt = X.T.tocsr()
+    Xc = X.tocsc()
+    if self.sim == 'pearson_baseline':
+      B = X.copy()
+      B.data[:] = 1
+      Bt, Bc = B.T.tocsr(), B.tocsc()
+      X2 = X.multiply(X)
+      X2t, X2c = X2.T.tocsr(), X2.tocsc()
+    else:
+      norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0)).ravel())
+      norms[norms == 0] = 1
+
+    counts, indices, sims = [], [], []
+    for lo in range(0, n_items, block_size):
+      hi = min(lo + block_size, n_items)
+      # (n_items, hi - lo) similarities of every item with the block
+      prods = (Xt @ Xc[:, lo:hi]).toarray()
+      if self.sim == 'pearson_baseline':
+        support = (Bt @ Bc[:, lo:hi]).toarray()
+        sq_i = (X2t @ Bc[:, lo:hi]).toarray()
+        sq_j = (Bt @ X2c[:, lo:hi]).toarray()
+        denom = np.sqrt(sq_i * sq_j)
+        ok = (support >= self.min_support) & (denom > 0)
+        sim = np.where(ok, prods / np.where(ok, denom, 1), 0)
+        sim *= np.maximum(support - 1, 0) / \
+          np.maximum(support - 1 + self.shrinkage, 1e-12)
+      else:
+        sim = prods / norms[:, None] / norms[lo:hi]
+      block = _top_k(sim, self.k, lo)
+      for acc, arr in zip((counts, indices, sims), block):
+        acc.append(arr)
+      if self.verbose:
+        print(f'items {lo}-{hi} of {n_items}')
+    return (np.concatenate(counts), np.concatenate(indices),
+            np.concatenate(sims))
+
+  # Queries, answered by the fitted ModelArtifact
+  def predict(self, uids, iids, clip=True):
+    return self.model.predict(uids, iids, clip)
+
+  def similar_items(self, riid, n=10):
+    return self.model.similar_items(riid, n)
+
+  def top_n(self, uid, n=10, exclude_seen=True):
+    return self.model.top_n(uid, n, exclude_seen)
+
+  def save(self, path):
+    """Write the model as a model_io artifact; returns its version"""
+    arrays = {name: getattr(self.model, name) for name in
+              ('bu', 'bi', 'nb_indptr', 'nb_indices', 'nb_sims', 'user_raw',
+               'item_raw', 'user_order', 'item_order', 'ur_indptr',
+               'ur_indices', 'ur_ratings')}
+    write_artifact(path, self.meta, arrays)
+    return self.meta['version']
+
+
+if __name__ == '__main__':
+  from surprise import Dataset, Reader
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('--ratings', default=RATINGS_CSV)
+  parser.add_argument('--movies', default=MOVIES_CSV)
+  parser.add_argument('--sim', choices=['pearson_baseline', 'cosine'],
+                      default='pearson_baseline')
+  parser.add_argument('--k', type=int, default=40)
+  parser.add_argument('--shrinkage', type=float, default=100)
+  parser.add_argument('--save', help='directory to save the model to')
+  parser.add_argument('--like', type=int, nargs='*', default=[],
+                      help='movieIds to list similar movies for')
+  parser.add_argument('--n', type=int, default=10)
+  args = parser.parse_args()
+
+  df = pd.read_csv(args.ratings)
+  data = Dataset.load_from_df(df[['userId', 'movieId', 'rating']],
+                              Reader(rating_scale=(0.5, 5)))
+  algo = ItemKNN(k=args.k, sim=args.sim, shrinkage=args.shrinkage,
+                 verbose=True).fit(data.build_full_trainset())
+  if args.save:
+    print(f'model {algo.save(args.save)} saved to {args.save}')
+
+  titles = pd.read_csv(args.movies).set_index('movieId')['title']
+  for movie in args.like:
+    print(f'\nMovies like {titles.get(movie, movie)}:')
+    for iid, s in algo.similar_items(movie, args.n):
+      print(f'  {s:6.3f}  {titles.get(iid, iid)}')
@@ -0,0 +1,94 @@
+"""
+Load generator for serve.py
+
+Opens `concurrency` keep-alive connections, sends /predict or /topn requests
+for users and items drawn from the served model for `duration` seconds, and
+reports QPS and latency percentiles.
+
+  python3 loadgen.py models/mf --port 8080 --endpoint predict --concurrency 64
+"""
+import time
+import asyncio
+import itertools
+import argparse
+import numpy as np
+
+from model_io import load_model
+
+
+async def _worker(host, port, paths, deadline, latencies, errors):
+  reader, writer = await asyncio.open_connection(host, port)
+  try:
+    for path in itertools.cycle(paths):
+      if time.perf_counter() >= deadline:
+        break
+      start = time.perf_counter()
+      writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+      await writer.drain()
+      status = await reader.readline()
+      length = 0
+      while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+          break
+        if line.lower().startswith(b'content-length:'):
+          length = int(line.split(b':')[1])
+      await reader.readexactly(length)
+      latencies.append(time.perf_counter() - start)
+      if b' 200 ' not in status:
+        errors.append(status)
+  finally:
+    writer.close()
+
+
+def make_paths(model, endpoint, n, n_top=10, seed=42):
+  """n request paths with users and items drawn uniformly from the model"""
+  rng = np.random.default_rng(seed)
+  uids = model.user_raw[rng.integers(0, model.n_users, n)].tolist()
+  if endpoint == 'topn':
+    return [f'/topn?uid={uid}&n={n_top}' for uid in uids]
+  iids = model.item_raw[rng.integers(0, model.n_items, n)].tolist()
+  return [f'/predict?uid={uid}&iid={iid}' for uid, iid in zip(uids, iids)]
+
+
+async def run_load(host, port, paths_per_worker, duration):
+  """Run every worker until the deadline; returns (latencies, errors, secs)"""
+  latencies, errors = [], []
+  start = time.perf_counter()
+  deadline = start + duration
+  await asyncio.gather(*[_worker(host, port, paths, deadline, latencies,
+                                 errors) for paths in paths_per_worker])
+  return latencies, errors, time.perf_counter() - start
+
+
+def report(latencies, errors, elapsed):
+  lat_ms = 1000 * np.asarray(latencies)
+  print(f'requests: {len(latencies)}, errors: {len(errors)}, '
+        f'elapsed: {elapsed:.2f} s')
+  print(f'QPS: {len(latencies) / elapsed:.0f}')
+  if len(lat_ms):
+    print('latency p50: {:.2f} ms, p90: {:.2f} ms, p99: {:.2f} ms, '
+          'max: {:.2f} ms'.format(*np.percentile(lat_ms, [50, 90, 99]),
+                                   lat_ms.max()))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('model', help='artifact served by serve.py, used to '
+                      'draw valid user and item ids')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--endpoint', choices=['predict', 'topn'],
+                      default='predict')
+  parser.add_argument('--concurrency', type=int, default=64)
+  parser.add_argument('--duration', type=float, default=10.0)
+  parser.add_argument('--n', type=int, default=10, help='top-N list size')
+  args = parser.parse_args()
+
+  model = load_model(args.model)
+  # Every worker cycles through its own share of the request paths
+  paths = make_paths(model, args.endpoint, args.concurrency * 1000, args.n)
+  paths_per_worker = [paths[w::args.concurrency]
+                      for w in range(args.concurrency)]
+  report(*asyncio.run(run_load(args.host, args.port, paths_per_worker,
+                               args.duration)))
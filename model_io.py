@@ -0,0 +1,658 @@
+"""
+Memory-mapped model artifacts for the fitted models of project3.py
+
+A fitted model is written to a directory holding one .npy file per array and a
+small meta.json. The directory is <path>.v-<version> and path is a symlink to
+it, swapped atomically when a new version is written. Loading opens every
+array with np.load(mmap_mode='r'), so any number of worker processes share one
+copy of the model through the page cache and a load only costs a few file
+opens.
+
+Directory layout:
+  meta.json                          kind, version, global mean, rating scale..
+  user_raw.npy, item_raw.npy         raw id of every inner id
+  user_order.npy, item_order.npy     argsort of the raw ids (searchsorted maps)
+  ur_indptr.npy, ur_indices.npy,
+  ur_ratings.npy                     training ratings by user (CSR)
+
+  svd / nmf : pu.npy, qi.npy, bu.npy, bi.npy
+  naive     : user_mean.npy
+  knn       : user_mean.npy, ir_indptr.npy, ir_indices.npy, ir_ratings.npy
+              (training ratings by item, CSR) and nb_indptr.npy,
+              nb_indices.npy, nb_sims.npy (pruned neighbor lists, CSR, sorted
+              by decreasing similarity)
+  item_knn  : bu.npy, bi.npy (baselines) and nb_indptr.npy, nb_indices.npy,
+              nb_sims.npy (top-k similar items of every item, CSR, sorted by
+              decreasing similarity), written by item_knn.py
+
+svd / nmf artifacts written by quantize.py have meta['quantized'] set to
+'float16' or 'int8': pu.npy / qi.npy hold the quantized factors (int8 rows
+are multiplied by pu_scale.npy / qi_scale.npy), and the optional float32
+pu_exact.npy / qi_exact.npy re-rank the top meta['rerank'] * n candidates of
+top_n_batch. Only the candidate rows of the exact factors are read.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import numpy as np
+import scipy.sparse as sp
+
+from surprise import KNNWithMeans
+from surprise.prediction_algorithms.matrix_factorization import NMF, SVD
+
+META_FILE = 'meta.json'
+# Quantized item factors are converted to float32 this many rows at a time
+DEQUANT_BLOCK = 4096
+
+
+"""
+Helpers shared by the writer and the reader
+"""
+def raw_ids(trainset, users):
+  """Raw ids ordered by inner id, as a numpy array that can be mmapped"""
+  if hasattr(trainset, 'user_raw'):
+    raw = trainset.user_raw if users else trainset.item_raw
+  elif users:
+    raw = [trainset.to_raw_uid(u) for u in range(trainset.n_users)]
+  else:
+    raw = [trainset.to_raw_iid(i) for i in range(trainset.n_items)]
+  raw = np.asarray(raw)
+  if raw.dtype == object:
+    raise ValueError('raw ids must all be numbers or all be strings')
+  return raw
+
+
+def ratings_arrays(trainset):
+  """(inner uid, inner iid, rating) arrays of every training rating"""
+  if hasattr(trainset, 'ratings_arrays'):
+    return trainset.ratings_arrays()
+  n = trainset.n_ratings
+  u = np.empty(n, dtype=np.int32)
+  i = np.empty(n, dtype=np.int32)
+  r = np.empty(n, dtype=np.float32)
+  for j, (uid, iid, rating) in enumerate(trainset.all_ratings()):
+    u[j], i[j], r[j] = uid, iid, rating
+  return u, i, r
+
+
+def to_csr(rows, cols, vals, n_rows):
+  """Group (row, col, val) triplets by row; cols are sorted inside each row"""
+  order = np.lexsort((cols, rows))
+  indptr = np.zeros(n_rows + 1, dtype=np.int64)
+  np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+  return (indptr, np.ascontiguousarray(cols[order], dtype=np.int32),
+          np.ascontiguousarray(vals[order], dtype=np.float32))
+
+
+def _item_csr(trainset):
+  """Training ratings by item (CSR) keeping the rater order of trainset.ir"""
+  if hasattr(trainset, 'item_indptr'):
+    return trainset.item_indptr, trainset.item_users, trainset.item_ratings
+  indptr = np.zeros(trainset.n_items + 1, dtype=np.int64)
+  indices = np.empty(trainset.n_ratings, dtype=np.int32)
+  ratings = np.empty(trainset.n_ratings, dtype=np.float32)
+  for i in range(trainset.n_items):
+    row = trainset.ir[i]
+    lo = indptr[i]
+    indptr[i + 1] = lo + len(row)
+    for j, (u, r) in enumerate(row):
+      indices[lo + j], ratings[lo + j] = u, r
+  return indptr, indices, ratings
+
+
+def _knn_neighbors(algo, n_neighbors):
+  """Neighbor lists of every user, keeping only positive similarities
+
+  KNNWithMeans ignores neighbors whose similarity is not positive, so the
+  pruned lists give exactly the same predictions when n_neighbors is None.
+  With n_neighbors set only the n_neighbors most similar users are kept.
+  """
+  sim = algo.sim
+  indptr = np.zeros(sim.shape[0] + 1, dtype=np.int64)
+  indices, sims = [], []
+  for u in range(sim.shape[0]):
+    nbrs = np.flatnonzero(sim[u] > 0)
+    nbrs = nbrs[np.argsort(-sim[u, nbrs], kind='stable')]
+    if n_neighbors is not None:
+      nbrs = nbrs[:n_neighbors]
+    indices.append(nbrs.astype(np.int32))
+    sims.append(sim[u, nbrs])
+    indptr[u + 1] = indptr[u] + len(nbrs)
+  return indptr, np.concatenate(indices), np.concatenate(sims)
+
+
+def model_kind(algo):
+  """Name of the artifact format used for a fitted algorithm"""
+  if isinstance(algo, SVD):
+    return 'svd'
+  if isinstance(algo, NMF):
+    return 'nmf'
+  if isinstance(algo, KNNWithMeans):
+    if not algo.sim_options.get('user_based', True):
+      raise ValueError('only user based KNNWithMeans models can be saved')
+    return 'knn'
+  if hasattr(algo, '_m_uid'):
+    return 'naive'
+  raise ValueError(f'cannot save model of type {type(algo).__name__}')
+
+
+"""
+Writer
+"""
+def save_model(algo, path, n_neighbors=None):
+  """Write a fitted SVD / NMF / KNNWithMeans / NaiveCollabFilter to path
+
+  The directory is written next to path and path is switched to it in one
+  step (write_artifact), so readers never observe a half written or missing
+  model. Returns the version string of the new artifact.
+  """
+  kind = model_kind(algo)
+  trainset = algo.trainset
+  u, i, r = ratings_arrays(trainset)
+
+  arrays = dict()
+  arrays['user_raw'] = raw_ids(trainset, users=True)
+  arrays['item_raw'] = raw_ids(trainset, users=False)
+  arrays['user_order'] = np.argsort(arrays['user_raw'], kind='stable')
+  arrays['item_order'] = np.argsort(arrays['item_raw'], kind='stable')
+  arrays['ur_indptr'], arrays['ur_indices'], arrays['ur_ratings'] = \
+    to_csr(u, i, r, trainset.n_users)
+
+  meta = artifact_meta(kind, trainset.n_users, trainset.n_items,
+                       trainset.n_ratings, trainset.global_mean,
+                       trainset.rating_scale)
+
+  if kind in ('svd', 'nmf'):
+    meta['biased'] = bool(algo.biased)
+    arrays['pu'] = np.asarray(algo.pu)
+    arrays['qi'] = np.asarray(algo.qi)
+    # Surprise leaves the biases at zero when the model is not biased
+    arrays['bu'] = np.asarray(algo.bu, dtype=np.float64)
+    arrays['bi'] = np.asarray(algo.bi, dtype=np.float64)
+  elif kind == 'naive':
+    user_mean = np.zeros(trainset.n_users)
+    for uid, (m, _) in algo._m_uid.items():
+      user_mean[uid] = m
+    arrays['user_mean'] = user_mean
+  else:
+    meta['k'], meta['min_k'] = int(algo.k), int(algo.min_k)
+    arrays['user_mean'] = np.asarray(algo.means, dtype=np.float64)
+    arrays['ir_indptr'], arrays['ir_indices'], arrays['ir_ratings'] = \
+      _item_csr(trainset)
+    arrays['nb_indptr'], arrays['nb_indices'], arrays['nb_sims'] = \
+      _knn_neighbors(algo, n_neighbors)
+
+  write_artifact(path, meta, arrays)
+  return meta['version']
+
+
+def artifact_meta(kind, n_users, n_items, n_ratings, global_mean,
+                  rating_scale):
+  """meta.json fields shared by every kind of model, with a new version"""
+  return {
+    'kind': kind,
+    'version': uuid.uuid4().hex,
+    'created': time.time(),
+    'n_users': int(n_users),
+    'n_items': int(n_items),
+    'n_ratings': int(n_ratings),
+    'global_mean': float(global_mean),
+    'rating_scale': list(rating_scale),
+  }
+
+
+def version_dir(path, version=None):
+  """New directory for a version of the artifact (or store) at path"""
+  path = os.path.abspath(path.rstrip(os.sep))
+  return f'{path}.v-{version or uuid.uuid4().hex}'
+
+
+def write_artifact(path, meta, arrays):
+  """Write the arrays and meta to a new version directory and switch path
+  to it (replace_dir)"""
+  new_dir = version_dir(path, meta.get('version'))
+  os.makedirs(new_dir)
+  for name, arr in arrays.items():
+    np.save(os.path.join(new_dir, name + '.npy'), np.ascontiguousarray(arr))
+  with open(os.path.join(new_dir, META_FILE), 'w') as handle:
+    json.dump(meta, handle, indent=2)
+  replace_dir(path, new_dir)
+
+
+def _own_version(path, target):
+  return os.path.dirname(target) == os.path.dirname(path) and \
+    os.path.basename(target).startswith(os.path.basename(path) + '.v-')
+
+
+def replace_dir(path, new_dir):
+  """Atomically point the symlink path at the complete directory new_dir
+
+  The link is swapped with os.replace, so a reader opening path sees the old
+  or the new directory and never a missing one. The directory of the old
+  version is removed; processes that mapped its arrays keep reading them. A
+  plain directory at path (written before versioned directories) is moved
+  away first, the one non-atomic swap.
+  """
+  path = os.path.abspath(path.rstrip(os.sep))
+  old_dir = os.path.realpath(path) if os.path.islink(path) else None
+  link = f'{path}.link-{os.getpid()}'
+  # Relative target, so the parent directory can be moved or copied
+  os.symlink(os.path.basename(new_dir), link)
+  legacy_dir = None
+  if os.path.isdir(path) and not os.path.islink(path):
+    legacy_dir = f'{path}.old-{os.getpid()}'
+    os.rename(path, legacy_dir)
+  os.replace(link, path)
+  if legacy_dir:
+    shutil.rmtree(legacy_dir)
+  elif old_dir and _own_version(path, old_dir) and \
+      old_dir != os.path.realpath(new_dir):
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def remove_artifact(path):
+  """Remove the artifact (or store) at path and its version directory"""
+  path = os.path.abspath(path.rstrip(os.sep))
+  if os.path.islink(path):
+    target = os.path.realpath(path)
+    os.remove(path)
+    if _own_version(path, target):
+      shutil.rmtree(target, ignore_errors=True)
+  elif os.path.isdir(path):
+    shutil.rmtree(path)
+
+
+"""
+Reader
+"""
+def load_model(path, mmap=True):
+  """Open the artifact at path; arrays are memory mapped unless mmap=False"""
+  # Every file is read from the version path points to, so a version switched
+  # in meanwhile is never mixed in. Its directory may be removed before it is
+  # opened; the new version is read then.
+  for attempt in range(3):
+    version_path = os.path.realpath(path)
+    try:
+      with open(os.path.join(version_path, META_FILE)) as handle:
+        meta = json.load(handle)
+      arrays = dict()
+      for fname in os.listdir(version_path):
+        if fname.endswith('.npy'):
+          arrays[fname[:-4]] = np.load(os.path.join(version_path, fname),
+                                       mmap_mode='r' if mmap else None)
+      return ModelArtifact(path, meta, arrays)
+    except FileNotFoundError:
+      if attempt == 2 or os.path.realpath(path) == version_path:
+        raise
+
+
+def _to_float(ids):
+  """float64 array of ids; nan where an id is not a number"""
+  try:
+    return ids.astype(np.float64)
+  except ValueError:
+    out = np.full(ids.shape, np.nan)
+    for k, value in enumerate(ids.flat):
+      try:
+        out.flat[k] = float(value)
+      except ValueError:
+        pass
+    return out
+
+
+def lookup_ids(raw, order, ids):
+  """Vectorized raw -> inner id map; unknown ids map to -1
+
+  Ids looked up among integer raw ids must be integral: 1.5 is unknown, it
+  does not match 1. Ids that are not numbers are unknown among numbers.
+  """
+  ids = np.asarray(ids)
+  if len(raw) == 0:
+    return np.full(ids.shape, -1, dtype=np.int64)
+  known = np.ones(ids.shape, dtype=bool)
+  if raw.dtype.kind in 'iuf':
+    if ids.dtype.kind not in 'iu':
+      ids = _to_float(ids)
+      known = ~np.isnan(ids)
+      if raw.dtype.kind in 'iu':
+        known &= np.isfinite(ids) & (ids == np.round(ids))
+      ids = np.where(known, ids, 0)
+    ids = ids.astype(raw.dtype)
+  elif ids.dtype.kind != raw.dtype.kind:
+    ids = ids.astype(str)
+  sorted_raw = raw[order]
+  pos = np.searchsorted(sorted_raw, ids)
+  pos = np.minimum(pos, len(order) - 1)
+  found = known & (sorted_raw[pos] == ids)
+  return np.where(found, order[pos], -1).astype(np.int64)
+
+
+class ModelArtifact:
+  """Read-only view of a saved model
+
+  Every array attribute is a numpy memmap (or array when mmap=False). All
+  estimates follow the Surprise models they were saved from: impossible
+  predictions fall back to the global mean and estimates are clipped to the
+  rating scale unless clip=False. item_knn models fall back to the baseline
+  (global mean plus the biases that are known).
+  """
+  def __init__(self, path, meta, arrays):
+    self.path = path
+    self.meta = meta
+    self.kind = meta['kind']
+    self.version = meta['version']
+    self.n_users = meta['n_users']
+    self.n_items = meta['n_items']
+    self.global_mean = meta['global_mean']
+    self.rating_scale = tuple(meta['rating_scale'])
+    for name, arr in arrays.items():
+      setattr(self, name, arr)
+
+  # Id maps
+  def to_inner_uids(self, ruids):
+    return lookup_ids(self.user_raw, self.user_order, ruids)
+
+  def to_inner_iids(self, riids):
+    return lookup_ids(self.item_raw, self.item_order, riids)
+
+  def to_raw_iids(self, iiids):
+    return self.item_raw[np.asarray(iiids)]
+
+  def seen_items(self, u):
+    """Inner ids of the items rated by inner user u in the training set"""
+    return self.ur_indices[self.ur_indptr[u]:self.ur_indptr[u + 1]]
+
+  def _clip(self, est, clip):
+    if clip:
+      lower_bound, higher_bound = self.rating_scale
+      est = np.clip(est, lower_bound, higher_bound)
+    return est
+
+  # Pointwise estimates
+  def estimate(self, u, i, clip=True):
+    """Estimates for arrays of inner user and item ids (-1 means unknown)"""
+    u = np.atleast_1d(np.asarray(u, dtype=np.int64))
+    i = np.atleast_1d(np.asarray(i, dtype=np.int64))
+    known_u, known_i = u >= 0, i >= 0
+    uu, ii = np.where(known_u, u, 0), np.where(known_i, i, 0)
+
+    if self.kind in ('svd', 'nmf'):
+      both = known_u & known_i
+      dot = np.einsum('ij,ij->i', self._user_factors(uu),
+                      self._item_factors(ii))
+      if self.meta['biased']:
+        est = (self.global_mean + np.where(known_u, self.bu[uu], 0)
+               + np.where(known_i, self.bi[ii], 0) + np.where(both, dot, 0))
+      else:
+        est = np.where(both, dot, self.global_mean)
+    elif self.kind == 'naive':
+      est = np.where(known_u, self.user_mean[uu], 0)
+    elif self.kind == 'item_knn':
+      est = self._item_knn_estimate(u, i)
+    else:
+      est = np.array([self._knn_estimate(a, b) for a, b in zip(u, i)])
+    return self._clip(est, clip)
+
+  def predict(self, uids, iids, clip=True):
+    """Estimates for arrays of raw user and item ids"""
+    return self.estimate(self.to_inner_uids(uids), self.to_inner_iids(iids),
+                         clip)
+
+  # Factors of svd / nmf models, dequantized when needed
+  def _user_factors(self, us):
+    quantized = self.meta.get('quantized')
+    if quantized is None:
+      return self.pu[us]
+    pu = self.pu[us].astype(np.float32)
+    if quantized == 'int8':
+      pu *= self.pu_scale[us][..., None]
+    return pu
+
+  def _item_factors(self, iis):
+    quantized = self.meta.get('quantized')
+    if quantized is None:
+      return self.qi[iis]
+    qi = self.qi[iis].astype(np.float32)
+    if quantized == 'int8':
+      qi *= self.qi_scale[iis][..., None]
+    return qi
+
+  def _dot_items(self, P):
+    """P @ qi.T for rows of user factors P"""
+    if self.meta.get('quantized') is None:
+      return P @ self.qi.T
+    # The float32 copy of qi never exists as a whole
+    out = np.empty((len(P), self.n_items), dtype=np.float32)
+    for lo in range(0, self.n_items, DEQUANT_BLOCK):
+      hi = min(lo + DEQUANT_BLOCK, self.n_items)
+      out[:, lo:hi] = P @ self.qi[lo:hi].astype(np.float32).T
+    if self.meta['quantized'] == 'int8':
+      out *= self.qi_scale
+    return out
+
+  def _exact_scores(self, us, items):
+    """(len(us), items.shape[1]) estimates from the float32 exact factors"""
+    est = np.einsum('bk,bnk->bn', self.pu_exact[us],
+                    self.qi_exact[items]).astype(np.float64)
+    if self.meta['biased']:
+      est += self.global_mean + self.bu[us][:, None] + self.bi[items]
+    return self._clip(est, True)
+
+  def _knn_estimate(self, u, i):
+    if u < 0 or i < 0:
+      return self.global_mean
+    nbrs = self.nb_indices[self.nb_indptr[u]:self.nb_indptr[u + 1]]
+    sims = self.nb_sims[self.nb_indptr[u]:self.nb_indptr[u + 1]]
+    raters = self.ir_indices[self.ir_indptr[i]:self.ir_indptr[i + 1]]
+    ratings = self.ir_ratings[self.ir_indptr[i]:self.ir_indptr[i + 1]]
+    est = self.user_mean[u]
+    if len(raters) == 0 or len(nbrs) == 0:
+      return est
+
+    # Similarity of every rater of i; the stable sort breaks ties in rater
+    # order, like the heapq.nlargest call of KNNWithMeans
+    order = np.argsort(nbrs)
+    pos = np.minimum(np.searchsorted(nbrs[order], raters), len(nbrs) - 1)
+    s = np.where(nbrs[order][pos] == raters, sims[order][pos], 0)
+    sel = np.argsort(-s, kind='stable')[:self.meta['k']]
+    sel = sel[s[sel] > 0]
+    if len(sel) < self.meta['min_k']:
+      return est
+    dev = ratings[sel] - self.user_mean[raters[sel]]
+    return est + np.dot(s[sel], dev) / np.sum(s[sel])
+
+  def _ur_keys(self):
+    # u * n_items + i of every training rating, sorted since the items of a
+    # user are sorted: one searchsorted finds any (user, item) rating
+    if not hasattr(self, '_keys'):
+      users = np.repeat(np.arange(self.n_users, dtype=np.int64),
+                        np.diff(self.ur_indptr))
+      self._keys = users * self.n_items + self.ur_indices
+    return self._keys
+
+  def _item_knn_estimate(self, u, i):
+    # baseline + sum(s_ij * (r_uj - b_uj)) / sum(s_ij) over the neighbors j
+    # of i in the table that u rated
+    known_u, known_i = u >= 0, i >= 0
+    uu, ii = np.where(known_u, u, 0), np.where(known_i, i, 0)
+    est = (self.global_mean + np.where(known_u, self.bu[uu], 0) +
+           np.where(known_i, self.bi[ii], 0))
+
+    pairs = np.flatnonzero(known_u & known_i)
+    starts = self.nb_indptr[ii[pairs]]
+    lengths = self.nb_indptr[ii[pairs] + 1] - starts
+    pair = np.repeat(pairs, lengths)
+    flat = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+      np.arange(lengths.sum())
+    j, s, users = self.nb_indices[flat], self.nb_sims[flat], uu[pair]
+
+    keys = self._ur_keys()
+    if len(keys) == 0:
+      return est
+    key = users * self.n_items + j
+    pos = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+    hit = keys[pos] == key
+    pair, s, users, j, pos = pair[hit], s[hit], users[hit], j[hit], pos[hit]
+    dev = self.ur_ratings[pos] - (self.global_mean + self.bu[users] +
+                                  self.bi[j])
+
+    cnt = np.bincount(pair, minlength=len(u))
+    sum_sim = np.bincount(pair, weights=s, minlength=len(u))
+    sum_dev = np.bincount(pair, weights=s * dev, minlength=len(u))
+    ok = (cnt >= self.meta['min_k']) & (sum_sim > 0)
+    return est + np.where(ok, sum_dev / np.where(ok, sum_sim, 1), 0)
+
+  def _item_knn_score_user(self, u):
+    # Same sums as _item_knn_estimate for every item, as sparse products of
+    # the neighbor table with the deviations of the user
+    if u < 0:
+      return self.global_mean + self.bi
+    if not hasattr(self, '_nb_matrix'):
+      shape = (self.n_items, self.n_items)
+      self._nb_matrix = sp.csr_matrix(
+        (self.nb_sims, self.nb_indices, self.nb_indptr), shape=shape)
+      self._nb_support = sp.csr_matrix(
+        (np.ones(len(self.nb_indices)), self.nb_indices, self.nb_indptr),
+        shape=shape)
+    items = self.seen_items(u)
+    baseline = self.global_mean + self.bu[u] + self.bi
+    rated = np.zeros(self.n_items)
+    rated[items] = 1
+    dev = np.zeros(self.n_items)
+    dev[items] = self.ur_ratings[self.ur_indptr[u]:self.ur_indptr[u + 1]] - \
+      baseline[items]
+
+    cnt = self._nb_support @ rated
+    sum_sim = self._nb_matrix @ rated
+    sum_dev = self._nb_matrix @ dev
+    ok = (cnt >= self.meta['min_k']) & (sum_sim > 0)
+    return baseline + np.where(ok, sum_dev / np.where(ok, sum_sim, 1), 0)
+
+  def similar_items(self, riid, n=10):
+    """[(raw iid, similarity)] of the n items most similar to raw item riid"""
+    if self.kind != 'item_knn':
+      raise ValueError(f'{self.kind} models have no item neighbors')
+    i = self.to_inner_iids([riid])[0]
+    if i < 0:
+      raise ValueError(f'unknown item {riid}')
+    lo = self.nb_indptr[i]
+    hi = min(self.nb_indptr[i + 1], lo + n)
+    return list(zip(self.to_raw_iids(self.nb_indices[lo:hi]).tolist(),
+                    self.nb_sims[lo:hi].tolist()))
+
+  # Full catalog scores
+  def score_user(self, u, clip=True):
+    """Estimates of every item for inner user u (-1 means unknown)"""
+    if self.kind in ('svd', 'nmf'):
+      if u < 0 and self.meta['biased']:
+        est = self.global_mean + self.bi
+      elif u < 0:
+        est = np.full(self.n_items, self.global_mean)
+      else:
+        est = self._dot_items(self._user_factors(np.array([u])))[0]
+        if self.meta['biased']:
+          est = est + (self.global_mean + self.bu[u]) + self.bi
+    elif self.kind == 'naive':
+      est = np.full(self.n_items, self.user_mean[u] if u >= 0 else 0.0)
+    elif self.kind == 'item_knn':
+      est = self._item_knn_score_user(u)
+    else:
+      est = self._knn_score_user(u)
+    return self._clip(np.asarray(est, dtype=np.float64), clip)
+
+  def _knn_score_user(self, u):
+    # Equal to estimate() for every item, except that similarity ties at the
+    # k-th neighbor are broken by user id instead of rater order
+    if u < 0:
+      return np.full(self.n_items, self.global_mean)
+    lo, hi = self.nb_indptr[u], self.nb_indptr[u + 1]
+    nbrs, sims = self.nb_indices[lo:hi], self.nb_sims[lo:hi]
+
+    # Items rated by every neighbor, tagged with the neighbor's rank
+    starts, ends = self.ur_indptr[nbrs], self.ur_indptr[nbrs + 1]
+    lengths = ends - starts
+    rank = np.repeat(np.arange(len(nbrs)), lengths)
+    flat = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+      np.arange(lengths.sum())
+    items = self.ur_indices[flat]
+    dev = self.ur_ratings[flat] - self.user_mean[nbrs][rank]
+
+    # Keep the k most similar raters of every item
+    order = np.lexsort((rank, items))
+    items, rank, dev = items[order], rank[order], dev[order]
+    group_start = np.r_[0, np.flatnonzero(np.diff(items)) + 1]
+    pos_in_group = np.arange(len(items)) - np.repeat(
+      group_start, np.diff(np.r_[group_start, len(items)]))
+    keep = pos_in_group < self.meta['k']
+    items, s, dev = items[keep], sims[rank[keep]], dev[keep]
+
+    cnt = np.bincount(items, minlength=self.n_items)
+    sum_sim = np.bincount(items, weights=s, minlength=self.n_items)
+    sum_ratings = np.bincount(items, weights=s * dev, minlength=self.n_items)
+    ok = (cnt >= self.meta['min_k']) & (sum_sim > 0)
+    return self.user_mean[u] + np.where(ok, sum_ratings /
+                                        np.where(ok, sum_sim, 1), 0)
+
+  def score_users(self, us, clip=True):
+    """(len(us), n_items) estimates for an array of inner user ids"""
+    us = np.asarray(us, dtype=np.int64)
+    if self.kind not in ('svd', 'nmf'):
+      return np.array([self.score_user(u, clip) for u in us]).reshape(
+        len(us), self.n_items)
+    known = us >= 0
+    est = self._dot_items(self._user_factors(np.where(known, us, 0)))
+    if self.meta['biased']:
+      est += np.where(known, self.bu[np.where(known, us, 0)], 0)[:, None]
+      est += self.global_mean + self.bi
+      est[~known] = self.global_mean + self.bi
+    else:
+      est[~known] = self.global_mean
+    return self._clip(est, clip)
+
+  def top_n_batch(self, uids, n=10, exclude_seen=True, rerank=None):
+    """top_n for a list of raw user ids, scored as one matrix product
+
+    Quantized models with exact factors pick the top rerank * n candidates
+    (default meta['rerank']) and re-score them exactly; rerank=0 keeps the
+    approximate scores.
+    """
+    us = self.to_inner_uids(uids)
+    scores = self.score_users(us)
+    if exclude_seen:
+      for row, u in enumerate(us):
+        if u >= 0:
+          scores[row, self.seen_items(u)] = -np.inf
+    if rerank is None:
+      rerank = self.meta.get('rerank', 0)
+    n = min(n, self.n_items)
+    n_cand = min(n * rerank, self.n_items) if hasattr(self, 'qi_exact') \
+      else 0
+    if n_cand > n:
+      top = np.argpartition(-scores, n_cand - 1, axis=1)[:, :n_cand]
+      exact = self._exact_scores(np.maximum(us, 0), top)
+      known = us >= 0
+      # Unknown users are scored by the biases only: keep their scores
+      exact[~known] = np.take_along_axis(scores[~known], top[~known], axis=1)
+      exact[~np.isfinite(np.take_along_axis(scores, top, axis=1))] = -np.inf
+      best = np.argpartition(-exact, n - 1, axis=1)[:, :n]
+      top = np.take_along_axis(top, best, axis=1)
+      top_scores = np.take_along_axis(exact, best, axis=1)
+    else:
+      top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+      top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    results = []
+    for items, est in zip(top, top_scores):
+      ok = np.isfinite(est)
+      results.append(list(zip(self.to_raw_iids(items[ok]).tolist(),
+                              est[ok].tolist())))
+    return results
+
+  def top_n(self, uid, n=10, exclude_seen=True):
+    """[(raw iid, est)] of the n best items for raw user uid"""
+    return self.top_n_batch([uid], n, exclude_seen)[0]
@@ -9,7 +9,6 @@ http://files.grouplens.org/datasets/movielens/ml-latest-small.zip
 import os
 import pdb
 import pickle
-import bisect  # use to keep a sorted list
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -18,19 +17,39 @@ import random
 np.random.seed(42)
 random.seed(42)
 
-from surprise import KNNBasic, AlgoBase
+from surprise import KNNBasic
 from surprise.prediction_algorithms.matrix_factorization import NMF, SVD
 from surprise.prediction_algorithms.baseline_only import BaselineOnly
 from surprise.model_selection import cross_validate, KFold, train_test_split
 from surprise import Dataset, Reader, KNNWithMeans, accuracy
 from sklearn.metrics import roc_curve, auc
 from collections import defaultdict
+from model_io import save_model
+from instrument import Tracer
+from compact_trainset import split_folds
+from search import successive_halving, print_search
+from baseline import BaselineALS
+from cf_utils import build_rating_matrix, movie_rating_stats, popular_movies
+from cf_utils import high_variance_movies, NaiveCollabFilter
+from cf_utils import calc_precision_recall
 
 """
 Constants
 """
 PLOT_RESULT = True
 USE_PICKLED_RESULTS = True
+SAVE_MODELS = False  # write the fitted Q34 models as memory-mapped artifacts
+MODEL_DIR = './models'
+TRACE_PREFIX = './trace'  # stage timings: trace.jsonl and trace.chrome.json
+TRACE_MEMORY = False  # tracemalloc peaks: a separate, 5-8x slower pass
+USE_COMPACT_TRAINSET = False  # array-backed trainsets, ~8x less memory
+HALVING_SEARCH = False  # also pick k / n_factors by successive halving
+
+tracer = Tracer(TRACE_PREFIX, memory=TRACE_MEMORY)
+
+def folds(kf, data):
+  """kf.split(data), with CompactTrainset trainsets if USE_COMPACT_TRAINSET"""
+  return split_folds(kf, data, compact=USE_COMPACT_TRAINSET)
 
 """
 Loading data, computing rating matrix R
@@ -48,16 +67,7 @@ movies = df['movieId'].unique()
 users = df['userId'].unique()
 
 print(f"Dataset has {movies.shape[0]} movies & {users.shape[0]} users")
-movies_map = dict()
-movies_inv_map = dict()
-for (i, Id) in enumerate(movies):
-  movies_map[Id] = i 
-  movies_inv_map[i] = Id
-
-R = np.zeros([users.shape[0], movies.shape[0]])
-
-for idx, row in df.iterrows():
-  R[int(row['userId']-1)][movies_map[row['movieId']]] =  row['rating']
+R, movies_map, movies_inv_map = build_rating_matrix(df)
 
 print(R)
 
@@ -147,6 +157,13 @@ sim_options = {
 k_values = range(2,101,2)
 results = []
 
+if HALVING_SEARCH:
+  search = successive_halving(
+    lambda k: KNNWithMeans(k=k, sim_options=sim_options, verbose=False),
+    k_values, data, compact=USE_COMPACT_TRAINSET, tracer=tracer,
+    model='knn_search')
+  print_search(search, 'k')
+
 if USE_PICKLED_RESULTS == True:
   with open('knn.pickle', 'rb') as handle:
     results = pickle.load(handle)
@@ -154,8 +171,9 @@ else:
   for k in k_values:
     print('\nk = {0:d}'.format(k))
     algo = KNNWithMeans(k=k, sim_options=sim_options)
-    results.append(cross_validate(algo, data, measures=['RMSE', 'MAE'], cv=10,
-                                verbose=True, n_jobs=-1))
+    with tracer.stage('cross_validate', model='knn', param=k):
+      results.append(cross_validate(algo, data, measures=['RMSE', 'MAE'],
+                                    cv=10, verbose=True, n_jobs=-1))
   # Pickle results
   with open('knn.pickle', 'wb') as handle:
     pickle.dump(results, handle)
@@ -192,24 +210,11 @@ if PLOT_RESULT:
 """
 Question 12: k-NN on popular movies
 """
-# Create a dict where each movieId is a key and the values are a list
-# of all the ratings for the movieId
-ratings = {}
-for row in data.raw_ratings:
-  # if movieId not in dict, add it
-  if row[1] not in ratings:
-    ratings[row[1]] = []
-
-  # Add ratings to movieId list
-  ratings[row[1]].append(row[2])
-
-# Create dictionary with rating variance for each movieId
-variances = {}
-for movieId in ratings:
-  variances[movieId] = np.var(ratings[movieId])
+# All ratings and the rating variance of each movieId
+ratings, variances = movie_rating_stats(data.raw_ratings)
 
 # Create list with movies with more than 2 ratings
-pop_movies = [movie for movie in ratings if len(ratings[movie]) > 2]
+pop_movies = popular_movies(ratings)
 
 # Train/test using cross-validation iterators
 kf = KFold(n_splits=10)
@@ -223,18 +228,24 @@ else:
   # Iterate over all k values and calculate RMSE for each
   for k in k_values:
     algo = KNNWithMeans(k=k, sim_options=sim_options)
-    for counter, [trainset, testset] in enumerate(kf.split(data)):
+    for counter, [trainset, testset] in enumerate(tracer.iterate(
+        'split', folds(kf, data), model='knn_pop', param=k)):
+      tags = dict(model='knn_pop', param=k, fold=counter)
       print('\nk = {0:d}, fold = {1:d}'.format(k, counter+1))
 
       # Train algorithm with 9 unmodified trainsets
-      algo.fit(trainset)
+      with tracer.stage('fit', **tags):
+        algo.fit(trainset)
 
       # Test with trimmed test set
-      trimmed_testset = [x for x in testset if x[1] in pop_movies]
-      predictions = algo.test(trimmed_testset)
+      with tracer.stage('trim', **tags):
+        trimmed_testset = [x for x in testset if x[1] in pop_movies]
+      with tracer.stage('test', **tags):
+        predictions = algo.test(trimmed_testset)
 
       # Compute and print Root Mean Squared Error (RMSE) for each fold
-      k_rmse += accuracy.rmse(predictions, verbose=True)
+      with tracer.stage('metrics', **tags):
+        k_rmse += accuracy.rmse(predictions, verbose=True)
 
     #Compute mean of all rsme values for each k
     print('Mean RMSE for 10 folds: ', k_rmse/(counter+1))
@@ -268,18 +279,24 @@ if USE_PICKLED_RESULTS == True:
 else:
   for k in k_values:
     algo = KNNWithMeans(k=k, sim_options=sim_options)
-    for counter, [trainset, testset] in enumerate(kf.split(data)):
+    for counter, [trainset, testset] in enumerate(tracer.iterate(
+        'split', folds(kf, data), model='knn_unpop', param=k)):
+      tags = dict(model='knn_unpop', param=k, fold=counter)
       print('\nk = {0:d}, fold = {1:d}'.format(k, counter+1))
 
       # Train algorithm with 9 unmodified trainset
-      algo.fit(trainset)
+      with tracer.stage('fit', **tags):
+        algo.fit(trainset)
 
       # Test with trimmed test set
-      trimmed_testset = [x for x in testset if x[1] not in pop_movies]
-      predictions = algo.test(trimmed_testset)
+      with tracer.stage('trim', **tags):
+        trimmed_testset = [x for x in testset if x[1] not in pop_movies]
+      with tracer.stage('test', **tags):
+        predictions = algo.test(trimmed_testset)
 
       # Compute and print Root Mean Squared Error (RMSE) for each fold
-      k_rmse += accuracy.rmse(predictions, verbose=True)
+      with tracer.stage('metrics', **tags):
+        k_rmse += accuracy.rmse(predictions, verbose=True)
 
     #Compute mean of all rsme values for each k
     print('Mean RMSE for 10 folds: ', k_rmse/(counter+1))
@@ -307,8 +324,7 @@ Question 14: Trimmed test set - movies with more than 5 ratings and variance hig
 than 2.
 """
 # Create list with high_variance movies
-high_var_movies = [movieId for movieId in ratings if len(ratings[movieId]) >=5
-                   and variances[movieId] >= 2]
+high_var_movies = high_variance_movies(ratings, variances)
 
 # Empty list to store rmse for each k
 rmse_high_var = []
@@ -323,18 +339,24 @@ if USE_PICKLED_RESULTS == True:
 else:
   for k in k_values:
     algo = KNNWithMeans(k=k, sim_options=sim_options)
-    for counter, [trainset, testset] in enumerate(kf.split(data)):
+    for counter, [trainset, testset] in enumerate(tracer.iterate(
+        'split', folds(kf, data), model='knn_high_var', param=k)):
+      tags = dict(model='knn_high_var', param=k, fold=counter)
       print('\nk = {0:d}, fold = {1:d}'.format(k, counter+1))
 
       # Train algorithm with 9 unmodified trainset
-      algo.fit(trainset)
+      with tracer.stage('fit', **tags):
+        algo.fit(trainset)
 
       # Test with trimmed test set
-      trimmed_testset = [x for x in testset if x[1] in high_var_movies]
-      predictions = algo.test(trimmed_testset)
+      with tracer.stage('trim', **tags):
+        trimmed_testset = [x for x in testset if x[1] in high_var_movies]
+      with tracer.stage('test', **tags):
+        predictions = algo.test(trimmed_testset)
 
       # Compute and print Root Mean Squared Error (RMSE) for each fold
-      k_rmse += accuracy.rmse(predictions, verbose=True)
+      with tracer.stage('metrics', **tags):
+        k_rmse += accuracy.rmse(predictions, verbose=True)
 
     # Compute mean of all rsme values for each k
     print('Mean RMSE for 10 folds: ', k_rmse/(counter+1))
@@ -407,13 +429,24 @@ rmse, mae = 0, 0
 kf_rmse, kf_mae = [], []
 
 k_values = range(2,51,2)
+if HALVING_SEARCH:
+  search = successive_halving(lambda k: NMF(n_factors=k), k_values, data,
+                              compact=USE_COMPACT_TRAINSET, tracer=tracer,
+                              model='nmf_search')
+  print_search(search, 'n_factors')
+
 for k in k_values:
   algo = NMF(n_factors=k)
-  for trainset, testset in kf.split(data):
-    algo.fit(trainset)
-    pred = algo.test(testset)
-    rmse += accuracy.rmse(pred)
-    mae += accuracy.mae(pred)
+  for counter, [trainset, testset] in enumerate(tracer.iterate(
+      'split', folds(kf, data), model='nmf', param=k)):
+    tags = dict(model='nmf', param=k, fold=counter)
+    with tracer.stage('fit', **tags):
+      algo.fit(trainset)
+    with tracer.stage('test', **tags):
+      pred = algo.test(testset)
+    with tracer.stage('metrics', **tags):
+      rmse += accuracy.rmse(pred)
+      mae += accuracy.mae(pred)
   kf_rmse.append(rmse / kf.n_splits)
   kf_mae.append(mae / kf.n_splits)
   rmse, mae = 0, 0
@@ -458,18 +491,24 @@ rmse_pop = []
 # Iterate over all k values and calculate RMSE for each
 for k in k_values:
   algo = NMF(n_factors=k)
-  for counter, [trainset, testset] in enumerate(kf.split(data)):
+  for counter, [trainset, testset] in enumerate(tracer.iterate(
+      'split', folds(kf, data), model='nmf_pop', param=k)):
+    tags = dict(model='nmf_pop', param=k, fold=counter)
     print('\nk = {0:d}, fold = {1:d}'.format(k, counter+1))
 
     # Train algorithm with 9 unmodified trainsets
-    algo.fit(trainset)
+    with tracer.stage('fit', **tags):
+      algo.fit(trainset)
 
     # Test with trimmed test set
-    trimmed_testset = [x for x in testset if x[1] in pop_movies]
-    predictions = algo.test(trimmed_testset)
+    with tracer.stage('trim', **tags):
+      trimmed_testset = [x for x in testset if x[1] in pop_movies]
+    with tracer.stage('test', **tags):
+      predictions = algo.test(trimmed_testset)
 
     # Compute and print Root Mean Squared Error (RMSE) for each fold
-    k_rmse += accuracy.rmse(predictions, verbose=True)
+    with tracer.stage('metrics', **tags):
+      k_rmse += accuracy.rmse(predictions, verbose=True)
 
   #Compute mean of all rmse values for each k
   print('Mean RMSE for 10 folds: ', k_rmse/(counter+1))
@@ -498,18 +537,24 @@ rmse_unpop = []
 for k in k_values:
     algo = NMF(n_factors=k, biased=False)
 
-    for counter, [trainset, testset] in enumerate(kf.split(data)):
+    for counter, [trainset, testset] in enumerate(tracer.iterate(
+        'split', folds(kf, data), model='nmf_unpop', param=k)):
+      tags = dict(model='nmf_unpop', param=k, fold=counter)
       print('\nk = {0:d}, fold = {1:d}'.format(k, counter+1))
 
       # Train algorithm with 9 unmodified trainset
-      algo.fit(trainset)
+      with tracer.stage('fit', **tags):
+        algo.fit(trainset)
 
       # Test with unpopular movie trimmed test set
-      trimmed_testset = [x for x in testset if x[1] not in pop_movies]
-      predictions = algo.test(trimmed_testset)
+      with tracer.stage('trim', **tags):
+        trimmed_testset = [x for x in testset if x[1] not in pop_movies]
+      with tracer.stage('test', **tags):
+        predictions = algo.test(trimmed_testset)
 
       # Compute and print Root Mean Squared Error (RMSE) for each fold
-      k_rmse += accuracy.rmse(predictions, verbose=True)
+      with tracer.stage('metrics', **tags):
+        k_rmse += accuracy.rmse(predictions, verbose=True)
 
     #Compute mean of all rsme values for each k
     print('Mean RMSE for 10 folds: ', k_rmse/(counter+1))
@@ -535,18 +580,24 @@ k_rmse = 0
 
 for k in k_values:
     algo = NMF(n_factors=k, biased=False)
-    for counter, [trainset, testset] in enumerate(kf.split(data)):
+    for counter, [trainset, testset] in enumerate(tracer.iterate(
+        'split', folds(kf, data), model='nmf_high_var', param=k)):
+      tags = dict(model='nmf_high_var', param=k, fold=counter)
       print('\nk = {0:d}, fold = {1:d}'.format(k, counter+1))
 
       # Train algorithm with 9 unmodified trainset
-      algo.fit(trainset)
+      with tracer.stage('fit', **tags):
+        algo.fit(trainset)
 
       # Test with trimmed test set
-      trimmed_testset = [x for x in testset if x[1] in high_var_movies]
-      predictions = algo.test(trimmed_testset)
+      with tracer.stage('trim', **tags):
+        trimmed_testset = [x for x in testset if x[1] in high_var_movies]
+      with tracer.stage('test', **tags):
+        predictions = algo.test(trimmed_testset)
 
       # Compute and print Root Mean Squared Error (RMSE) for each fold
-      k_rmse += accuracy.rmse(predictions, verbose=True)
+      with tracer.stage('metrics', **tags):
+        k_rmse += accuracy.rmse(predictions, verbose=True)
 
     # Compute mean of all rsme values for each k
     print('Mean RMSE for 10 folds: ', k_rmse/(counter+1))
@@ -641,6 +692,12 @@ k_rmse, k_mae, k_pop_rmse, k_unpop_rmse, k_high_var_rmse = 0, 0, 0, 0, 0
 kf_rmse, kf_mae, rmse_pop, rmse_unpop, rmse_high_var = [], [], [], [], []
 k_values = range(2, 51, 2)
 
+if HALVING_SEARCH:
+  search = successive_halving(lambda k: SVD(n_factors=k, random_state=42),
+                              k_values, data, compact=USE_COMPACT_TRAINSET,
+                              tracer=tracer, model='svd_search')
+  print_search(search, 'n_factors')
+
 if USE_PICKLED_RESULTS and os.path.isfile('mf_bias_rmse.pickle') and os.path.isfile('mf_bias_high_var_rmse.pickle'):
   with open('mf_bias_rmse.pickle', 'rb') as handle:
     kf_rmse = pickle.load(handle)
@@ -655,24 +712,38 @@ if USE_PICKLED_RESULTS and os.path.isfile('mf_bias_rmse.pickle') and os.path.isf
 else:
   for k in k_values:
     algo = SVD(n_factors=k, random_state=42)
-    for counter, [trainset, testset] in enumerate(kf.split(data)):
+    for counter, [trainset, testset] in enumerate(tracer.iterate(
+        'split', folds(kf, data), model='svd', param=k)):
+      tags = dict(model='svd', param=k, fold=counter)
       print('\nk = {0:d}, fold = {1:d}'.format(k, counter + 1))
-      algo.fit(trainset)
-      pred = algo.test(testset)
-      k_rmse += accuracy.rmse(pred)
-      k_mae += accuracy.mae(pred)
-
-      pop_testset = [x for x in testset if x[1] in pop_movies]
-      pop_pred = algo.test(pop_testset)
-      k_pop_rmse += accuracy.rmse(pop_pred)
-
-      unpop_testset = [x for x in testset if x[1] not in pop_movies]
-      unpop_pred = algo.test(unpop_testset)
-      k_unpop_rmse += accuracy.rmse(unpop_pred)
-
-      high_var_testset = [x for x in testset if x[1] in high_var_movies]
-      high_var_pred = algo.test(high_var_testset)
-      k_high_var_rmse += accuracy.rmse(high_var_pred)
+      with tracer.stage('fit', **tags):
+        algo.fit(trainset)
+      with tracer.stage('test', **tags):
+        pred = algo.test(testset)
+      with tracer.stage('metrics', **tags):
+        k_rmse += accuracy.rmse(pred)
+        k_mae += accuracy.mae(pred)
+
+      with tracer.stage('trim', **tags):
+        pop_testset = [x for x in testset if x[1] in pop_movies]
+      with tracer.stage('test', **tags):
+        pop_pred = algo.test(pop_testset)
+      with tracer.stage('metrics', **tags):
+        k_pop_rmse += accuracy.rmse(pop_pred)
+
+      with tracer.stage('trim', **tags):
+        unpop_testset = [x for x in testset if x[1] not in pop_movies]
+      with tracer.stage('test', **tags):
+        unpop_pred = algo.test(unpop_testset)
+      with tracer.stage('metrics', **tags):
+        k_unpop_rmse += accuracy.rmse(unpop_pred)
+
+      with tracer.stage('trim', **tags):
+        high_var_testset = [x for x in testset if x[1] in high_var_movies]
+      with tracer.stage('test', **tags):
+        high_var_pred = algo.test(high_var_testset)
+      with tracer.stage('metrics', **tags):
+        k_high_var_rmse += accuracy.rmse(high_var_pred)
 
     kf_rmse.append(k_rmse / kf.n_splits)
     kf_mae.append(k_mae / kf.n_splits)
@@ -762,66 +833,86 @@ Question 30: Naive Collaborative Filtering
 
 rij_hat = mean(u_j)
 """
-class NaiveCollabFilter(AlgoBase):
-  def __init__(self):
-    AlgoBase.__init__(self)
-    self._m_uid = dict()
-
-  def fit(self, trainset):
-    AlgoBase.fit(self, trainset)
-    self._m_uid.clear()
-    for uid, iid, rating in self.trainset.all_ratings():
-      if uid in self._m_uid:
-        m = self._m_uid[uid][0]
-        n = self._m_uid[uid][1] + 1
-        m += (rating - m) / n
-        self._m_uid[uid] = (m, n)
-      else:
-        self._m_uid[uid] = (rating, 1)
-
-  def estimate(self, u, i):
-    return self._m_uid[u][0] if u in self._m_uid else 0
-
 algo = NaiveCollabFilter()
 algo.fit(data.build_full_trainset())
 
 kf = KFold(n_splits=10)
 kf_rmse = []
-for _, testset in kf.split(data):
-  pred = algo.test(testset)
-  kf_rmse.append(accuracy.rmse(pred, verbose=True))
+for counter, [_, testset] in enumerate(tracer.iterate(
+    'split', folds(kf, data), model='naive')):
+  tags = dict(model='naive', fold=counter)
+  with tracer.stage('test', **tags):
+    pred = algo.test(testset)
+  with tracer.stage('metrics', **tags):
+    kf_rmse.append(accuracy.rmse(pred, verbose=True))
 print('Naive Collab Fillter RMSE for 10 folds CV: ', np.mean(kf_rmse))
 
 """
 Question 31:
 """
 kf_rmse = []
-for _, testset in kf.split(data):
-  trimmed_testset = [x for x in testset if x[1] in pop_movies]
-  pred = algo.test(trimmed_testset)
-  kf_rmse.append(accuracy.rmse(pred, verbose=True))
+for counter, [_, testset] in enumerate(tracer.iterate(
+    'split', folds(kf, data), model='naive_pop')):
+  tags = dict(model='naive_pop', fold=counter)
+  with tracer.stage('trim', **tags):
+    trimmed_testset = [x for x in testset if x[1] in pop_movies]
+  with tracer.stage('test', **tags):
+    pred = algo.test(trimmed_testset)
+  with tracer.stage('metrics', **tags):
+    kf_rmse.append(accuracy.rmse(pred, verbose=True))
 print('Naive Collab Fillter RMSE for 10 folds CV (popular testset): ', np.mean(kf_rmse))
 
 """
 Question 32:
 """
 kf_rmse = []
-for _, testset in kf.split(data):
-  trimmed_testset = [x for x in testset if x[1] not in pop_movies]
-  pred = algo.test(trimmed_testset)
-  kf_rmse.append(accuracy.rmse(pred, verbose=True))
+for counter, [_, testset] in enumerate(tracer.iterate(
+    'split', folds(kf, data), model='naive_unpop')):
+  tags = dict(model='naive_unpop', fold=counter)
+  with tracer.stage('trim', **tags):
+    trimmed_testset = [x for x in testset if x[1] not in pop_movies]
+  with tracer.stage('test', **tags):
+    pred = algo.test(trimmed_testset)
+  with tracer.stage('metrics', **tags):
+    kf_rmse.append(accuracy.rmse(pred, verbose=True))
 print('Naive Collab Fillter RMSE for 10 folds CV (not popular testset): ', np.mean(kf_rmse))
 
 """
 Question 33:
 """
 kf_rmse = []
-for _, testset in kf.split(data):
-  trimmed_testset = [x for x in testset if x[1] in high_var_movies]
-  pred = algo.test(trimmed_testset)
-  kf_rmse.append(accuracy.rmse(pred, verbose=True))
+for counter, [_, testset] in enumerate(tracer.iterate(
+    'split', folds(kf, data), model='naive_high_var')):
+  tags = dict(model='naive_high_var', fold=counter)
+  with tracer.stage('trim', **tags):
+    trimmed_testset = [x for x in testset if x[1] in high_var_movies]
+  with tracer.stage('test', **tags):
+    pred = algo.test(trimmed_testset)
+  with tracer.stage('metrics', **tags):
+    kf_rmse.append(accuracy.rmse(pred, verbose=True))
 print('Naive Collab Fillter RMSE for 10 folds CV (high var testset): ', np.mean(kf_rmse))
 
+"""
+Baseline estimator
+
+rij_hat = mu + b_i + b_j, regularized biases fitted by ALS on each fold
+"""
+unpop_movies = set(ratings) - set(pop_movies)
+slices = {'all': None, 'popular': pop_movies, 'not popular': unpop_movies,
+          'high var': high_var_movies}
+baseline_rmse = defaultdict(list)
+for counter, [trainset, testset] in enumerate(tracer.iterate(
+    'split', folds(kf, data), model='baseline')):
+  tags = dict(model='baseline', fold=counter)
+  with tracer.stage('fit', **tags):
+    algo = BaselineALS().fit(trainset)
+  with tracer.stage('test', **tags):
+    for name, rmse in algo.evaluate_slices(testset, slices).items():
+      baseline_rmse[name].append(rmse)
+for name in slices:
+  print('Baseline RMSE for 10 folds CV ({} testset): '.format(name),
+        np.nanmean(baseline_rmse[name]))
+
 """
 Question 34
 Plot the ROC curves (threshold = 3) for the k-NN, NNMF, and
@@ -853,6 +944,8 @@ for name, algo in algos:
   roc_auc = auc(fpr, tpr)
   label =  name + ' ROC curve (area = %0.2f)' % roc_auc
   plt.plot(fpr, tpr, label=label)
+  if SAVE_MODELS:
+    save_model(algo, os.path.join(MODEL_DIR, name.lower()))
 
 plt.plot([0, 1], [0, 1], color='navy', linestyle='--')
 plt.xlim([0.0, 1.0])
@@ -871,23 +964,6 @@ against t (X-axis) and average precision (Y-axis) against average
 recall (X-axis). Use the k found in question 11 and sweep t from 1 to 25 in step
 sizes of 1. For each plot, briefly comment on the shape of the plot.
 """
-def calc_precision_recall(pred, t, threshold=3.0):
-  user_ratings = defaultdict(list)
-  for uid,_,r_ui, est, _ in pred:
-    bisect.insort(user_ratings[uid], (est, r_ui))
-
-  precision, recall  = dict(), dict()
-  for uid, ratings in user_ratings.items():
-    if len(ratings) < t:
-      continue
-    # |G|
-    G = sum((r_ui >= threshold) for (_, r_ui) in ratings)
-    if int(G) == 0:
-      continue
-    StnG = sum(((est >= threshold) and (est >= threshold)) for (est, r_ui) in ratings[-t:])
-    precision[uid], recall[uid] = StnG / t, StnG / G
-  return (precision, recall)
-
 kf = KFold(n_splits=10)
 ts = list(range(1,25+1))
 threshold = 3
@@ -901,12 +977,17 @@ knn_prec, knn_recall = [], []
 for t in ts:
   precision_sum, recall_sum = 0.0, 0.0
   knn = KNNWithMeans(k=20, sim_options=sim_options)
-  for trainset, testset in kf.split(data):
-    knn.fit(trainset)
-    pred = knn.test(testset)
-    precision, recall = calc_precision_recall(pred, int(t), threshold)
-    precision_sum += np.mean(list(precision.values()))
-    recall_sum += np.mean(list(recall.values()))
+  for counter, [trainset, testset] in enumerate(tracer.iterate(
+      'split', folds(kf, data), model='knn_pr', param=t)):
+    tags = dict(model='knn_pr', param=t, fold=counter)
+    with tracer.stage('fit', **tags):
+      knn.fit(trainset)
+    with tracer.stage('test', **tags):
+      pred = knn.test(testset)
+    with tracer.stage('metrics', **tags):
+      precision, recall = calc_precision_recall(pred, int(t), threshold)
+      precision_sum += np.mean(list(precision.values()))
+      recall_sum += np.mean(list(recall.values()))
   precision_avg = precision_sum / kf.n_splits
   recall_avg = recall_sum / kf.n_splits
   print(f"kNN t: {t}, precision_avg: {precision_avg}, recall_avg: {recall_avg}")
@@ -939,12 +1020,17 @@ nmf_prec, nmf_recall = [], []
 for t in ts:
   precision_sum, recall_sum = 0.0, 0.0
   nmf = NMF(n_factors=20, biased=False)
-  for trainset, testset in kf.split(data):
-    nmf.fit(trainset)
-    pred = nmf.test(testset)
-    precision, recall = calc_precision_recall(pred, int(t), threshold)
-    precision_sum += np.mean(list(precision.values()))
-    recall_sum += np.mean(list(recall.values()))
+  for counter, [trainset, testset] in enumerate(tracer.iterate(
+      'split', folds(kf, data), model='nmf_pr', param=t)):
+    tags = dict(model='nmf_pr', param=t, fold=counter)
+    with tracer.stage('fit', **tags):
+      nmf.fit(trainset)
+    with tracer.stage('test', **tags):
+      pred = nmf.test(testset)
+    with tracer.stage('metrics', **tags):
+      precision, recall = calc_precision_recall(pred, int(t), threshold)
+      precision_sum += np.mean(list(precision.values()))
+      recall_sum += np.mean(list(recall.values()))
   precision_avg = precision_sum / kf.n_splits
   recall_avg = recall_sum / kf.n_splits
   print(f"NMF t: {t}, precision_avg: {precision_avg}, recall_avg: {recall_avg}")
@@ -977,12 +1063,17 @@ mf_prec, mf_recall = [], []
 for t in ts:
   precision_sum, recall_sum = 0.0, 0.0
   svd = SVD(n_factors=50, random_state=42)
-  for trainset, testset in kf.split(data):
-    svd.fit(trainset)
-    pred = svd.test(testset)
-    precision, recall = calc_precision_recall(pred, int(t), threshold)
-    precision_sum += np.mean(list(precision.values()))
-    recall_sum += np.mean(list(recall.values()))
+  for counter, [trainset, testset] in enumerate(tracer.iterate(
+      'split', folds(kf, data), model='svd_pr', param=t)):
+    tags = dict(model='svd_pr', param=t, fold=counter)
+    with tracer.stage('fit', **tags):
+      svd.fit(trainset)
+    with tracer.stage('test', **tags):
+      pred = svd.test(testset)
+    with tracer.stage('metrics', **tags):
+      precision, recall = calc_precision_recall(pred, int(t), threshold)
+      precision_sum += np.mean(list(precision.values()))
+      recall_sum += np.mean(list(recall.values()))
   precision_avg = precision_sum / kf.n_splits
   recall_avg = recall_sum / kf.n_splits
   print(f"MF t: {t}, precision_avg: {precision_avg}, recall_avg: {recall_avg}")
@@ -1020,3 +1111,7 @@ plt.plot(nmf_recall, nmf_prec, label='NMF')
 plt.plot(mf_recall, mf_prec, label='MF')
 plt.legend()
 plt.show(0)
+
+# Time spent in every stage of the experiment loops
+tracer.summary()
+tracer.close()
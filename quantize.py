@@ -0,0 +1,224 @@
+"""
+Quantized factor storage for SVD / NMF model artifacts
+
+The factors pu / qi of a saved svd or nmf artifact (float64) are rewritten as
+
+  float16 : 4x smaller, about 3 significant digits
+  int8    : 8x smaller, every row scaled by max|row| / 127 (pu_scale /
+            qi_scale hold the float32 scales)
+
+and the model is scored from the quantized arrays (converted to float32 a
+block of items at a time, see model_io.ModelArtifact). With exact=True the
+float32 factors are kept too, as pu_exact / qi_exact: top_n re-scores its
+best rerank * n candidates with them, so only those rows are ever read.
+
+  python3 quantize.py ./models/svd ./models/svd-int8 --dtype int8 --rerank 4
+  python3 quantize.py --report --folds 3          # loss against float64
+
+The report fits SVD(n_factors=50) on the 10 folds of project3.py and compares
+each quantization with the full precision model: RMSE on the test fold,
+precision / recall of the top t test items (calc_precision_recall), agreement
+of the full catalog top-N lists, factor memory and users/sec of full catalog
+scoring and of top-N.
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+from model_io import artifact_meta, load_model, save_model, write_artifact
+from cf_utils import calc_precision_recall
+
+RATINGS_CSV = './ml-latest-small/ratings.csv'
+DTYPES = ('float16', 'int8')
+
+
+def quantize_factors(x, dtype):
+  """(quantized array, per-row float32 scales or None) of the rows of x"""
+  x = np.asarray(x, dtype=np.float64)
+  if dtype == 'float16':
+    return x.astype(np.float16), None
+  if dtype == 'int8':
+    scale = np.abs(x).max(axis=1) / 127
+    scale[scale == 0] = 1
+    q = np.rint(x / scale[:, None]).astype(np.int8)
+    return q, scale.astype(np.float32)
+  raise ValueError(f'unknown dtype {dtype}')
+
+
+def quantize_model(model, path, dtype='int8', exact=True, rerank=4):
+  """Write a quantized copy of the svd / nmf artifact model to path
+
+  model is a ModelArtifact (or the path of one). Returns the version of the
+  new artifact.
+  """
+  if isinstance(model, str):
+    model = load_model(model)
+  if model.kind not in ('svd', 'nmf'):
+    raise ValueError(f'only svd and nmf models can be quantized, '
+                     f'not {model.kind}')
+  if model.meta.get('quantized'):
+    raise ValueError('the model is already quantized')
+
+  arrays = {name: getattr(model, name) for name in
+            ('user_raw', 'item_raw', 'user_order', 'item_order', 'ur_indptr',
+             'ur_indices', 'ur_ratings', 'bu', 'bi')}
+  for name in ('pu', 'qi'):
+    arrays[name], scale = quantize_factors(getattr(model, name), dtype)
+    if scale is not None:
+      arrays[name + '_scale'] = scale
+    if exact:
+      arrays[name + '_exact'] = np.asarray(getattr(model, name),
+                                           dtype=np.float32)
+
+  meta = artifact_meta(model.kind, model.n_users, model.n_items,
+                       model.meta['n_ratings'], model.global_mean,
+                       model.rating_scale)
+  meta.update(biased=model.meta['biased'], quantized=dtype,
+              rerank=int(rerank) if exact else 0,
+              source_version=model.version)
+  write_artifact(path, meta, arrays)
+  return meta['version']
+
+
+def factor_bytes(model):
+  """Bytes of the factors scored for every request"""
+  names = ['pu', 'qi', 'pu_scale', 'qi_scale']
+  return sum(getattr(model, name).nbytes for name in names
+             if hasattr(model, name))
+
+
+"""
+Report
+"""
+def _top_n_lists(model, uids, n, rerank, batch_size=256):
+  """(top-N list of every user, users per second of scoring, of top-N)"""
+  us = model.to_inner_uids(uids)
+  start = time.perf_counter()
+  for lo in range(0, len(us), batch_size):
+    model.score_users(us[lo:lo + batch_size])
+  scoring = len(us) / (time.perf_counter() - start)
+
+  lists = []
+  start = time.perf_counter()
+  for lo in range(0, len(uids), batch_size):
+    lists += model.top_n_batch(uids[lo:lo + batch_size], n, rerank=rerank)
+  return lists, scoring, len(uids) / (time.perf_counter() - start)
+
+
+def _overlap(reference, uids, lists, ref_lists):
+  """Mean fraction of lists scored by the reference model at least as high
+  as the last item of its own top-N (ties at the clipped maximum rating are
+  common, so item sets are not compared)"""
+  users = np.repeat(uids, [len(items) for items in lists])
+  items = np.array([i for items in lists for i, _ in items])
+  est = reference.predict(users, items)
+  last = np.repeat([items[-1][1] if items else np.inf for items in ref_lists],
+                   [len(items) for items in lists])
+  return float(np.mean(est >= last - 1e-9))
+
+
+def _fold_report(model, testset, t, threshold, n, rerank):
+  uids, iids, r_ui = (np.asarray(col) for col in zip(*testset))
+  est = model.predict(uids, iids)
+  pred = [(u, i, r, e, None) for u, i, r, e in
+          zip(uids.tolist(), iids.tolist(), r_ui.tolist(), est.tolist())]
+  precision, recall = calc_precision_recall(pred, t, threshold)
+  row = {'rmse': float(np.sqrt(np.mean((r_ui - est) ** 2))),
+         'precision': float(np.mean(list(precision.values()))),
+         'recall': float(np.mean(list(recall.values())))}
+  row['top_n'], row['score_users_per_s'], row['top_n_users_per_s'] = \
+    _top_n_lists(model, model.user_raw[:], n, rerank)
+  return row
+
+
+def report(data, n_folds=10, n_factors=50, t=10, threshold=3, n=10,
+           rerank=4):
+  """Table of every quantization against float64, averaged over the folds
+
+  factor_mb counts the factors scanned by every request; the float32 copies
+  used by the re-rank stay on disk, only their candidate rows are read.
+  """
+  from surprise.model_selection import KFold
+  from surprise.prediction_algorithms.matrix_factorization import SVD
+
+  variants = [('float64', 'float64', 0), ('float16', 'float16', 0),
+              ('int8', 'int8', 0), (f'int8 + re-rank x{rerank}', 'int8',
+                                    rerank)]
+  results = {name: [] for name, _, _ in variants}
+  memory = dict()
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    kf = KFold(n_splits=10)
+    for fold, (trainset, testset) in enumerate(kf.split(data)):
+      if fold == n_folds:
+        break
+      algo = SVD(n_factors=n_factors, random_state=42).fit(trainset)
+      save_model(algo, os.path.join(tmp_dir, 'float64'))
+      for dtype in DTYPES:
+        quantize_model(os.path.join(tmp_dir, 'float64'),
+                       os.path.join(tmp_dir, dtype), dtype)
+      reference = load_model(os.path.join(tmp_dir, 'float64'))
+      for name, dtype, k in variants:
+        model = load_model(os.path.join(tmp_dir, dtype))
+        row = _fold_report(model, testset, t, threshold, n, k)
+        if dtype == 'float64':
+          ref_lists = row['top_n']
+        row['top_n_agreement'] = _overlap(reference, model.user_raw[:],
+                                          row.pop('top_n'), ref_lists)
+        results[name].append(row)
+        memory[name] = factor_bytes(model)
+      print(f'fold {fold} done')
+  finally:
+    shutil.rmtree(tmp_dir)
+
+  rows = []
+  for name, _, _ in variants:
+    row = {'model': name, 'factor_mb': memory[name] / 2**20}
+    row.update(pd.DataFrame(results[name]).mean().to_dict())
+    rows.append(row)
+  out = pd.DataFrame(rows).set_index('model')
+  base = out.loc['float64']
+  out['rmse_loss'] = out['rmse'] - base['rmse']
+  out['recall_loss'] = base['recall'] - out['recall']
+  out['scoring_speedup'] = out['score_users_per_s'] / \
+    base['score_users_per_s']
+  out['top_n_speedup'] = out['top_n_users_per_s'] / base['top_n_users_per_s']
+  return out
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('src', nargs='?', help='svd / nmf artifact to quantize')
+  parser.add_argument('dst', nargs='?', help='directory of the new artifact')
+  parser.add_argument('--dtype', choices=DTYPES, default='int8')
+  parser.add_argument('--no-exact', action='store_true',
+                      help='do not keep the float32 factors for re-ranking')
+  parser.add_argument('--rerank', type=int, default=4,
+                      help='candidates re-scored per top-N result')
+  parser.add_argument('--report', action='store_true',
+                      help='compare the quantizations on the project folds')
+  parser.add_argument('--ratings', default=RATINGS_CSV)
+  parser.add_argument('--folds', type=int, default=10)
+  parser.add_argument('--t', type=int, default=10)
+  args = parser.parse_args()
+
+  if args.report:
+    from surprise import Dataset, Reader
+    df = pd.read_csv(args.ratings)
+    data = Dataset.load_from_df(df[['userId', 'movieId', 'rating']],
+                                Reader(rating_scale=(0.5, 5)))
+    table = report(data, args.folds, t=args.t, n=args.t, rerank=args.rerank)
+    print(table.round(4).to_string())
+  elif args.src and args.dst:
+    version = quantize_model(args.src, args.dst, args.dtype,
+                             not args.no_exact, args.rerank)
+    before = factor_bytes(load_model(args.src))
+    after = factor_bytes(load_model(args.dst))
+    print(f'model {version} saved to {args.dst}: factors {before / 2**20:.1f}'
+          f' MB -> {after / 2**20:.1f} MB')
+  else:
+    parser.error('give src and dst, or --report')
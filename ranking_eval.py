@@ -0,0 +1,301 @@
+"""
+Sampled-negative ranking evaluation for large catalogs
+
+Ranking the whole catalog for every user of every fold does not scale. Here
+every user's held-out relevant items (rating >= threshold) are ranked against
+n_negatives items the user has not rated, drawn once per evaluate() call with
+a fixed seed and probability proportional to count ** alpha, count being the
+number of ratings of the movie in the training fold (alpha = 0 samples
+uniformly, alpha = 1 by popularity, which gives harder negatives). Items the
+user rated in the test fold without liking them are neither positives nor
+negatives.
+
+Per user, over the top t of the candidates:
+
+  HR@t        1 if a relevant item is in the top t
+  NDCG@t      sum 1 / log2(rank + 2) of the relevant items in the top t,
+              divided by its maximum min(t, |relevant|) terms
+  precision@t relevant items in the top t / t
+  recall@t    relevant items in the top t / |relevant|
+
+A relevant item ranks below every candidate with an equal score (estimates
+clipped to the rating scale tie often). exact=True ranks against every item
+the user has not rated instead, which gives the full catalog metrics. Models
+are model_io artifacts: candidates are scored by one estimate() call per
+batch of users.
+
+  evaluator = SampledRanking(trainset_counts(trainset), n_negatives=100, t=10)
+  metrics = evaluator.evaluate(load_model('models/mf'), testset)
+
+  python3 ranking_eval.py --folds 3 --negatives 100 --t 10
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from model_io import load_model, save_model
+from cf_utils import NaiveCollabFilter
+
+RATINGS_CSV = './ml-latest-small/ratings.csv'
+METRICS = ('hr', 'ndcg', 'precision', 'recall')
+
+
+def movie_counts(ratings):
+  """{movieId: number of ratings} from the ratings of movie_rating_stats"""
+  return {movie: len(r) for movie, r in ratings.items()}
+
+
+def trainset_counts(trainset):
+  """{raw iid: number of ratings} of the items of a trainset"""
+  return {trainset.to_raw_iid(i): len(trainset.ir[i])
+          for i in trainset.all_items()}
+
+
+def _isin_sorted(keys, sorted_keys):
+  """np.isin(keys, sorted_keys) without sorting sorted_keys again"""
+  if len(sorted_keys) == 0:
+    return np.zeros(np.shape(keys), dtype=bool)
+  pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+  return sorted_keys[pos] == keys
+
+
+def rank_metrics(pos, neg, t):
+  """Per-user HR, NDCG, precision and recall at t
+
+  pos (B, R) are the scores of the relevant items (nan pads rows with fewer
+  items), neg (B, N) the scores of the other candidates (-inf pads). Every row
+  needs a relevant item.
+  """
+  valid = ~np.isnan(pos)
+  n_pos = valid.sum(axis=1)
+  finite = np.concatenate([pos[valid], neg[np.isfinite(neg)]])
+  low, high = finite.min() - 1, finite.max() + 1
+  n_rows, n_neg = neg.shape
+
+  # Negatives scoring >= each positive, for all rows at once: shifting row r
+  # by r * span keeps the rows apart in one sorted array
+  offsets = np.arange(n_rows)[:, None] * (high - low)
+  sorted_neg = np.sort((np.where(np.isfinite(neg), neg, low) +
+                        offsets).ravel())
+  below = np.searchsorted(sorted_neg, (np.where(valid, pos, low) +
+                                       offsets).ravel(), side='left')
+  neg_above = n_neg - (below.reshape(pos.shape) -
+                       np.arange(n_rows)[:, None] * n_neg)
+
+  # Position among the relevant items of the row
+  order = np.argsort(-np.where(valid, pos, -np.inf), axis=1, kind='stable')
+  pos_rank = np.empty_like(order)
+  np.put_along_axis(pos_rank, order, np.arange(pos.shape[1])[None, :], axis=1)
+
+  rank = neg_above + pos_rank
+  top = valid & (rank < t)
+  hits = top.sum(axis=1)
+  dcg = np.where(top, 1 / np.log2(rank + 2), 0).sum(axis=1)
+  idcg = np.cumsum(1 / np.log2(np.arange(t) + 2))[np.minimum(n_pos, t) - 1]
+  return {'hr': (hits > 0).astype(np.float64), 'ndcg': dcg / idcg,
+          'precision': hits / t, 'recall': hits / n_pos}
+
+
+class SampledRanking:
+  """Sampled (or exact) ranking metrics of model artifacts on a testset
+
+  counts maps a raw movie id to its number of training ratings
+  (trainset_counts); items missing from it are never sampled. Users are
+  scored batch_size at a time.
+  """
+  def __init__(self, counts, n_negatives=100, t=10, threshold=3, alpha=1.0,
+               seed=42, batch_size=1024):
+    self.counts = counts
+    self.n_negatives = n_negatives
+    self.t = t
+    self.threshold = threshold
+    self.alpha = alpha
+    self.seed = seed
+    self.batch_size = batch_size
+
+  def _weights(self, model):
+    counts = np.array([self.counts.get(iid, 0) for iid in
+                       model.item_raw.tolist()], dtype=np.float64)
+    weights = np.where(counts > 0, counts ** self.alpha, 0)
+    return weights / weights.sum()
+
+  def _sample(self, rng, us, weights, rated):
+    """(B, n_negatives) unrated items of every user, -1 where none is left
+
+    rated holds the sorted u * n_items + i keys of the rated items.
+    """
+    n_items = len(weights)
+    out = np.full((len(us), self.n_negatives), -1, dtype=np.int64)
+    todo = np.arange(len(us))
+    for _ in range(10):
+      draws = rng.choice(n_items, size=(len(todo), 2 * self.n_negatives),
+                         p=weights)
+      bad = _isin_sorted(us[todo, None] * n_items + draws, rated)
+      # Keep the first draw of every item
+      order = np.argsort(draws, axis=1, kind='stable')
+      sorted_draws = np.take_along_axis(draws, order, axis=1)
+      repeat = np.zeros_like(bad)
+      repeat[:, 1:] = sorted_draws[:, 1:] == sorted_draws[:, :-1]
+      np.put_along_axis(bad, order, np.take_along_axis(bad, order, axis=1)
+                        | repeat, axis=1)
+      first = np.argsort(bad, axis=1, kind='stable')[:, :self.n_negatives]
+      ok = ~np.take_along_axis(bad, first, axis=1)
+      out[todo] = np.where(ok, np.take_along_axis(draws, first, axis=1), -1)
+      todo = todo[~ok.all(axis=1)]
+      if len(todo) == 0:
+        break
+    return out
+
+  def evaluate(self, model, testset, exact=False):
+    """Mean metrics over the users with a relevant test item
+
+    Returns a dict with 'hr', 'ndcg', 'precision', 'recall', the number of
+    users and the seconds taken.
+    """
+    start = time.perf_counter()
+    uids, iids, r_ui = (np.asarray(col) for col in zip(*testset))
+    us, items = model.to_inner_uids(uids), model.to_inner_iids(iids)
+    keep = us >= 0
+    us, items, r_ui = us[keep], items[keep], r_ui[keep].astype(np.float64)
+
+    # Rated (training and test) items of every user, as sorted u * n + i keys
+    n_items = model.n_items
+    train_u = np.repeat(np.arange(model.n_users), np.diff(model.ur_indptr))
+    rated = np.union1d(train_u * n_items + model.ur_indices,
+                       us[items >= 0] * n_items + items[items >= 0])
+
+    relevant = r_ui >= self.threshold
+    order = np.lexsort((items[relevant], us[relevant]))
+    pos_u, pos_i = us[relevant][order], items[relevant][order]
+    users, starts, n_pos = np.unique(pos_u, return_index=True,
+                                     return_counts=True)
+
+    rng = np.random.default_rng(self.seed)
+    weights = None if exact else self._weights(model)
+    per_user = {name: [] for name in METRICS}
+    for lo in range(0, len(users), self.batch_size):
+      batch = users[lo:lo + self.batch_size]
+      b_starts, b_n = starts[lo:lo + len(batch)], n_pos[lo:lo + len(batch)]
+      # (B, R) relevant items; unknown ones (-1) get the fallback estimate
+      width = b_n.max()
+      cols = np.arange(width)[None, :]
+      pad = cols >= b_n[:, None]
+      pos_items = pos_i[np.minimum(b_starts[:, None] + cols, len(pos_i) - 1)]
+      pos = model.estimate(np.repeat(batch, width),
+                           pos_items.ravel()).reshape(pos_items.shape)
+      pos[pad] = np.nan
+
+      if exact:
+        neg = model.score_users(batch).astype(np.float64)
+        neg_keys = batch[:, None] * n_items + np.arange(n_items)[None, :]
+        neg[_isin_sorted(neg_keys, rated)] = -np.inf
+      else:
+        neg_items = self._sample(rng, batch, weights, rated)
+        neg = model.estimate(np.repeat(batch, self.n_negatives), np.maximum(
+          neg_items.ravel(), 0)).reshape(neg_items.shape)
+        neg[neg_items < 0] = -np.inf
+
+      for name, values in rank_metrics(pos, neg, self.t).items():
+        per_user[name].append(values)
+
+    result = {name: float(np.mean(np.concatenate(values)))
+              for name, values in per_user.items()}
+    result['n_users'] = int(len(users))
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+"""
+Report: sampled against exact metrics
+"""
+def _report_models():
+  from surprise import KNNWithMeans
+  from surprise.prediction_algorithms.matrix_factorization import NMF, SVD
+  sim_options = {'name': 'pearson', 'user_based': True}
+  return {
+    'naive': NaiveCollabFilter,
+    'knn-20': lambda: KNNWithMeans(k=20, sim_options=sim_options,
+                                   verbose=False),
+    'nmf-20': lambda: NMF(n_factors=20, biased=False),
+    'svd-2': lambda: SVD(n_factors=2, random_state=42),
+    'svd-50': lambda: SVD(n_factors=50, random_state=42),
+    'svd-50-5ep': lambda: SVD(n_factors=50, n_epochs=5, random_state=42),
+  }
+
+
+def report(data, n_folds=3, n_negatives=100, t=10, threshold=3, alpha=1.0,
+           seed=42):
+  """(per model and fold metrics, correlations of sampled and exact)
+
+  Negatives are weighted by the counts of the training fold, so the held-out
+  ratings do not make their items more likely negatives.
+  """
+  from surprise.model_selection import KFold
+
+  rows = []
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    kf = KFold(n_splits=10)
+    for fold, (trainset, testset) in enumerate(kf.split(data)):
+      if fold == n_folds:
+        break
+      evaluator = SampledRanking(trainset_counts(trainset), n_negatives, t,
+                                 threshold, alpha, seed)
+      for name, make in _report_models().items():
+        algo = make()
+        algo.fit(trainset)
+        path = os.path.join(tmp_dir, name)
+        save_model(algo, path)
+        model = load_model(path)
+        sampled = evaluator.evaluate(model, testset)
+        exact = evaluator.evaluate(model, testset, exact=True)
+        row = {'model': name, 'fold': fold,
+               'sampled_s': sampled['seconds'], 'exact_s': exact['seconds']}
+        for metric in METRICS:
+          row[f'{metric}_sampled'] = sampled[metric]
+          row[f'{metric}_exact'] = exact[metric]
+        rows.append(row)
+      print(f'fold {fold} done')
+  finally:
+    shutil.rmtree(tmp_dir)
+
+  results = pd.DataFrame(rows)
+  corr = []
+  for metric in METRICS:
+    x, y = results[f'{metric}_sampled'], results[f'{metric}_exact']
+    corr.append({'metric': metric, 'pearson': stats.pearsonr(x, y)[0],
+                 'spearman': stats.spearmanr(x, y)[0],
+                 'kendall': stats.kendalltau(x, y)[0]})
+  return results, pd.DataFrame(corr).set_index('metric')
+
+
+if __name__ == '__main__':
+  from surprise import Dataset, Reader
+
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('--ratings', default=RATINGS_CSV)
+  parser.add_argument('--folds', type=int, default=3)
+  parser.add_argument('--negatives', type=int, default=100)
+  parser.add_argument('--t', type=int, default=10)
+  parser.add_argument('--threshold', type=float, default=3)
+  parser.add_argument('--alpha', type=float, default=1.0,
+                      help='negatives drawn with probability ~ count**alpha')
+  parser.add_argument('--seed', type=int, default=42)
+  args = parser.parse_args()
+
+  df = pd.read_csv(args.ratings)
+  data = Dataset.load_from_df(df[['userId', 'movieId', 'rating']],
+                              Reader(rating_scale=(0.5, 5)))
+  results, corr = report(data, args.folds, args.negatives, args.t,
+                         args.threshold, args.alpha, args.seed)
+  pd.set_option('display.width', 200)
+  print(results.groupby('model', sort=False).mean().drop(columns='fold')
+        .round(4).to_string())
+  print(f'\nCorrelation of sampled and exact metrics over '
+        f'{len(results)} (model, fold) pairs:')
+  print(corr.round(3).to_string())
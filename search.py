@@ -0,0 +1,181 @@
+"""
+Successive-halving search over k / n_factors
+
+The grids of project3.py run 10-fold CV for every value (50 values of k for
+kNN, 25 values of n_factors for NMF and SVD). Successive halving spends the
+folds where they matter:
+
+  rung 0 : every candidate is evaluated on min_folds folds
+  rung r : the best 1/eta of the candidates (by mean RMSE over the folds
+           evaluated so far) get eta times more folds
+  last   : the survivors are evaluated on all the folds
+
+Fold results are kept between rungs, so no fit is ever repeated, and every
+candidate sees the same folds. The best candidate is then chosen on its full
+n_splits-fold CV RMSE, exactly as in the grid.
+
+  python3 search.py --model knn --values 2:101:2
+  python3 search.py --model svd --values 2:51:2 --min-folds 2 --eta 3
+"""
+import math
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from surprise import Dataset, Reader, KNNWithMeans, accuracy
+from surprise.prediction_algorithms.matrix_factorization import NMF, SVD
+from surprise.model_selection import KFold
+
+from compact_trainset import split_folds
+
+RATINGS_CSV = './ml-latest-small/ratings.csv'
+
+
+def make_algo(model, param):
+  """The models of project3.py, with k / n_factors = param"""
+  if model == 'knn':
+    sim_options = {'name': 'pearson', 'user_based': True}
+    return KNNWithMeans(k=param, sim_options=sim_options, verbose=False)
+  if model == 'nmf':
+    return NMF(n_factors=param)
+  if model == 'svd':
+    return SVD(n_factors=param, random_state=42)
+  raise ValueError(f'unknown model {model}')
+
+
+def evaluate_fold(algo, trainset, testset):
+  """(RMSE, MAE) of algo fitted on trainset, as in the project3.py loops"""
+  algo.fit(trainset)
+  pred = algo.test(testset)
+  return accuracy.rmse(pred, verbose=False), accuracy.mae(pred, verbose=False)
+
+
+class _Candidate:
+  def __init__(self, param):
+    self.param = param
+    self.rmse = []
+    self.mae = []
+    self.seconds = 0.0
+
+  def mean_rmse(self):
+    return float(np.mean(self.rmse))
+
+
+def successive_halving(make, params, data, n_splits=10, min_folds=1, eta=2,
+                       random_state=None, compact=False, tracer=None,
+                       model='search', verbose=True):
+  """Best param of params by successive halving over the folds of data
+
+  make(param) returns a new unfitted algorithm. Returns a dict with the best
+  param, its n_splits-fold CV RMSE and MAE, the number of fits against the
+  full grid, the time taken against an estimate of the grid's time, and the
+  candidates kept at every rung.
+  """
+  if not 1 <= min_folds <= n_splits or eta < 2:
+    raise ValueError('need 1 <= min_folds <= n_splits and eta >= 2')
+  start = time.perf_counter()
+  kf = KFold(n_splits=n_splits, random_state=random_state)
+  splits = list(split_folds(kf, data, compact))
+
+  candidates = [_Candidate(param) for param in params]
+  survivors = candidates
+  n_folds = min_folds
+  rungs = []
+  while True:
+    for cand in survivors:
+      for fold in range(len(cand.rmse), n_folds):
+        trainset, testset = splits[fold]
+        fold_start = time.perf_counter()
+        if tracer is not None:
+          with tracer.stage('fit_test', model=model, param=cand.param,
+                            fold=fold, rung=len(rungs)):
+            scores = evaluate_fold(make(cand.param), trainset, testset)
+        else:
+          scores = evaluate_fold(make(cand.param), trainset, testset)
+        cand.seconds += time.perf_counter() - fold_start
+        cand.rmse.append(scores[0])
+        cand.mae.append(scores[1])
+
+    survivors = sorted(survivors, key=_Candidate.mean_rmse)
+    rungs.append([(c.param, n_folds, c.mean_rmse()) for c in survivors])
+    if verbose:
+      print(f'rung {len(rungs) - 1}: {len(survivors)} candidates on '
+            f'{n_folds} fold(s), best {survivors[0].param} '
+            f'(RMSE {survivors[0].mean_rmse():.4f})')
+    if n_folds == n_splits:
+      break
+    survivors = survivors[:max(1, math.ceil(len(survivors) / eta))]
+    n_folds = min(n_splits, n_folds * eta)
+
+  best = survivors[0]
+  n_fits = sum(len(c.rmse) for c in candidates)
+  # Each candidate's folds cost about the same, so the grid would have taken
+  # n_splits times its mean time per fold
+  grid_seconds = sum(c.seconds / len(c.rmse) * n_splits for c in candidates)
+  return {
+    'best_param': best.param,
+    'n_splits': n_splits,
+    'rmse': best.mean_rmse(),
+    'mae': float(np.mean(best.mae)),
+    'n_fits': n_fits,
+    'grid_fits': len(candidates) * n_splits,
+    'fits_saved': 1 - n_fits / (len(candidates) * n_splits),
+    'seconds': time.perf_counter() - start,
+    'fit_seconds': sum(c.seconds for c in candidates),
+    'grid_seconds_estimate': grid_seconds,
+    'rungs': rungs,
+  }
+
+
+def print_search(result, name='param'):
+  print(f'\nBest {name} = {result["best_param"]}: '
+        f'{result["n_splits"]}-fold CV RMSE '
+        f'{result["rmse"]:.4f}, MAE {result["mae"]:.4f}')
+  print(f'{result["n_fits"]} fits instead of {result["grid_fits"]} '
+        f'({100 * result["fits_saved"]:.0f}% saved), '
+        f'{result["fit_seconds"]:.1f} s instead of about '
+        f'{result["grid_seconds_estimate"]:.1f} s')
+
+
+def _parse_values(spec):
+  """'2:101:2' -> range(2, 101, 2); '10,20,40' -> [10, 20, 40]"""
+  if ':' in spec:
+    return list(range(*(int(x) for x in spec.split(':'))))
+  return [int(x) for x in spec.split(',')]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('--model', choices=['knn', 'nmf', 'svd'], default='knn')
+  parser.add_argument('--values', default='2:101:2',
+                      help='start:stop:step or a comma separated list')
+  parser.add_argument('--ratings', default=RATINGS_CSV)
+  parser.add_argument('--splits', type=int, default=10)
+  parser.add_argument('--min-folds', type=int, default=1)
+  parser.add_argument('--eta', type=int, default=2)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--grid', action='store_true',
+                      help='also run the full grid to check the result')
+  args = parser.parse_args()
+
+  df = pd.read_csv(args.ratings)
+  data = Dataset.load_from_df(df[['userId', 'movieId', 'rating']],
+                              Reader(rating_scale=(0.5, 5)))
+  values = _parse_values(args.values)
+  name = 'k' if args.model == 'knn' else 'n_factors'
+
+  def make(param):
+    return make_algo(args.model, param)
+
+  result = successive_halving(make, values, data, args.splits,
+                              args.min_folds, args.eta, args.seed,
+                              compact=True)
+  print_search(result, name)
+
+  if args.grid:
+    grid = successive_halving(make, values, data, args.splits, args.splits,
+                              args.eta, args.seed, compact=True,
+                              verbose=False)
+    print(f'Full grid: best {name} = {grid["best_param"]} (RMSE '
+          f'{grid["rmse"]:.4f}) in {grid["fit_seconds"]:.1f} s')
@@ -0,0 +1,356 @@
+"""
+Local asyncio recommendation server
+
+Serves a model artifact written by model_io.save_model over plain HTTP/1.1
+(keep-alive, standard library only):
+
+  GET /predict?uid=1&iid=31     {"uid": 1, "iid": 31, "est": 3.71}
+  GET /topn?uid=1&n=10          {"uid": 1, "items": [[iid, est], ...]}
+      &exclude_seen=0           (rated items are excluded by default)
+  POST /ratings?uid=1&iid=31&rating=4
+                                {"uid": 1, "iid": 31, "invalidated": 2}
+  GET /similar?iid=1&n=10       {"iid": 1, "items": [[iid, sim], ...]}
+                                (item_knn models only)
+  GET /health                   {"kind": "svd", "version": "...",
+                                 "cache": {"hits": ..., "misses": ...}}
+
+Concurrent requests are not scored one by one: /predict and /topn hand their
+request to a MicroBatcher, which waits at most `window` seconds (or until
+`max_batch` requests are queued) and scores the whole batch with one
+vectorized call on the model.
+
+Top-N lists are cached per (user, n, filter, model version) in a TopNCache
+(LRU with a TTL), so repeated requests of active users skip scoring. A POSTed
+rating drops the cached lists of its user, and its item is excluded from the
+user's lists until the next model. The artifact directory is polled for a new
+version (written by save_model or streaming.py); a new model is swapped in and
+the whole cache is dropped.
+
+  python3 serve.py models/mf --port 8080 --window-ms 2 --max-batch 256 \\
+    --cache-size 100000 --cache-ttl 300
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs
+
+from model_io import META_FILE, load_model
+from topn_cache import TopNCache
+
+
+class MicroBatcher:
+  """Coalesce concurrent submit() calls into batches for score_fn
+
+  score_fn receives a list of requests and must return one result per
+  request, in the same order.
+  """
+  def __init__(self, score_fn, window=0.002, max_batch=256):
+    self.score_fn = score_fn
+    self.window = window
+    self.max_batch = max_batch
+    self.n_batches = 0
+    self.n_requests = 0
+    self._queue = None
+    self._task = None
+
+  def start(self):
+    self._queue = asyncio.Queue()
+    self._task = asyncio.get_running_loop().create_task(self._run())
+
+  async def stop(self):
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+
+  async def submit(self, request):
+    future = asyncio.get_running_loop().create_future()
+    await self._queue.put((request, future))
+    return await future
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = [await self._queue.get()]
+      deadline = loop.time() + self.window
+      while len(batch) < self.max_batch:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+        except asyncio.TimeoutError:
+          break
+      # Drain whatever else arrived meanwhile without waiting any longer
+      while len(batch) < self.max_batch and not self._queue.empty():
+        batch.append(self._queue.get_nowait())
+
+      self.n_batches += 1
+      self.n_requests += len(batch)
+      try:
+        results = self.score_fn([request for request, _ in batch])
+      except Exception as e:
+        for _, future in batch:
+          if not future.done():
+            future.set_exception(e)
+        continue
+      for (_, future), result in zip(batch, results):
+        if not future.done():
+          future.set_result(result)
+
+
+class RecommendationServer:
+  """HTTP front end of one model artifact
+
+  cache is a TopNCache or None. Ratings POSTed since the model was loaded
+  are kept in new_ratings (and appended to ratings_log, a csv, if given).
+  """
+  def __init__(self, model, window=0.002, max_batch=256, cache=None,
+               ratings_log=None):
+    self.model = model
+    self.cache = cache
+    self.ratings_log = ratings_log
+    self.new_ratings = defaultdict(set)
+    self.predict_batcher = MicroBatcher(self._predict_batch, window, max_batch)
+    self.topn_batcher = MicroBatcher(self._topn_batch, window, max_batch)
+
+  # Batch scoring
+  def _predict_batch(self, requests):
+    uids = [uid for uid, _ in requests]
+    iids = [iid for _, iid in requests]
+    return self.model.predict(uids, iids).tolist()
+
+  def _topn_batch(self, requests):
+    results = [None] * len(requests)
+    for exclude_seen in (True, False):
+      rows = [k for k, request in enumerate(requests)
+              if request[2] == exclude_seen]
+      if not rows:
+        continue
+      # Ask for enough items to drop the ones rated since the model was built
+      new = [self.new_ratings.get(requests[k][0], set()) if exclude_seen
+             else set() for k in rows]
+      n_max = max(requests[k][1] + len(items) for k, items in zip(rows, new))
+      lists = self.model.top_n_batch([requests[k][0] for k in rows], n_max,
+                                     exclude_seen)
+      for k, items, rated in zip(rows, lists, new):
+        results[k] = [item for item in items
+                      if item[0] not in rated][:requests[k][1]]
+    return results
+
+  async def _top_n(self, uid, n, exclude_seen):
+    if self.cache is None:
+      return await self.topn_batcher.submit((uid, n, exclude_seen))
+    flt = 'unseen' if exclude_seen else 'all'
+    version = self.model.version
+    items = self.cache.get(uid, n, flt, version)
+    if items is None:
+      generation = self.cache.generation(uid)
+      items = await self.topn_batcher.submit((uid, n, exclude_seen))
+      self.cache.put(uid, n, flt, version, items, generation)
+    return items
+
+  # Updates
+  def add_rating(self, uid, iid, rating):
+    """Record a new rating; returns the number of cached lists dropped"""
+    self.new_ratings[uid].add(iid)
+    if self.ratings_log:
+      with open(self.ratings_log, 'a') as handle:
+        handle.write(f'{uid},{iid},{rating},{int(time.time())}\n')
+    return self.cache.invalidate_user(uid) if self.cache is not None else 0
+
+  def reload(self, model):
+    """Serve model from now on; the cached lists and new ratings are dropped"""
+    self.model = model
+    self.new_ratings.clear()
+    if self.cache is not None:
+      self.cache.invalidate_all()
+
+  async def watch_model(self, interval):
+    """Reload the artifact whenever its directory holds a new version"""
+    path = os.path.join(self.model.path, META_FILE)
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        with open(path) as handle:
+          version = json.load(handle)['version']
+        if version != self.model.version:
+          self.reload(load_model(self.model.path))
+          print(f'Reloaded model {version}')
+      except (OSError, ValueError, KeyError) as e:
+        # Caught in the middle of a rename; try again at the next tick
+        print(f'Model reload failed: {e}')
+
+  # Request handling
+  def _parse_id(self, value, raw):
+    if raw.dtype.kind in 'iu':
+      return int(value)
+    if raw.dtype.kind == 'f':
+      return float(value)
+    return value
+
+  async def handle(self, path, query, method='GET'):
+    """(status, body dict) of one request"""
+    if (method == 'POST') != (path == '/ratings'):
+      return 405, {'error': f'{method} is not supported on {path}'}
+    try:
+      if path == '/predict':
+        uid = self._parse_id(query['uid'][0], self.model.user_raw)
+        iid = self._parse_id(query['iid'][0], self.model.item_raw)
+        est = await self.predict_batcher.submit((uid, iid))
+        return 200, {'uid': uid, 'iid': iid, 'est': est}
+      if path == '/topn':
+        uid = self._parse_id(query['uid'][0], self.model.user_raw)
+        n = int(query.get('n', ['10'])[0])
+        if n < 1:
+          raise ValueError('n must be positive')
+        exclude_seen = query.get('exclude_seen', ['1'])[0] not in ('0',
+                                                                   'false')
+        items = await self._top_n(uid, n, exclude_seen)
+        return 200, {'uid': uid, 'items': items}
+      if path == '/ratings':
+        uid = self._parse_id(query['uid'][0], self.model.user_raw)
+        iid = self._parse_id(query['iid'][0], self.model.item_raw)
+        rating = float(query['rating'][0])
+        lower_bound, higher_bound = self.model.rating_scale
+        if not lower_bound <= rating <= higher_bound:
+          raise ValueError(f'rating must be in {self.model.rating_scale}')
+        return 200, {'uid': uid, 'iid': iid,
+                     'invalidated': self.add_rating(uid, iid, rating)}
+      if path == '/similar':
+        # A slice of the neighbor table, cheap enough to skip the batcher
+        iid = self._parse_id(query['iid'][0], self.model.item_raw)
+        n = int(query.get('n', ['10'])[0])
+        if n < 1:
+          raise ValueError('n must be positive')
+        return 200, {'iid': iid, 'items': self.model.similar_items(iid, n)}
+      if path == '/health':
+        body = {'kind': self.model.kind, 'version': self.model.version}
+        if self.cache is not None:
+          body['cache'] = self.cache.stats()
+        return 200, body
+    except (KeyError, ValueError) as e:
+      return 400, {'error': f'bad request: {e}'}
+    except Exception as e:
+      # A failed scoring call answers this request only
+      print(f'Error serving {path}: {e!r}')
+      return 500, {'error': f'internal error: {e!r}'}
+    return 404, {'error': f'unknown path {path}'}
+
+  async def _respond(self, parts, content):
+    """(status, body dict) of a request line split in parts and its body"""
+    if len(parts) != 3 or parts[0] not in ('GET', 'POST'):
+      return 405, {'error': 'only GET and POST are supported'}
+    try:
+      url = urlsplit(parts[1])
+    except ValueError as e:
+      return 400, {'error': f'bad request: {e}'}
+    query = parse_qs(url.query)
+    try:
+      # A JSON object body adds to the query parameters
+      if content:
+        query.update({k: [str(v)] for k, v in json.loads(content).items()})
+    except (ValueError, AttributeError):
+      return 400, {'error': 'body must be a JSON object'}
+    return await self.handle(url.path, query, parts[0])
+
+  async def serve_connection(self, reader, writer):
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line:
+          break
+        headers = dict()
+        while True:
+          line = await reader.readline()
+          if line in (b'\r\n', b'\n', b''):
+            break
+          name, _, value = line.decode('latin-1').partition(':')
+          headers[name.strip().lower()] = value.strip()
+
+        parts = request_line.decode('latin-1').split()
+        keep_alive = headers.get('connection', '').lower() != 'close' and \
+          parts[-1:] == ['HTTP/1.1']
+        try:
+          length = int(headers.get('content-length', 0))
+          if length < 0:
+            raise ValueError(f'negative length {length}')
+        except ValueError:
+          # Where the body ends is unknown, so no other request can follow
+          status, body = 400, {'error': 'bad Content-Length'}
+          keep_alive = False
+        else:
+          content = await reader.readexactly(length) if length else b''
+          status, body = await self._respond(parts, content)
+
+        payload = json.dumps(body).encode()
+        writer.write(
+          f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+          f'Content-Type: application/json\r\n'
+          f'Content-Length: {len(payload)}\r\n'
+          f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+          f'\r\n'.encode() + payload)
+        await writer.drain()
+        if not keep_alive:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def run(self, host='127.0.0.1', port=8080, reload_interval=None):
+    self.predict_batcher.start()
+    self.topn_batcher.start()
+    watcher = None
+    if reload_interval and self.model.path:
+      watcher = asyncio.get_running_loop().create_task(
+        self.watch_model(reload_interval))
+    server = await asyncio.start_server(self.serve_connection, host, port)
+    print(f'Serving {self.model.kind} model {self.model.version} '
+          f'on http://{host}:{port}')
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      if watcher is not None:
+        watcher.cancel()
+      await self.predict_batcher.stop()
+      await self.topn_batcher.stop()
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('model', help='model artifact directory')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--window-ms', type=float, default=2.0,
+                      help='longest wait for a batch to fill up')
+  parser.add_argument('--max-batch', type=int, default=256)
+  parser.add_argument('--cache-size', type=int, default=100000,
+                      help='cached top-N lists (0 disables the cache)')
+  parser.add_argument('--cache-ttl', type=float, default=300,
+                      help='seconds a cached list stays valid')
+  parser.add_argument('--reload-s', type=float, default=5,
+                      help='model version polling period (0 disables)')
+  parser.add_argument('--ratings-log', help='csv to append new ratings to')
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  model = load_model(args.model)
+  print(f'Loaded model in {1000 * (time.perf_counter() - start):.1f} ms')
+  cache = TopNCache(args.cache_size, args.cache_ttl) if args.cache_size \
+    else None
+  server = RecommendationServer(model, args.window_ms / 1000, args.max_batch,
+                                cache, args.ratings_log)
+  try:
+    asyncio.run(server.run(args.host, args.port, args.reload_s))
+  except KeyboardInterrupt:
+    pass
@@ -0,0 +1,698 @@
+"""
+Out-of-core training of the biased MF (SVD) and NMF models
+
+The models of project3.py are fitted on a Surprise Trainset built from a
+DataFrame holding every rating, so the data has to fit in RAM several times
+over. The trainers of this module read the ratings from disk in blocks, one
+shuffle buffer at a time, and only keep the model resident:
+
+  memory ~ factors and biases (+ the NMF accumulators, same size)
+         + id maps and rating counts (a few bytes per user / item)
+         + block_size * buffer_blocks * ~24 bytes (the shuffle buffer)
+
+Ratings are read either from a store directory (memory-mapped .npy columns,
+written once by prepare_store) or straight from a ratings.csv with chunked
+read_csv. Every epoch visits the blocks in a new random order and shuffles
+the ratings inside each buffer; prepare_store already scatters the ratings of
+the (usually user sorted) csv over the whole store, so every block is a
+sample of all the users.
+
+  python3 streaming.py prepare ml-latest-small/ratings.csv ./ratings-store
+  python3 streaming.py train ./ratings-store ./models/mf --model svd \\
+    --factors 50 --epochs 20
+
+Long fits can be checkpointed every few epochs (parameters, RNG state and
+epoch log, written atomically) and resumed after a crash by running the same
+command again; with a validation csv they stop early once its RMSE stops
+improving:
+
+  python3 streaming.py train ./ratings-store ./models/mf --model svd \\
+    --checkpoint-dir ./models/mf-checkpoints --valid valid.csv --patience 3
+
+The fitted model is saved in the memory-mapped format of model_io.py (kind
+svd / nmf), so serve.py and load_model() use it like any other saved model.
+"""
+import os
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from numpy.lib.format import open_memmap
+
+from model_io import (META_FILE, artifact_meta, lookup_ids, remove_artifact,
+                      replace_dir, version_dir, write_artifact)
+from baseline import als_baselines
+
+COLUMNS = ('userId', 'movieId', 'rating')
+
+
+"""
+Rating sources
+"""
+def _scan_csv(csv_path, chunksize, columns):
+  """Raw ids, rating counts, number and sum of the ratings of a csv"""
+  u, i, r = columns
+  user_counts = item_counts = pd.Series(dtype=np.float64)
+  n_ratings, total = 0, 0.0
+  for chunk in pd.read_csv(csv_path, usecols=list(columns),
+                           chunksize=chunksize):
+    user_counts = user_counts.add(chunk[u].value_counts(), fill_value=0)
+    item_counts = item_counts.add(chunk[i].value_counts(), fill_value=0)
+    n_ratings += len(chunk)
+    total += float(chunk[r].sum())
+  user_counts, item_counts = user_counts.sort_index(), item_counts.sort_index()
+  return {
+    'user_raw': user_counts.index.values,
+    'item_raw': item_counts.index.values,
+    'user_counts': user_counts.values.astype(np.int64),
+    'item_counts': item_counts.values.astype(np.int64),
+    'n_ratings': n_ratings,
+    'global_mean': total / n_ratings,
+  }
+
+
+def _inner_ids(raw, ids):
+  """Inner ids of raw ids known to be in the sorted array raw"""
+  return np.searchsorted(raw, ids).astype(np.int32)
+
+
+def _shuffled_buffers(blocks, buffer_blocks, rng):
+  """Concatenate groups of buffer_blocks blocks and shuffle every group"""
+  buffer = []
+  for block in blocks:
+    buffer.append(block)
+    if len(buffer) == buffer_blocks:
+      yield _shuffle(buffer, rng)
+      buffer = []
+  if buffer:
+    yield _shuffle(buffer, rng)
+
+
+def _shuffle(buffer, rng):
+  u, i, r = (np.concatenate(col) for col in zip(*buffer))
+  order = rng.permutation(len(u))
+  return u[order], i[order], r[order]
+
+
+class _Store:
+  """Ratings of a training set with inner ids 0..n-1 in raw id order"""
+  def _set_stats(self, stats, rating_scale):
+    self.user_raw = np.asarray(stats['user_raw'])
+    self.item_raw = np.asarray(stats['item_raw'])
+    self.user_counts = np.asarray(stats['user_counts'])
+    self.item_counts = np.asarray(stats['item_counts'])
+    self.n_users, self.n_items = len(self.user_raw), len(self.item_raw)
+    self.n_ratings = int(stats['n_ratings'])
+    self.global_mean = float(stats['global_mean'])
+    self.rating_scale = tuple(rating_scale)
+
+  def user_csr(self, out_dir):
+    """Training ratings by user (CSR) written as .npy memmaps to out_dir
+
+    The items of a user are in store order (not sorted by inner id).
+    """
+    indptr = np.zeros(self.n_users + 1, dtype=np.int64)
+    np.cumsum(self.user_counts, out=indptr[1:])
+    np.save(os.path.join(out_dir, 'ur_indptr.npy'), indptr)
+    indices = open_memmap(os.path.join(out_dir, 'ur_indices.npy'), mode='w+',
+                          dtype=np.int32, shape=(self.n_ratings,))
+    ratings = open_memmap(os.path.join(out_dir, 'ur_ratings.npy'), mode='w+',
+                          dtype=np.float32, shape=(self.n_ratings,))
+
+    cursor = indptr[:-1].copy()
+    for u, i, r in self.blocks():
+      order = np.argsort(u, kind='stable')
+      u = u[order]
+      starts = np.flatnonzero(np.r_[True, u[1:] != u[:-1]])
+      sizes = np.diff(np.r_[starts, len(u)])
+      rank = np.arange(len(u)) - np.repeat(starts, sizes)
+      pos = cursor[u] + rank
+      indices[pos], ratings[pos] = i[order], r[order]
+      cursor[u[starts]] += sizes
+    indices.flush()
+    ratings.flush()
+    return indptr, indices, ratings
+
+
+class NpyStore(_Store):
+  """Store directory written by prepare_store, read through memmaps"""
+  def __init__(self, path, block_size=1000000, buffer_blocks=4):
+    self.path = path
+    self.block_size = block_size
+    self.buffer_blocks = buffer_blocks
+    with open(os.path.join(path, META_FILE)) as handle:
+      meta = json.load(handle)
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+              for name in ('user_raw', 'item_raw', 'user_counts',
+                           'item_counts', 'user', 'item', 'rating')}
+    self._set_stats({**meta, **arrays}, meta['rating_scale'])
+    self.user, self.item, self.rating = \
+      arrays['user'], arrays['item'], arrays['rating']
+
+  def blocks(self, rng=None):
+    """(users, items, ratings) blocks; shuffled buffers when rng is given"""
+    n_blocks = math.ceil(self.n_ratings / self.block_size)
+    order = np.arange(n_blocks) if rng is None else rng.permutation(n_blocks)
+    blocks = ((np.array(self.user[lo:lo + self.block_size]),
+               np.array(self.item[lo:lo + self.block_size]),
+               np.array(self.rating[lo:lo + self.block_size]))
+              for lo in order * self.block_size)
+    if rng is None:
+      return blocks
+    return _shuffled_buffers(blocks, self.buffer_blocks, rng)
+
+  def user_csr(self, out_dir=None):
+    # prepare_store already wrote the CSR arrays
+    return tuple(np.load(os.path.join(self.path, name + '.npy'),
+                         mmap_mode='r')
+                 for name in ('ur_indptr', 'ur_indices', 'ur_ratings'))
+
+
+class CsvStore(_Store):
+  """ratings.csv read with chunked read_csv
+
+  The csv is scanned once for the ids and counts. Epochs read it in file
+  order and shuffle buffers of buffer_blocks chunks, drawn at random from a
+  pool of buffer_blocks * 2 chunks; a prepared NpyStore mixes far better.
+  """
+  def __init__(self, csv_path, block_size=1000000, buffer_blocks=4,
+               rating_scale=(0.5, 5), columns=COLUMNS):
+    self.path = csv_path
+    self.block_size = block_size
+    self.buffer_blocks = buffer_blocks
+    self.columns = list(columns)
+    self._set_stats(_scan_csv(csv_path, block_size, columns), rating_scale)
+
+  def _chunks(self):
+    u, i, r = self.columns
+    for chunk in pd.read_csv(self.path, usecols=self.columns,
+                             chunksize=self.block_size):
+      yield (_inner_ids(self.user_raw, chunk[u].values),
+             _inner_ids(self.item_raw, chunk[i].values),
+             chunk[r].values.astype(np.float32))
+
+  def blocks(self, rng=None):
+    if rng is None:
+      return self._chunks()
+    return self._shuffled_blocks(rng)
+
+  def _shuffled_blocks(self, rng):
+    pool = []
+    pool_size = self.buffer_blocks * 2
+
+    def drawn():
+      for block in self._chunks():
+        pool.append(block)
+        if len(pool) >= pool_size:
+          yield pool.pop(rng.integers(len(pool)))
+      while pool:
+        yield pool.pop(rng.integers(len(pool)))
+    return _shuffled_buffers(drawn(), self.buffer_blocks, rng)
+
+
+def prepare_store(csv_path, out_dir, chunksize=1000000, rating_scale=(0.5, 5),
+                  columns=COLUMNS):
+  """Convert a ratings.csv to a store directory; returns the NpyStore
+
+  Rating j of the csv is written at position (a * j + c) mod n, a fixed
+  permutation that spreads the users of the csv over the whole store.
+  """
+  stats = _scan_csv(csv_path, chunksize, columns)
+  n = stats['n_ratings']
+  tmp_dir = version_dir(out_dir)
+  os.makedirs(tmp_dir)
+
+  for name in ('user_raw', 'item_raw', 'user_counts', 'item_counts'):
+    np.save(os.path.join(tmp_dir, name + '.npy'), stats[name])
+  cols = [open_memmap(os.path.join(tmp_dir, name + '.npy'), mode='w+',
+                      dtype=dtype, shape=(n,))
+          for name, dtype in (('user', np.int32), ('item', np.int32),
+                              ('rating', np.float32))]
+  a = max(1, int(n * (math.sqrt(5) - 1) / 2))
+  while math.gcd(a, n) != 1:
+    a += 1
+  c = n // 3
+
+  u, i, r = columns
+  j = 0
+  for chunk in pd.read_csv(csv_path, usecols=list(columns),
+                           chunksize=chunksize):
+    pos = (a * np.arange(j, j + len(chunk), dtype=np.int64) + c) % n
+    cols[0][pos] = _inner_ids(stats['user_raw'], chunk[u].values)
+    cols[1][pos] = _inner_ids(stats['item_raw'], chunk[i].values)
+    cols[2][pos] = chunk[r].values
+    j += len(chunk)
+  for col in cols:
+    col.flush()
+  del cols
+
+  meta = {'n_ratings': n, 'global_mean': stats['global_mean'],
+          'rating_scale': list(rating_scale)}
+  with open(os.path.join(tmp_dir, META_FILE), 'w') as handle:
+    json.dump(meta, handle, indent=2)
+  # Written while the columns are in the page cache
+  store = NpyStore(tmp_dir, block_size=chunksize)
+  _Store.user_csr(store, tmp_dir)
+  del store
+
+  replace_dir(out_dir, tmp_dir)
+  return NpyStore(out_dir)
+
+
+def open_store(path, block_size=1000000, buffer_blocks=4):
+  """NpyStore for a store directory, CsvStore for a csv file"""
+  if os.path.isdir(path):
+    return NpyStore(path, block_size, buffer_blocks)
+  return CsvStore(path, block_size, buffer_blocks)
+
+
+def _checkpoints(checkpoint_dir):
+  """Names of the complete checkpoints in checkpoint_dir, oldest first"""
+  return sorted(name for name in os.listdir(checkpoint_dir)
+                if name.startswith('epoch-') and '.' not in name)
+
+
+"""
+Trainers
+
+Same hyperparameters and defaults as the Surprise SVD and NMF models. The
+per-rating SGD updates of Surprise are applied batch_size ratings at a time
+(the gradients of a batch are summed with np.add.at), which needs numpy only
+and converges like the sequential updates for batches much smaller than the
+number of users and items.
+"""
+class _StreamingMF:
+  kind = None
+
+  def _init_params(self, store, rng):
+    raise NotImplementedError
+
+  def _epoch(self, store, rng):
+    """Run one epoch; returns the training RMSE seen during the epoch"""
+    raise NotImplementedError
+
+  def fit(self, store, valid=None, patience=None, min_delta=0.0,
+          checkpoint_dir=None, checkpoint_every=1):
+    """Fit on the ratings of store
+
+    valid is a (raw uids, raw iids, ratings) triple of held-out ratings whose
+    RMSE is logged every epoch, and the parameters of its best epoch are
+    kept in memory and in the checkpoints. With patience set, training stops
+    once the validation RMSE has not improved by min_delta for patience
+    epochs (a nan or inf RMSE is no improvement), and the parameters of the
+    best epoch are kept. With checkpoint_dir set, the
+    parameters, RNG state and logs are written there every checkpoint_every
+    epochs and fit() resumes from the latest checkpoint found.
+    """
+    if patience is not None and valid is None:
+      raise ValueError('early stopping needs a validation set')
+    self.store = store
+    self.n_users, self.n_items = store.n_users, store.n_items
+    self.global_mean = store.global_mean
+    rng = np.random.default_rng(self.random_state)
+    if valid is not None:
+      valid = self._valid_arrays(store, valid)
+
+    self.epoch_log = []
+    self.best_epoch = None
+    best_rmse, best_params, first = math.inf, None, 0
+    state = self._load_checkpoint(checkpoint_dir, rng) if checkpoint_dir \
+      else None
+    if state is None:
+      self._init_params(store, rng)
+    else:
+      first = state['epoch'] + 1
+      self.epoch_log, self.best_epoch = state['epoch_log'], state['best_epoch']
+      best_rmse = math.inf if state['best_rmse'] is None else \
+        state['best_rmse']
+      best_params = state['best_params']
+      if self.verbose:
+        print(f'resumed from the checkpoint of epoch {state["epoch"]}')
+
+    for epoch in range(first, self.n_epochs):
+      if patience is not None and self._since_best(epoch) > patience:
+        break  # resumed from the checkpoint of a stopped fit
+      start = time.perf_counter()
+      entry = {'epoch': epoch, 'train_rmse': self._epoch(store, rng)}
+      if valid is not None:
+        entry['valid_rmse'] = self._valid_rmse(*valid)
+        # False for nan; inf never improves on the initial best_rmse
+        if entry['valid_rmse'] < best_rmse - min_delta:
+          best_rmse, self.best_epoch = entry['valid_rmse'], epoch
+          best_params = self._params(copy=True)
+      entry['seconds'] = time.perf_counter() - start
+      self.epoch_log.append(entry)
+
+      stop = patience is not None and self._since_best(epoch) >= patience
+      if checkpoint_dir and (stop or epoch == self.n_epochs - 1 or
+                             (epoch + 1) % checkpoint_every == 0):
+        checkpoint_start = time.perf_counter()
+        self._save_checkpoint(checkpoint_dir, epoch, rng, best_rmse,
+                              best_params)
+        entry['checkpoint_seconds'] = time.perf_counter() - checkpoint_start
+      if self.verbose:
+        valid_msg = f', valid RMSE {entry["valid_rmse"]:.4f}' \
+          if valid is not None else ''
+        print(f'epoch {epoch}: train RMSE {entry["train_rmse"]:.4f}'
+              f'{valid_msg} ({entry["seconds"]:.1f} s)')
+      if stop:
+        if self.verbose:
+          kept = 'the last one' if self.best_epoch is None else \
+            f'epoch {self.best_epoch}'
+          print(f'no improvement for {patience} epochs, keeping {kept}')
+        break
+
+    if patience is not None and best_params is not None:
+      self.pu, self.qi, self.bu, self.bi = best_params
+    return self
+
+  def _since_best(self, epoch):
+    """Epochs since the best one; every epoch counts while none was finite"""
+    return epoch - (-1 if self.best_epoch is None else self.best_epoch)
+
+  def _params(self, copy=False):
+    params = (self.pu, self.qi, self.bu, self.bi)
+    return tuple(p.copy() for p in params) if copy else params
+
+  # Validation
+  def _valid_arrays(self, store, valid):
+    uids, iids, r = valid
+    u = lookup_ids(store.user_raw, np.arange(store.n_users), uids)
+    i = lookup_ids(store.item_raw, np.arange(store.n_items), iids)
+    return u, i, np.asarray(r, dtype=np.float64)
+
+  def _valid_rmse(self, u, i, r, batch_size=65536):
+    """RMSE of the clipped estimates, with the fallbacks of model_io"""
+    sq_err = 0.0
+    for lo in range(0, len(u), batch_size):
+      uu, ii = u[lo:lo + batch_size], i[lo:lo + batch_size]
+      known_u, known_i = uu >= 0, ii >= 0
+      both = known_u & known_i
+      uu, ii = np.where(known_u, uu, 0), np.where(known_i, ii, 0)
+      dot = np.einsum('ij,ij->i', self.pu[uu], self.qi[ii])
+      if self.biased:
+        est = (self.global_mean + np.where(known_u, self.bu[uu], 0) +
+               np.where(known_i, self.bi[ii], 0) + np.where(both, dot, 0))
+      else:
+        est = np.where(both, dot, self.global_mean)
+      err = r[lo:lo + batch_size] - np.clip(est, *self.store.rating_scale)
+      sq_err += float(err @ err)
+    return math.sqrt(sq_err / max(len(u), 1))
+
+  # Checkpoints
+  def _fingerprint(self):
+    """Settings a checkpoint must have been written with to be resumed"""
+    fit = {'kind': self.kind, 'n_factors': self.n_factors,
+           'biased': bool(self.biased), 'random_state': self.random_state,
+           'n_epochs': self.n_epochs, 'batch_size': self.batch_size,
+           'n_users': self.n_users, 'n_items': self.n_items,
+           'n_ratings': self.store.n_ratings}
+    # Learning rates and regularization terms of either model
+    fit.update((name, value) for name, value in sorted(vars(self).items())
+               if name.startswith(('lr_', 'reg_')))
+    return fit
+
+  def _save_checkpoint(self, checkpoint_dir, epoch, rng, best_rmse,
+                       best_params, keep=2):
+    """Atomically write the state after epoch; older checkpoints but the
+    last keep are removed"""
+    arrays = dict(zip(('pu', 'qi', 'bu', 'bi'), self._params()))
+    if best_params is not None and self.best_epoch != epoch:
+      arrays.update(zip(('best_pu', 'best_qi', 'best_bu', 'best_bi'),
+                        best_params))
+    state = {'fit': self._fingerprint(), 'epoch': epoch,
+             'rng': rng.bit_generator.state, 'epoch_log': self.epoch_log,
+             'best_epoch': self.best_epoch,
+             'best_rmse': None if math.isinf(best_rmse) else best_rmse}
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    write_artifact(os.path.join(checkpoint_dir, f'epoch-{epoch:04d}'), state,
+                   arrays)
+    for name in _checkpoints(checkpoint_dir)[:-keep]:
+      remove_artifact(os.path.join(checkpoint_dir, name))
+
+  def _load_checkpoint(self, checkpoint_dir, rng):
+    """State of the latest checkpoint (restoring the params and rng), or
+    None when there is none"""
+    names = _checkpoints(checkpoint_dir) if os.path.isdir(checkpoint_dir) \
+      else []
+    if not names:
+      return None
+    path = os.path.join(checkpoint_dir, names[-1])
+    with open(os.path.join(path, META_FILE)) as handle:
+      state = json.load(handle)
+    if state['fit'] != self._fingerprint():
+      raise ValueError(f'checkpoint {path} is of another fit '
+                       f'({state["fit"]})')
+    self.pu, self.qi, self.bu, self.bi = (
+      np.load(os.path.join(path, f'{name}.npy'))
+      for name in ('pu', 'qi', 'bu', 'bi'))
+    if os.path.exists(os.path.join(path, 'best_pu.npy')):
+      state['best_params'] = tuple(
+        np.load(os.path.join(path, f'best_{name}.npy'))
+        for name in ('pu', 'qi', 'bu', 'bi'))
+    elif state['best_epoch'] is None:
+      state['best_params'] = None
+    else:
+      # Checkpoints written before the best params were kept with every
+      # validation set have none: the restored epoch becomes the best one
+      if state['best_epoch'] != state['epoch']:
+        state['best_epoch'] = state['epoch']
+        state['best_rmse'] = state['epoch_log'][-1]['valid_rmse']
+      state['best_params'] = self._params(copy=True)
+    rng.bit_generator.state = state['rng']
+    return state
+
+  def _batches(self, store, rng):
+    for u, i, r in store.blocks(rng):
+      for lo in range(0, len(u), self.batch_size):
+        hi = lo + self.batch_size
+        yield u[lo:hi], i[lo:hi], r[lo:hi]
+
+  def save(self, path):
+    """Write the model as a model_io artifact; returns its version"""
+    store = self.store
+    meta = artifact_meta(self.kind, store.n_users, store.n_items,
+                         store.n_ratings, store.global_mean,
+                         store.rating_scale)
+    meta['biased'] = bool(self.biased)
+    arrays = {'pu': self.pu, 'qi': self.qi, 'bu': self.bu, 'bi': self.bi,
+              'user_raw': store.user_raw, 'item_raw': store.item_raw,
+              'user_order': np.argsort(store.user_raw, kind='stable'),
+              'item_order': np.argsort(store.item_raw, kind='stable')}
+    scratch = tempfile.mkdtemp()
+    try:
+      arrays['ur_indptr'], arrays['ur_indices'], arrays['ur_ratings'] = \
+        store.user_csr(scratch)
+      write_artifact(path, meta, arrays)
+    finally:
+      shutil.rmtree(scratch)
+    return meta['version']
+
+
+class StreamingSVD(_StreamingMF):
+  """Biased MF of surprise.SVD: r_ui = mu + bu + bi + qi.pu, fitted by SGD
+
+  init_baseline=True starts the biases from the ALS baselines of baseline.py
+  instead of 0.
+  """
+  kind = 'svd'
+
+  def __init__(self, n_factors=100, n_epochs=20, biased=True, init_mean=0,
+               init_std_dev=.1, lr_all=.005, reg_all=.02, lr_bu=None,
+               lr_bi=None, lr_pu=None, lr_qi=None, reg_bu=None, reg_bi=None,
+               reg_pu=None, reg_qi=None, init_baseline=False, batch_size=1024,
+               random_state=None, verbose=False):
+    self.n_factors = n_factors
+    self.n_epochs = n_epochs
+    self.biased = biased
+    self.init_mean = init_mean
+    self.init_std_dev = init_std_dev
+    self.lr_bu = lr_bu if lr_bu is not None else lr_all
+    self.lr_bi = lr_bi if lr_bi is not None else lr_all
+    self.lr_pu = lr_pu if lr_pu is not None else lr_all
+    self.lr_qi = lr_qi if lr_qi is not None else lr_all
+    self.reg_bu = reg_bu if reg_bu is not None else reg_all
+    self.reg_bi = reg_bi if reg_bi is not None else reg_all
+    self.reg_pu = reg_pu if reg_pu is not None else reg_all
+    self.reg_qi = reg_qi if reg_qi is not None else reg_all
+    self.init_baseline = init_baseline
+    self.batch_size = batch_size
+    self.random_state = random_state
+    self.verbose = verbose
+
+  def _init_params(self, store, rng):
+    if self.biased and self.init_baseline:
+      # Start from the ALS baselines, computed with 2 passes per ALS epoch
+      self.bu, self.bi = als_baselines(store.blocks, store.n_users,
+                                       store.n_items, store.global_mean)
+    else:
+      self.bu = np.zeros(store.n_users)
+      self.bi = np.zeros(store.n_items)
+    self.pu = rng.normal(self.init_mean, self.init_std_dev,
+                         (store.n_users, self.n_factors))
+    self.qi = rng.normal(self.init_mean, self.init_std_dev,
+                         (store.n_items, self.n_factors))
+
+  def _epoch(self, store, rng):
+    bu, bi, pu, qi = self.bu, self.bi, self.pu, self.qi
+    global_mean = self.global_mean if self.biased else 0
+    sq_err = 0.0
+    for u, i, r in self._batches(store, rng):
+      pu_u, qi_i = pu[u], qi[i]
+      err = r - (global_mean + bu[u] + bi[i] +
+                 np.einsum('ij,ij->i', pu_u, qi_i))
+      sq_err += float(err @ err)
+      if self.biased:
+        np.add.at(bu, u, self.lr_bu * (err - self.reg_bu * bu[u]))
+        np.add.at(bi, i, self.lr_bi * (err - self.reg_bi * bi[i]))
+      err = err[:, None]
+      np.add.at(pu, u, self.lr_pu * (err * qi_i - self.reg_pu * pu_u))
+      np.add.at(qi, i, self.lr_qi * (err * pu_u - self.reg_qi * qi_i))
+    return math.sqrt(sq_err / store.n_ratings)
+
+
+class StreamingNMF(_StreamingMF):
+  """surprise.NMF: multiplicative updates of non-negative pu and qi
+
+  The numerators and denominators of the updates are sums over the ratings,
+  accumulated block by block with sparse products. Without biases the result
+  does not depend on the order of the ratings; the optional biases are
+  fitted by SGD batch_size ratings at a time.
+  """
+  kind = 'nmf'
+
+  def __init__(self, n_factors=15, n_epochs=50, biased=False, reg_pu=.06,
+               reg_qi=.06, reg_bu=.02, reg_bi=.02, lr_bu=.005, lr_bi=.005,
+               init_low=0, init_high=1, batch_size=1024, random_state=None,
+               verbose=False):
+    if init_low < 0:
+      raise ValueError('init_low should be greater than zero')
+    self.n_factors = n_factors
+    self.n_epochs = n_epochs
+    self.biased = biased
+    self.reg_pu = reg_pu
+    self.reg_qi = reg_qi
+    self.reg_bu = reg_bu
+    self.reg_bi = reg_bi
+    self.lr_bu = lr_bu
+    self.lr_bi = lr_bi
+    self.init_low = init_low
+    self.init_high = init_high
+    self.batch_size = batch_size
+    self.random_state = random_state
+    self.verbose = verbose
+
+  def _init_params(self, store, rng):
+    self.pu = rng.uniform(self.init_low, self.init_high,
+                          (store.n_users, self.n_factors))
+    self.qi = rng.uniform(self.init_low, self.init_high,
+                          (store.n_items, self.n_factors))
+    self.bu = np.zeros(store.n_users)
+    self.bi = np.zeros(store.n_items)
+
+  def _estimates(self, u, i, r):
+    """Estimates of a block, updating the biases on the way when biased"""
+    dot = np.einsum('ij,ij->i', self.pu[u], self.qi[i])
+    if not self.biased:
+      return dot
+    est = np.empty(len(u))
+    for lo in range(0, len(u), self.batch_size):
+      s = slice(lo, lo + self.batch_size)
+      uu, ii = u[s], i[s]
+      est[s] = self.global_mean + self.bu[uu] + self.bi[ii] + dot[s]
+      err = r[s] - est[s]
+      np.add.at(self.bu, uu, self.lr_bu * (err - self.reg_bu * self.bu[uu]))
+      np.add.at(self.bi, ii, self.lr_bi * (err - self.reg_bi * self.bi[ii]))
+    return est
+
+  def _epoch(self, store, rng):
+    pu, qi = self.pu, self.qi
+    user_num, user_denom = np.zeros_like(pu), np.zeros_like(pu)
+    item_num, item_denom = np.zeros_like(qi), np.zeros_like(qi)
+    shape = (store.n_users, store.n_items)
+    sq_err = 0.0
+    for u, i, r in store.blocks(rng):
+      r = r.astype(np.float64)
+      est = self._estimates(u, i, r)
+      sq_err += float((r - est) @ (r - est))
+      by_rating = sp.csr_matrix((r, (u, i)), shape=shape)
+      by_est = sp.csr_matrix((est, (u, i)), shape=shape)
+      user_num += by_rating @ qi
+      user_denom += by_est @ qi
+      item_num += by_rating.T @ pu
+      item_denom += by_est.T @ pu
+
+    # Factors that are exactly 0 stay at 0, as in surprise.NMF
+    user_denom += self.reg_pu * store.user_counts[:, None] * pu
+    np.multiply(pu, user_num / np.where(pu != 0, user_denom, 1), out=pu)
+    item_denom += self.reg_qi * store.item_counts[:, None] * qi
+    np.multiply(qi, item_num / np.where(qi != 0, item_denom, 1), out=qi)
+    return math.sqrt(sq_err / store.n_ratings)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  prepare = commands.add_parser('prepare', help='convert a csv to a store')
+  prepare.add_argument('csv')
+  prepare.add_argument('store')
+  prepare.add_argument('--chunk-size', type=int, default=1000000)
+
+  train = commands.add_parser('train', help='fit a model and save it')
+  train.add_argument('source', help='store directory or ratings.csv')
+  train.add_argument('model_dir')
+  train.add_argument('--model', choices=['svd', 'nmf'], default='svd')
+  train.add_argument('--factors', type=int, help='default: as in Surprise')
+  train.add_argument('--epochs', type=int, help='default: as in Surprise')
+  train.add_argument('--unbiased', action='store_true',
+                     help='SVD without biases (NMF is unbiased by default)')
+  train.add_argument('--biased', action='store_true', help='NMF with biases')
+  train.add_argument('--init-baseline', action='store_true',
+                     help='start the SVD biases from the ALS baselines')
+  train.add_argument('--block-size', type=int, default=1000000,
+                     help='ratings read from disk at a time')
+  train.add_argument('--buffer-blocks', type=int, default=4,
+                     help='blocks shuffled together')
+  train.add_argument('--batch-size', type=int, default=1024)
+  train.add_argument('--seed', type=int, default=42)
+  train.add_argument('--valid', help='csv of held-out ratings (RMSE logged '
+                     'every epoch)')
+  train.add_argument('--patience', type=int,
+                     help='stop after this many epochs without improvement')
+  train.add_argument('--min-delta', type=float, default=0.0)
+  train.add_argument('--checkpoint-dir',
+                     help='checkpoint there, and resume from it')
+  train.add_argument('--checkpoint-every', type=int, default=1)
+  args = parser.parse_args()
+
+  if args.command == 'prepare':
+    store = prepare_store(args.csv, args.store, args.chunk_size)
+    print(f'{store.n_ratings} ratings of {store.n_users} users and '
+          f'{store.n_items} items written to {args.store}')
+  else:
+    store = open_store(args.source, args.block_size, args.buffer_blocks)
+    options = dict(batch_size=args.batch_size, random_state=args.seed,
+                   verbose=True)
+    if args.factors:
+      options['n_factors'] = args.factors
+    if args.epochs:
+      options['n_epochs'] = args.epochs
+    if args.model == 'svd':
+      algo = StreamingSVD(biased=not args.unbiased,
+                          init_baseline=args.init_baseline, **options)
+    else:
+      algo = StreamingNMF(biased=args.biased, **options)
+    valid = None
+    if args.valid:
+      df = pd.read_csv(args.valid, usecols=list(COLUMNS))
+      valid = tuple(df[col].values for col in COLUMNS)
+    algo.fit(store, valid, args.patience, args.min_delta, args.checkpoint_dir,
+             args.checkpoint_every)
+    version = algo.save(args.model_dir)
+    print(f'model {version} saved to {args.model_dir}')
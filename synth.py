@@ -0,0 +1,269 @@
+"""
+Synthetic power-law ratings for scale testing
+
+Writes <out>/ratings.csv (userId,movieId,rating,timestamp) and <out>/movies.csv
+in the MovieLens format read by project3.py, streaming the ratings in chunks so
+that 100M ratings can be produced on a single box.
+
+The profile of the data is fitted to a real ratings.csv (ml-latest-small by
+default):
+  - number of ratings per user  : rank-frequency power law c(r) ~ r^-s_user,
+                                  with the minimum count of the real data
+  - number of ratings per movie : movie popularity p(r) ~ r^-s_item
+  - rating values               : histogram of the real ratings
+  - user / movie effects        : std of the user and movie mean ratings
+A rating is the quantile of (user effect + movie effect + noise) mapped through
+the real histogram, so the marginal histogram is reproduced exactly while
+users and movies keep consistent biases for the models to learn.
+
+  python3 synth.py --ratings 10000000 --out ./synth-10m
+"""
+import os
+import json
+import math
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+RATINGS_CSV = './ml-latest-small/ratings.csv'
+
+# Profile of ml-latest-small, used when its ratings.csv is not available
+DEFAULT_PROFILE = {
+  'n_ratings': 100836,
+  'n_users': 610,
+  'n_items': 9724,
+  'user_exponent': 0.95,
+  'item_exponent': 1.05,
+  'min_user_count': 20,
+  'rating_values': [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0],
+  'rating_probs': [0.0136, 0.0279, 0.0178, 0.0749, 0.0550, 0.1988, 0.1303,
+                   0.2660, 0.0848, 0.1309],
+  'user_effect_std': 0.48,
+  'item_effect_std': 0.84,
+}
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime',
+          'Documentary', 'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'IMAX',
+          'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War',
+          'Western']
+
+
+"""
+Fitting the profile
+"""
+def _power_law_exponent(counts):
+  """Slope s of log(count) = a - s * log(rank) over the sorted counts"""
+  counts = np.sort(np.asarray(counts, dtype=np.float64))[::-1]
+  ranks = np.arange(1, len(counts) + 1)
+  slope, _ = np.polyfit(np.log(ranks), np.log(counts), 1)
+  return float(-slope)
+
+
+def fit_profile(ratings_csv=RATINGS_CSV):
+  """Profile of a real ratings.csv; DEFAULT_PROFILE if it does not exist"""
+  if not os.path.isfile(ratings_csv):
+    return dict(DEFAULT_PROFILE)
+  df = pd.read_csv(ratings_csv)
+  user_counts = df['userId'].value_counts()
+  item_counts = df['movieId'].value_counts()
+  hist = df['rating'].value_counts(normalize=True).sort_index()
+  return {
+    'n_ratings': len(df),
+    'n_users': len(user_counts),
+    'n_items': len(item_counts),
+    'user_exponent': _power_law_exponent(user_counts),
+    'item_exponent': _power_law_exponent(item_counts),
+    'min_user_count': int(user_counts.min()),
+    'rating_values': hist.index.tolist(),
+    'rating_probs': hist.values.tolist(),
+    'user_effect_std': float(df.groupby('userId')['rating'].mean().std()),
+    'item_effect_std': float(df.groupby('movieId')['rating'].mean().std()),
+  }
+
+
+"""
+Generation
+"""
+def default_sizes(n_ratings, profile):
+  """(n_users, n_items) for n_ratings, scaled from the profile
+
+  Users grow linearly with the ratings (constant ratings per user, as in the
+  larger MovieLens sets) and the catalog grows with the square root.
+  """
+  scale = n_ratings / profile['n_ratings']
+  n_users = max(2, int(round(profile['n_users'] * scale)))
+  n_items = max(2, int(round(profile['n_items'] * math.sqrt(scale))))
+  return n_users, n_items
+
+
+def user_counts(n_ratings, n_users, n_items, profile, rng):
+  """Number of ratings of every user (in user id order)"""
+  w = np.arange(1, n_users + 1, dtype=np.float64) ** -profile['user_exponent']
+  min_count = min(profile['min_user_count'], n_items)
+  max_count = max(min_count, n_items // 4)
+
+  # Spread the ratings above the minimum along the power law; the scale is
+  # bisected so that the counts still add up after capping the heavy users
+  def counts_at(scale):
+    return np.clip(np.floor(w * scale).astype(np.int64), min_count,
+                   max_count)
+  lo, hi = 0.0, float(n_ratings) / w[-1]
+  for _ in range(100):
+    mid = (lo + hi) / 2
+    if counts_at(mid).sum() < n_ratings:
+      lo = mid
+    else:
+      hi = mid
+  return rng.permutation(counts_at(lo))
+
+
+def _sample_items(counts, cdf, rng, max_rounds=10):
+  """Distinct items for a block of users, drawn from the popularity cdf"""
+  n_items = len(cdf)
+  prob = np.diff(np.r_[0, cdf])
+  done_users, done_items = [], []
+  active = np.arange(len(counts))
+  users = items = np.empty(0, dtype=np.int64)
+  missing = counts
+  for _ in range(max_rounds):
+    # Users that lost ratings to duplicates draw again; the number of draws
+    # is scaled by the popularity mass the user has not rated yet, since the
+    # rest of the draws will mostly be duplicates
+    covered = np.bincount(np.searchsorted(active, users), weights=prob[items],
+                          minlength=len(active))
+    n_draws = np.ceil(missing / np.maximum(1 - covered, 1e-3) * 1.1)
+    todo = np.repeat(active, n_draws.astype(np.int64))
+    draws = np.searchsorted(cdf, rng.random(len(todo)), side='right')
+    key = np.unique(np.concatenate([users * n_items + items,
+                                    todo * n_items + draws]))
+    users, items = key // n_items, key % n_items
+
+    # Drop a random subset of the surplus items of every user
+    order = np.lexsort((rng.random(len(users)), users))
+    users, items = users[order], items[order]
+    n_have = np.bincount(users, minlength=len(counts))
+    starts = np.r_[0, np.cumsum(n_have)]
+    keep = np.arange(len(users)) - starts[users] < counts[users]
+    users, items = users[keep], items[keep]
+
+    # Users with all their ratings leave the active set
+    n_have = np.bincount(users, minlength=len(counts))
+    complete = n_have[users] == counts[users]
+    done_users.append(users[complete])
+    done_items.append(items[complete])
+    users, items = users[~complete], items[~complete]
+    active = active[n_have[active] < counts[active]]
+    missing = (counts - n_have)[active]
+    if len(active) == 0:
+      break
+
+  done_users.append(users)
+  done_items.append(items)
+  return np.concatenate(done_users), np.concatenate(done_items)
+
+
+def generate(n_ratings, n_users=None, n_items=None, profile=None,
+             chunk_size=1000000, seed=42):
+  """Yield DataFrame chunks of about chunk_size ratings, ordered by user"""
+  profile = profile or dict(DEFAULT_PROFILE)
+  rng = np.random.default_rng(seed)
+  default_users, default_items = default_sizes(n_ratings, profile)
+  n_users = n_users or default_users
+  n_items = n_items or default_items
+
+  counts = user_counts(n_ratings, n_users, n_items, profile, rng)
+
+  # Movie popularity: power law over a random order of the movie ids
+  popularity = np.arange(1, n_items + 1, dtype=np.float64) ** \
+    -profile['item_exponent']
+  cdf = np.cumsum(popularity / popularity.sum())
+  cdf[-1] = 1.0
+  movie_ids = rng.permutation(n_items) + 1
+
+  user_effect = rng.normal(0, profile['user_effect_std'], n_users)
+  item_effect = rng.normal(0, profile['item_effect_std'], n_items)
+  noise_std = 1.0
+  total_std = math.sqrt(profile['user_effect_std'] ** 2 +
+                        profile['item_effect_std'] ** 2 + noise_std ** 2)
+  values = np.asarray(profile['rating_values'])
+  rating_cdf = np.cumsum(profile['rating_probs'])
+  rating_cdf /= rating_cdf[-1]
+
+  block_ends = np.searchsorted(np.cumsum(counts),
+                               np.arange(chunk_size, counts.sum(), chunk_size))
+  for lo, hi in zip(np.r_[0, block_ends], np.r_[block_ends, n_users]):
+    if hi <= lo:
+      continue
+    users, items = _sample_items(counts[lo:hi], cdf, rng)
+    users += lo
+    z = (user_effect[users] + item_effect[items] +
+         rng.normal(0, noise_std, len(users))) / total_std
+    ratings = values[np.minimum(np.searchsorted(rating_cdf, ndtr(z)),
+                                len(values) - 1)]
+    yield pd.DataFrame({
+      'userId': users + 1,
+      'movieId': movie_ids[items],
+      'rating': ratings,
+      'timestamp': rng.integers(828124615, 1537799250, len(users)),
+    }).sort_values(['userId', 'movieId'], kind='stable')
+
+
+def generate_frame(n_ratings, **kwargs):
+  """All the chunks of generate() as one DataFrame"""
+  return pd.concat(list(generate(n_ratings, **kwargs)), ignore_index=True)
+
+
+def write_movies(path, n_items, seed=42):
+  """movies.csv with synthetic titles and 1 to 3 genres per movie"""
+  rng = np.random.default_rng(seed)
+  genres = ['|'.join(rng.choice(GENRES, rng.integers(1, 4), replace=False))
+            for _ in range(n_items)]
+  pd.DataFrame({
+    'movieId': np.arange(1, n_items + 1),
+    'title': [f'Movie {i} (2000)' for i in range(1, n_items + 1)],
+    'genres': genres,
+  }).to_csv(path, index=False)
+
+
+def write_dataset(out_dir, n_ratings, n_users=None, n_items=None,
+                  profile=None, chunk_size=1000000, seed=42):
+  """Stream a synthetic dataset to out_dir; returns the number of ratings"""
+  profile = profile or dict(DEFAULT_PROFILE)
+  default_users, default_items = default_sizes(n_ratings, profile)
+  n_items = n_items or default_items
+  os.makedirs(out_dir, exist_ok=True)
+
+  ratings_path = os.path.join(out_dir, 'ratings.csv')
+  written = 0
+  for counter, chunk in enumerate(generate(n_ratings, n_users, n_items,
+                                           profile, chunk_size, seed)):
+    chunk.to_csv(ratings_path, mode='w' if counter == 0 else 'a',
+                 header=counter == 0, index=False)
+    written += len(chunk)
+    print(f'chunk {counter + 1}: {written} ratings written')
+
+  write_movies(os.path.join(out_dir, 'movies.csv'), n_items, seed)
+  with open(os.path.join(out_dir, 'profile.json'), 'w') as handle:
+    json.dump(profile, handle, indent=2)
+  return written
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+  parser.add_argument('--ratings', type=int, default=1000000,
+                      help='number of ratings to generate')
+  parser.add_argument('--users', type=int, help='default: scaled from data')
+  parser.add_argument('--items', type=int, help='default: scaled from data')
+  parser.add_argument('--fit', default=RATINGS_CSV,
+                      help='real ratings.csv to fit the profile to')
+  parser.add_argument('--chunk-size', type=int, default=1000000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--out', default='./synth')
+  args = parser.parse_args()
+
+  profile = fit_profile(args.fit)
+  print('profile:', json.dumps(profile))
+  n = write_dataset(args.out, args.ratings, args.users, args.items, profile,
+                    args.chunk_size, args.seed)
+  print(f'{n} ratings written to {args.out}')
@@ -0,0 +1,35 @@
+import numpy as np
+from surprise import BaselineOnly
+from surprise.model_selection import train_test_split
+
+from baseline import BaselineALS
+
+
+def _inner(to_inner, raw):
+  try:
+    return to_inner(raw)
+  except ValueError:
+    return -1
+
+
+def test_estimates_match_surprise(data):
+  trainset, testset = train_test_split(data, test_size=0.2, random_state=0)
+  algo = BaselineALS().fit(trainset)
+  expected = BaselineOnly(bsl_options={'method': 'als'},
+                          verbose=False).fit(trainset)
+
+  # Inner ids of the testset, plus unknown users and items
+  u = np.array([_inner(trainset.to_inner_uid, uid) for uid, _, _ in testset] +
+               [-1, 0, -1])
+  i = np.array([_inner(trainset.to_inner_iid, iid) for _, iid, _ in testset] +
+               [0, -1, -1])
+  est = [expected.estimate(uu if uu >= 0 else 'UKN__x',
+                           ii if ii >= 0 else 'UKN__x')
+         for uu, ii in zip(u.tolist(), i.tolist())]
+  np.testing.assert_allclose(algo.estimate_batch(u, i), est, rtol=0,
+                             atol=1e-12)
+
+  _, est = algo.test_batch(testset)
+  np.testing.assert_allclose(
+    est, [expected.predict(uid, iid).est for uid, iid, _ in testset],
+    rtol=0, atol=1e-12)
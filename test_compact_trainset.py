@@ -0,0 +1,54 @@
+import numpy as np
+from surprise import KNNWithMeans
+from surprise.model_selection import KFold
+from surprise.prediction_algorithms.matrix_factorization import SVD
+
+from cf_utils import NaiveCollabFilter
+import compact_trainset
+from compact_trainset import CompactTrainset, kfold_split
+
+
+def test_folds_match_kfold(data, monkeypatch):
+  # Blocks of a few rows, so the full passes cross block boundaries
+  monkeypatch.setattr(compact_trainset, '_BLOCK', 50)
+  kf = KFold(n_splits=5, random_state=3)
+  folds = zip(kf.split(data), kfold_split(data, kf))
+  for (trainset, testset), (compact, compact_testset) in folds:
+    assert compact_testset == testset
+    assert isinstance(compact, CompactTrainset)
+    assert (compact.n_users, compact.n_items, compact.n_ratings) == \
+      (trainset.n_users, trainset.n_items, trainset.n_ratings)
+    assert compact.global_mean == trainset.global_mean
+    assert list(compact.all_ratings()) == list(trainset.all_ratings())
+    for u in range(trainset.n_users):
+      assert list(compact.ur[u]) == trainset.ur[u]
+      items, ratings = compact.ur_arrays(u)
+      assert list(zip(items.tolist(), ratings.tolist())) == trainset.ur[u]
+    for i in range(trainset.n_items):
+      assert list(compact.ir[i]) == trainset.ir[i]
+    assert dict(compact.ur.items()) == trainset.ur
+    assert dict(compact.ir.items()) == trainset.ir
+
+
+def test_rating_dtype(ratings_df):
+  df = ratings_df.assign(rating=ratings_df['rating'] + 0.1)
+  assert CompactTrainset.from_df(df).user_ratings.dtype == np.float32
+  compact = CompactTrainset.from_df(df, rating_dtype=np.float64)
+  users, items, ratings = compact.ratings_arrays()
+  assert ratings.dtype == np.float64
+  assert list(compact.all_ratings()) == list(zip(
+    users.tolist(), items.tolist(), ratings.tolist()))
+  assert sorted(ratings.tolist()) == sorted(df['rating'].tolist())
+
+
+def test_models_fit_the_same(data):
+  kf = KFold(n_splits=5, random_state=3)
+  (trainset, testset), = [next(iter(kf.split(data)))]
+  (compact, _), = [next(iter(kfold_split(data, kf)))]
+  for make in (lambda: SVD(n_factors=10, random_state=0),
+               lambda: KNNWithMeans(k=20, sim_options={'name': 'pearson'},
+                                    verbose=False),
+               NaiveCollabFilter):
+    expected = [p.est for p in make().fit(trainset).test(testset)]
+    est = [p.est for p in make().fit(compact).test(testset)]
+    np.testing.assert_allclose(est, expected, rtol=0, atol=1e-12)
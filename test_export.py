@@ -0,0 +1,64 @@
+import os
+import pytest
+from surprise.prediction_algorithms.matrix_factorization import SVD
+
+import export
+from export import export_top_n, read_export
+from model_io import save_model
+
+
+class Killed(Exception):
+  pass
+
+
+@pytest.fixture
+def model_path(data, tmp_path):
+  path = str(tmp_path / 'svd')
+  save_model(SVD(n_factors=5, random_state=0).fit(data.build_full_trainset()),
+             path)
+  return path
+
+
+def _files(out_dir):
+  files = dict()
+  for name in sorted(os.listdir(out_dir)):
+    with open(os.path.join(out_dir, name), 'rb') as handle:
+      files[name] = handle.read()
+  return files
+
+
+@pytest.mark.parametrize('fmt', export.FORMATS)
+def test_resumed_export_is_identical(model_path, tmp_path, monkeypatch, fmt):
+  expected_dir = str(tmp_path / 'expected')
+  export_top_n(model_path, expected_dir, n=5, block_size=8, fmt=fmt,
+               verbose=False)
+
+  # Killed while writing the fourth part, its temporary file left behind
+  out_dir = str(tmp_path / 'out')
+  write_part = export._write_part
+  calls = []
+
+  def killed_write(path, *args):
+    calls.append(path)
+    if len(calls) == 4:
+      open(f'{path}.tmp-12345', 'w').close()
+      raise Killed()
+    write_part(path, *args)
+  monkeypatch.setattr(export, '_write_part', killed_write)
+  with pytest.raises(Killed):
+    export_top_n(model_path, out_dir, n=5, block_size=8, fmt=fmt,
+                 verbose=False)
+  monkeypatch.undo()
+  # and a part lost
+  os.remove(export.part_path(out_dir, 1, fmt))
+
+  stats = export_top_n(model_path, out_dir, n=5, block_size=8, fmt=fmt,
+                       verbose=False)
+  assert stats['skipped_blocks'] == 2
+  assert _files(out_dir) == _files(expected_dir)
+  assert list(read_export(out_dir)) == list(read_export(expected_dir))
+
+
+def test_workers_refuse_other_version(model_path):
+  with pytest.raises(ValueError):
+    export._init_worker(os.path.realpath(model_path), 'another-version')
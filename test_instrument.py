@@ -0,0 +1,67 @@
+import json
+import time
+import pytest
+
+from instrument import Tracer
+
+
+def _read_jsonl(path):
+  with open(path) as handle:
+    return [json.loads(line) for line in handle]
+
+
+@pytest.mark.parametrize('memory', [False, True])
+def test_trace_records(tmp_path, capsys, memory):
+  prefix = str(tmp_path / 'trace')
+  tracer = Tracer(prefix, memory=memory, rss_interval=0.001)
+
+  @tracer.timed('load', model='naive')
+  def load():
+    time.sleep(0.01)
+    return [0] * 100000
+
+  for fold, item in enumerate(tracer.iterate('split', range(3),
+                                             model='knn', param=5)):
+    with tracer.stage('fit', model='knn', param=5, fold=fold):
+      with tracer.stage('trim', model='knn', param=5, fold=fold):
+        time.sleep(0.002)
+      time.sleep(0.005)
+  load()
+  tracer.summary()
+  tracer.close()
+
+  events = _read_jsonl(prefix + '.jsonl')
+  assert events == tracer.events
+  assert [e['stage'] for e in events] == \
+    ['split', 'trim', 'fit'] * 3 + ['load']
+  assert [e['fold'] for e in events if e['stage'] == 'split'] == [0, 1, 2]
+  for e in events:
+    assert e['depth'] == (1 if e['stage'] == 'trim' else 0)
+    assert e['rss_peak_mb'] >= e['rss_mb'] > 0
+    assert ('traced_peak_mb' in e) == memory
+  fits = [e for e in events if e['stage'] == 'fit']
+  trims = [e for e in events if e['stage'] == 'trim']
+  for fit, trim in zip(fits, trims):
+    assert fit['duration'] >= trim['duration'] + 0.005
+    assert fit['start'] <= trim['start']
+  if memory:
+    assert events[-1]['traced_peak_mb'] > 0.5  # the 100000 item list
+
+  # Summary: one row per (model, stage), its total and share of the run
+  rows = {tuple(line.split()[:2]): line.split()[2:]
+          for line in capsys.readouterr().out.splitlines()[2:]}
+  assert set(rows) == {('knn', 'split'), ('knn', 'fit'), ('knn', 'trim'),
+                       ('naive', 'load')}
+  for (model, stage), cols in rows.items():
+    durations = [e['duration'] for e in events
+                 if (e['model'], e['stage']) == (model, stage)]
+    assert int(cols[0]) == len(durations)
+    assert float(cols[1]) == pytest.approx(sum(durations), abs=1e-3)
+  run_time = sum(e['duration'] for e in events if e['depth'] == 0)
+  assert float(rows[('knn', 'fit')][4]) == pytest.approx(
+    100 * sum(e['duration'] for e in fits) / run_time, abs=0.1)
+
+  with open(prefix + '.chrome.json') as handle:
+    trace = json.load(handle)['traceEvents']
+  assert [e['name'] for e in trace] == [e['stage'] for e in events]
+  assert all(e['ph'] == 'X' and e['dur'] > 0 for e in trace)
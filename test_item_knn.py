@@ -0,0 +1,66 @@
+import numpy as np
+from surprise import BaselineOnly, KNNBaseline
+from surprise.model_selection import train_test_split
+
+from item_knn import ItemKNN
+from model_io import load_model
+
+
+def test_neighbors_match_surprise(data):
+  trainset = data.build_full_trainset()
+  k = 10
+  # Small blocks, so that the table is assembled from several of them
+  model = ItemKNN(k=k, block_size=16).fit(trainset).model
+  sim = KNNBaseline(sim_options={'name': 'pearson_baseline',
+                                 'user_based': False},
+                    verbose=False).fit(trainset).sim
+  np.fill_diagonal(sim, 0)
+
+  for i in range(trainset.n_items):
+    lo, hi = model.nb_indptr[i], model.nb_indptr[i + 1]
+    nb_sims = model.nb_sims[lo:hi]
+    # The k most similar positive items, by decreasing similarity
+    expected = np.sort(sim[i][sim[i] > 0])[::-1][:k]
+    np.testing.assert_allclose(nb_sims, expected, rtol=1e-6, atol=1e-8)
+    np.testing.assert_allclose(sim[i, model.nb_indices[lo:hi]], nb_sims,
+                               rtol=1e-6, atol=1e-8)
+
+
+def test_saved_model_scores(data, tmp_path):
+  trainset, testset = train_test_split(data, test_size=0.2, random_state=0)
+  knn = ItemKNN(k=20).fit(trainset)
+  path = str(tmp_path / 'item_knn')
+  knn.save(path)
+  model = load_model(path)
+  assert model.kind == 'item_knn' and model.version == knn.meta['version']
+
+  # Unknown users and items of the testset included, against the formula
+  # summed over the ratings of the trainset
+  def expected(uid, iid):
+    try:
+      u, i = trainset.to_inner_uid(uid), trainset.to_inner_iid(iid)
+    except ValueError:
+      return algo.predict(uid, iid).est
+    rated = dict(trainset.ur[u])
+    lo, hi = model.nb_indptr[i], model.nb_indptr[i + 1]
+    num = den = 0
+    for j, s in zip(model.nb_indices[lo:hi], model.nb_sims[lo:hi].tolist()):
+      if j in rated:
+        num += s * (rated[j] - model.global_mean - model.bu[u] - model.bi[j])
+        den += s
+    est = model.global_mean + model.bu[u] + model.bi[i]
+    return np.clip(est + (num / den if den > 0 else 0), 0.5, 5)
+
+  algo = BaselineOnly(bsl_options={'method': 'als'},
+                      verbose=False).fit(trainset)
+  uids, iids, _ = zip(*testset)
+  np.testing.assert_allclose(
+    model.predict(np.array(uids), np.array(iids)),
+    [expected(uid, iid) for uid, iid in zip(uids, iids)], rtol=0, atol=1e-9)
+
+  # score_user agrees with the estimates of every item, one user at a time
+  items = np.arange(trainset.n_items)
+  for u in [-1, 0, 7, trainset.n_users - 1]:
+    np.testing.assert_allclose(
+      model.score_user(u),
+      model.estimate(np.full(trainset.n_items, u), items), rtol=0, atol=1e-9)
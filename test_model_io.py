@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pytest
+from surprise import KNNWithMeans
+from surprise.model_selection import train_test_split
+from surprise.prediction_algorithms.matrix_factorization import NMF, SVD
+
+from cf_utils import NaiveCollabFilter
+from model_io import load_model, lookup_ids, save_model
+
+MODELS = {
+  'svd': lambda: SVD(n_factors=10, random_state=0),
+  'nmf': lambda: NMF(n_factors=5, random_state=0),
+  'knn': lambda: KNNWithMeans(k=20, sim_options={'name': 'pearson'},
+                              verbose=False),
+  'naive': NaiveCollabFilter,
+}
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_predictions_match_surprise(data, tmp_path, name):
+  trainset, testset = train_test_split(data, test_size=0.2, random_state=0)
+  algo = MODELS[name]()
+  algo.fit(trainset)
+  save_model(algo, str(tmp_path / name))
+  model = load_model(str(tmp_path / name))
+
+  # Unknown users and items of the testset included
+  uids, iids, _ = zip(*testset)
+  expected = [algo.predict(uid, iid).est for uid, iid in zip(uids, iids)]
+  est = model.predict(np.array(uids), np.array(iids))
+  np.testing.assert_allclose(est, expected, rtol=0, atol=1e-7)
+
+
+def test_save_swaps_version(data, tmp_path):
+  path = str(tmp_path / 'svd')
+  trainset = data.build_full_trainset()
+  first = save_model(SVD(n_factors=5, random_state=0).fit(trainset), path)
+  old_dir = os.path.realpath(path)
+  second = save_model(SVD(n_factors=5, random_state=1).fit(trainset), path)
+
+  assert os.path.islink(path)
+  assert first != second and load_model(path).version == second
+  assert not os.path.exists(old_dir)
+  assert sorted(os.listdir(tmp_path)) == ['svd', f'svd.v-{second}']
+
+
+def test_lookup_ids():
+  raw = np.array([30, 10, 20])
+  order = np.argsort(raw)
+  ids = [10, 20.0, '30', 1.5, 20.5, np.nan, 40, -1]
+  np.testing.assert_array_equal(lookup_ids(raw, order, np.array(ids, object)
+                                           .astype(str)),
+                                [1, 2, 0, -1, -1, -1, -1, -1])
+  np.testing.assert_array_equal(lookup_ids(raw, order, [10.0, 1.5, 30.2]),
+                                [1, -1, -1])
+  np.testing.assert_array_equal(lookup_ids(raw, order, ['x', '10']),
+                                [-1, 1])
+  raw = np.array(['b', 'a'])
+  np.testing.assert_array_equal(lookup_ids(raw, np.argsort(raw), ['a', 1]),
+                                [1, -1])
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from surprise.prediction_algorithms.matrix_factorization import SVD
+
+from model_io import load_model, save_model
+from quantize import quantize_factors, quantize_model
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_quantize_factors(dtype):
+  x = np.random.default_rng(0).normal(0, 0.1, (50, 8))
+  x[3] = 0
+  q, scale = quantize_factors(x, dtype)
+  if dtype == 'int8':
+    assert q.dtype == np.int8 and scale.dtype == np.float32
+    # Rounded to the nearest step of every row
+    err = np.abs(q * scale[:, None].astype(np.float64) - x)
+    assert (err <= scale[:, None] / 2 + 1e-9).all()
+    assert np.abs(q).max() == 127 and not q[3].any()
+  else:
+    assert q.dtype == np.float16 and scale is None
+    np.testing.assert_allclose(q, x, rtol=1e-3, atol=1e-7)
+
+
+def test_rerank_matches_float64(data, tmp_path):
+  trainset = data.build_full_trainset()
+  path, qpath = str(tmp_path / 'svd'), str(tmp_path / 'svd-int8')
+  save_model(SVD(n_factors=10, random_state=0).fit(trainset), path)
+  model = load_model(path)
+  quantize_model(path, qpath, 'int8', exact=True, rerank=8)
+  quantized = load_model(qpath)
+  assert quantized.meta['quantized'] == 'int8'
+
+  n = 10
+  # An unknown user included
+  uids = list(model.user_raw) + [-1]
+  expected = model.top_n_batch(uids, n)
+  for got, ref in zip(quantized.top_n_batch(uids, n), expected):
+    assert [iid for iid, _ in got] == [iid for iid, _ in ref]
+    np.testing.assert_allclose([est for _, est in got],
+                               [est for _, est in ref], rtol=0, atol=1e-5)
+  # Without the re-ranking the int8 scores alone reorder some lists
+  assert any([iid for iid, _ in got] != [iid for iid, _ in ref] for got, ref
+             in zip(quantized.top_n_batch(uids, n, rerank=0), expected))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from ranking_eval import _isin_sorted, rank_metrics, trainset_counts
+
+
+def brute_force(pos, neg, t):
+  """rank_metrics of one user by sorting its candidates"""
+  pos, neg = pos[~np.isnan(pos)], neg[np.isfinite(neg)]
+  # By decreasing score; a relevant item ranks below every negative of equal
+  # score, and relevant items of equal score keep their order
+  order = sorted([(-s, 0, 0) for s in neg] +
+                 [(-s, 1, j) for j, s in enumerate(pos)])
+  ranks = [rank for rank, (_, relevant, _) in enumerate(order) if relevant]
+  top = [rank for rank in ranks if rank < t]
+  dcg = sum(1 / np.log2(rank + 2) for rank in top)
+  idcg = sum(1 / np.log2(rank + 2) for rank in range(min(t, len(pos))))
+  return {'hr': float(len(top) > 0), 'ndcg': dcg / idcg,
+          'precision': len(top) / t, 'recall': len(top) / len(pos)}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rank_metrics_brute_force(seed):
+  rng = np.random.default_rng(seed)
+  n_rows, width, n_neg, t = 50, 6, 30, 10
+  # Half-star scores, so ties are common
+  pos = rng.integers(1, 11, size=(n_rows, width)) / 2
+  neg = rng.integers(1, 11, size=(n_rows, n_neg)) / 2
+  n_pos = rng.integers(1, width + 1, size=n_rows)
+  pos[np.arange(width)[None, :] >= n_pos[:, None]] = np.nan
+  neg[rng.random((n_rows, n_neg)) < 0.2] = -np.inf
+
+  metrics = rank_metrics(pos, neg, t)
+  for row in range(n_rows):
+    expected = brute_force(pos[row], neg[row], t)
+    for name, value in expected.items():
+      assert metrics[name][row] == pytest.approx(value), (row, name)
+
+
+def test_isin_sorted():
+  rng = np.random.default_rng(0)
+  sorted_keys = np.unique(rng.integers(0, 1000, size=300))
+  keys = rng.integers(-5, 1005, size=(20, 30))
+  np.testing.assert_array_equal(_isin_sorted(keys, sorted_keys),
+                                np.isin(keys, sorted_keys))
+  assert not _isin_sorted(keys, sorted_keys[:0]).any()
+
+
+def test_counts_of_training_fold(data):
+  from surprise.model_selection import train_test_split
+  trainset, testset = train_test_split(data, test_size=0.2, random_state=0)
+  counts = trainset_counts(trainset)
+  assert sum(counts.values()) == trainset.n_ratings
+  raw = [(uid, iid) for uid, iid, _, _ in data.raw_ratings]
+  for iid in list(counts)[:20]:
+    in_test = sum(1 for _, test_iid, _ in testset if test_iid == iid)
+    assert counts[iid] == sum(1 for _, i in raw if i == iid) - in_test
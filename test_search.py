@@ -0,0 +1,54 @@
+from collections import Counter
+
+import numpy as np
+from surprise.prediction_algorithms.matrix_factorization import SVD
+
+import search
+
+
+def test_rungs_reuse_folds(data, monkeypatch):
+  fits = []
+  evaluate_fold = search.evaluate_fold
+
+  def record(algo, trainset, testset):
+    scores = evaluate_fold(algo, trainset, testset)
+    fits.append((algo.n_factors, id(testset), scores[0]))
+    return scores
+
+  monkeypatch.setattr(search, 'evaluate_fold', record)
+  params = [1, 2, 4, 8, 16]
+  result = search.successive_halving(
+    lambda param: SVD(n_factors=param, n_epochs=5, random_state=0), params,
+    data, n_splits=4, min_folds=1, eta=2, random_state=0, verbose=False)
+
+  # 5 candidates on 1 fold, the best 3 on 2 folds, the best 2 on all 4,
+  # each rung sorted by the mean RMSE of its folds
+  rungs = result['rungs']
+  assert [len(rung) for rung in rungs] == [5, 3, 2]
+  for rung, n in zip(rungs, [1, 2, 4]):
+    assert [(n_folds, rmse) for _, n_folds, rmse in rung] == \
+      [(n, _mean(fits, param, n)) for param, _, _ in rung]
+    assert [rmse for _, _, rmse in rung] == sorted(rmse for _, _, rmse in rung)
+  for prev, rung in zip(rungs, rungs[1:]):
+    assert {param for param, _, _ in rung} == \
+      {param for param, _, _ in prev[:len(rung)]}
+
+  # No (value, fold) pair is fitted twice; every candidate sees the same
+  # folds, in the same order
+  pairs = [(param, fold) for param, fold, _ in fits]
+  assert len(set(pairs)) == len(pairs) == result['n_fits'] == 12
+  folds = list(dict.fromkeys(fold for _, fold, _ in fits))
+  assert len(folds) == 4
+  counts = Counter(param for param, _, _ in fits)
+  for param in params:
+    assert [fold for p, fold, _ in fits if p == param] == \
+      folds[:counts[param]]
+  assert sorted(counts.values()) == [1, 1, 2, 4, 4]
+  assert all(counts[param] == 4 for param, _, _ in rungs[2])
+  assert result['best_param'] == rungs[2][0][0]
+  assert result['rmse'] == _mean(fits, result['best_param'], 4)
+  assert result['grid_fits'] == 20
+
+
+def _mean(fits, param, n_folds):
+  return float(np.mean([rmse for p, _, rmse in fits if p == param][:n_folds]))
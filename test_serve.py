@@ -0,0 +1,129 @@
+import asyncio
+import json
+import numpy as np
+import pytest
+from surprise.prediction_algorithms.matrix_factorization import SVD
+
+from model_io import load_model, save_model
+from serve import MicroBatcher, RecommendationServer
+from topn_cache import TopNCache
+
+
+@pytest.fixture(scope='module')
+def model(data, tmp_path_factory):
+  path = str(tmp_path_factory.mktemp('serve') / 'svd')
+  save_model(SVD(n_factors=5, random_state=0).fit(data.build_full_trainset()),
+             path)
+  return load_model(path)
+
+
+def _run(server, coroutine):
+  """Run coroutine with the batchers of server started"""
+  async def main():
+    server.predict_batcher.start()
+    server.topn_batcher.start()
+    try:
+      return await coroutine()
+    finally:
+      await server.predict_batcher.stop()
+      await server.topn_batcher.stop()
+  return asyncio.run(main())
+
+
+def test_batcher_coalesces_concurrent_requests():
+  batches = []
+
+  def score(requests):
+    batches.append(list(requests))
+    return [2 * request for request in requests]
+
+  async def main():
+    batcher = MicroBatcher(score, window=0.05, max_batch=64)
+    batcher.start()
+    try:
+      return await asyncio.gather(*(batcher.submit(k) for k in range(20)))
+    finally:
+      await batcher.stop()
+  assert asyncio.run(main()) == [2 * k for k in range(20)]
+  assert batches == [list(range(20))]
+
+
+def test_concurrent_predictions_share_a_batch(model):
+  server = RecommendationServer(model, window=0.05, cache=TopNCache())
+  uids = model.user_raw[:10].tolist()
+  iids = model.item_raw[:10].tolist()
+
+  async def requests():
+    return await asyncio.gather(
+      *(server.handle('/predict', {'uid': [str(u)], 'iid': [str(i)]})
+        for u, i in zip(uids, iids)),
+      *(server.handle('/topn', {'uid': [str(u)], 'n': ['5']})
+        for u in uids))
+  results = _run(server, requests)
+  assert server.predict_batcher.n_batches == 1
+  assert server.topn_batcher.n_batches == 1
+  assert all(status == 200 for status, _ in results)
+  est = [body['est'] for _, body in results[:10]]
+  np.testing.assert_allclose(est, model.predict(uids, iids))
+  for uid, (_, body) in zip(uids, results[10:]):
+    assert body['items'] == model.top_n(uid, 5)
+
+
+@pytest.mark.parametrize('path, query', [
+  ('/predict', {'uid': ['1']}),
+  ('/predict', {'uid': ['x'], 'iid': ['1']}),
+  ('/topn', {'uid': ['1'], 'n': ['0']}),
+  ('/topn', {'uid': ['1'], 'n': ['ten']}),
+  ('/ratings', {'uid': ['1'], 'iid': ['1'], 'rating': ['9']}),
+])
+def test_bad_requests(model, path, query):
+  server = RecommendationServer(model)
+  method = 'POST' if path == '/ratings' else 'GET'
+  status, body = _run(server, lambda: server.handle(path, query, method))
+  assert status == 400 and 'error' in body
+
+
+def test_connection_errors(model, monkeypatch):
+  server = RecommendationServer(model)
+
+  def failing_predict(uids, iids):
+    raise RuntimeError('scoring failed')
+  monkeypatch.setattr(server.model, 'predict', failing_predict)
+  uid, iid = model.user_raw[0].item(), model.item_raw[0].item()
+
+  async def exchange(writer, reader, request):
+    writer.write(request.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = dict()
+    while (line := await reader.readline()) != b'\r\n':
+      name, _, value = line.decode().partition(':')
+      headers[name.lower()] = value.strip()
+    body = json.loads(await reader.readexactly(
+      int(headers['content-length'])))
+    return status, headers['connection'], body
+
+  async def requests():
+    tcp = await asyncio.start_server(server.serve_connection, '127.0.0.1', 0)
+    port = tcp.sockets[0].getsockname()[1]
+    async with tcp:
+      reader, writer = await asyncio.open_connection('127.0.0.1', port)
+      results = [
+        await exchange(writer, reader, f'GET /predict?uid={uid}&iid={iid} '
+                                       'HTTP/1.1\r\n\r\n'),
+        await exchange(writer, reader, 'GET /predict HTTP/1.1\r\n\r\n'),
+        await exchange(writer, reader, 'POST /ratings HTTP/1.1\r\n'
+                                       'Content-Length: 5\r\n\r\n[1,2]'),
+        await exchange(writer, reader, 'GET /health HTTP/1.1\r\n'
+                                       'Content-Length: x\r\n\r\n'),
+      ]
+      closed = await reader.read() == b''
+      writer.close()
+      return results, closed
+  results, closed = _run(server, requests)
+  # A scoring error and bad requests keep the connection alive
+  assert [r[:2] for r in results[:3]] == [(500, 'keep-alive'),
+                                          (400, 'keep-alive'),
+                                          (400, 'keep-alive')]
+  # A bad Content-Length closes it, as the end of the body is unknown
+  assert results[3][:2] == (400, 'close') and closed
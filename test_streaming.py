@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from streaming import StreamingNMF, StreamingSVD, prepare_store
+
+MODELS = {
+  'svd': (StreamingSVD, {'n_factors': 10}),
+  'nmf': (StreamingNMF, {'n_factors': 5, 'biased': True}),
+}
+
+
+class Crash(Exception):
+  pass
+
+
+@pytest.fixture
+def store_valid(ratings_df, tmp_path):
+  held_out = np.random.default_rng(0).random(len(ratings_df)) < 0.1
+  ratings_df[~held_out].to_csv(tmp_path / 'train.csv', index=False)
+  store = prepare_store(str(tmp_path / 'train.csv'), str(tmp_path / 'store'),
+                        chunksize=500)
+  valid = ratings_df[held_out]
+  return store, (valid['userId'].values, valid['movieId'].values,
+                 valid['rating'].values)
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_resume_is_bit_identical(store_valid, tmp_path, name):
+  store, valid = store_valid
+  model, options = MODELS[name]
+  full = model(n_epochs=6, random_state=1, **options).fit(store, valid)
+
+  crashing = model(n_epochs=6, random_state=1, **options)
+  epoch = crashing._epoch
+  calls = []
+
+  def crash_in_epoch_4(*args):
+    calls.append(1)
+    if len(calls) == 5:
+      raise Crash()
+    return epoch(*args)
+  crashing._epoch = crash_in_epoch_4
+  checkpoints = str(tmp_path / 'checkpoints')
+  with pytest.raises(Crash):
+    crashing.fit(store, valid, checkpoint_dir=checkpoints, checkpoint_every=2)
+
+  resumed = model(n_epochs=6, random_state=1, **options).fit(
+    store, valid, checkpoint_dir=checkpoints, checkpoint_every=2)
+  for a, b in zip(full._params(), resumed._params()):
+    assert np.array_equal(a, b)
+  assert [e['valid_rmse'] for e in resumed.epoch_log] == \
+    [e['valid_rmse'] for e in full.epoch_log]
+
+  with pytest.raises(ValueError):
+    model(n_epochs=6, random_state=1, batch_size=7, **options).fit(
+      store, valid, checkpoint_dir=checkpoints)
+
+
+def test_resume_keeps_best_epoch(store_valid, tmp_path):
+  """Checkpoints of a fit without patience still hold its best params"""
+  store, valid = store_valid
+  options = {'n_factors': 20, 'n_epochs': 8, 'lr_all': 0.05,
+             'reg_all': 0.0, 'random_state': 1}
+  checkpoints = str(tmp_path / 'checkpoints')
+  full = StreamingSVD(**options).fit(store, valid, checkpoint_dir=checkpoints)
+  assert full.best_epoch < 7
+  early = StreamingSVD(**options).fit(store, valid, patience=2)
+  resumed = StreamingSVD(**options).fit(store, valid, patience=2,
+                                        checkpoint_dir=checkpoints)
+  assert resumed.best_epoch == early.best_epoch == full.best_epoch
+  for a, b in zip(early._params(), resumed._params()):
+    assert np.array_equal(a, b)
+
+
+def test_non_finite_valid_rmse(store_valid, monkeypatch):
+  store, valid = store_valid
+  monkeypatch.setattr(StreamingSVD, '_valid_rmse',
+                      lambda self, u, i, r: float('nan'))
+  model = StreamingSVD(n_factors=5, n_epochs=10, random_state=1)
+  model.fit(store, valid, patience=3)
+  assert model.best_epoch is None
+  assert len(model.epoch_log) == 3
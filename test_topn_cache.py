@@ -0,0 +1,54 @@
+from topn_cache import TopNCache
+
+
+class Clock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+def test_lru_and_ttl():
+  clock = Clock()
+  cache = TopNCache(max_entries=2, ttl=10, clock=clock)
+  cache.put(1, 10, 'unseen', 'v1', [1])
+  cache.put(2, 10, 'unseen', 'v1', [2])
+  assert cache.get(1, 10, 'unseen', 'v1') == [1]
+  cache.put(3, 10, 'unseen', 'v1', [3])  # evicts user 2
+  assert cache.get(2, 10, 'unseen', 'v1') is None
+  clock.now = 11
+  assert cache.get(1, 10, 'unseen', 'v1') is None
+  assert cache.stats()['evictions'] == 1
+  assert cache.stats()['expirations'] == 1
+
+
+def test_stale_put_ignored():
+  cache = TopNCache()
+  generation = cache.generation(1)
+  cache.invalidate_user(1)
+  cache.put(1, 10, 'unseen', 'v1', [1], generation)
+  assert cache.get(1, 10, 'unseen', 'v1') is None
+
+  generation = cache.generation(1)
+  cache.invalidate_all()
+  cache.put(1, 10, 'unseen', 'v1', [1], generation)
+  assert cache.get(1, 10, 'unseen', 'v1') is None
+
+  cache.put(1, 10, 'unseen', 'v1', [1], cache.generation(1))
+  assert cache.get(1, 10, 'unseen', 'v1') == [1]
+
+
+def test_invalidations_bounded():
+  cache = TopNCache(max_entries=3)
+  generation = cache.generation(1)
+  cache.invalidate_user(1)
+  for uid in range(100, 200):
+    cache.invalidate_user(uid)
+  assert len(cache._generations) == 3
+  # User 1 was forgotten: the list computed before its invalidation is still
+  # refused, a new one is accepted
+  cache.put(1, 10, 'unseen', 'v1', [1], generation)
+  assert cache.get(1, 10, 'unseen', 'v1') is None
+  cache.put(1, 10, 'unseen', 'v1', [1], cache.generation(1))
+  assert cache.get(1, 10, 'unseen', 'v1') == [1]
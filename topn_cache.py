@@ -0,0 +1,115 @@
+"""
+LRU / TTL cache of top-N recommendation lists
+
+Entries are keyed by (user, n, filter, model version) and expire after `ttl`
+seconds. The cache holds at most `max_entries` lists; the least recently used
+list is evicted first.
+
+  cache = TopNCache(max_entries=100000, ttl=300)
+  items = cache.get(uid, n, 'unseen', model.version)
+  if items is None:
+    generation = cache.generation(uid)
+    items = model.top_n(uid, n)
+    cache.put(uid, n, 'unseen', model.version, items, generation)
+
+invalidate_user(uid) drops the lists of a user (new ratings), invalidate_all()
+drops everything (new model). put() ignores a list computed before the last
+invalidation of its user (generation changed), so a slow request can not bring
+back a stale list. The last invalidation is remembered for max_entries users;
+lists computed before the oldest one forgotten are ignored too.
+"""
+import time
+from collections import OrderedDict, defaultdict
+
+
+class TopNCache:
+  def __init__(self, max_entries=100000, ttl=300.0, clock=time.monotonic):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.clock = clock
+    self._entries = OrderedDict()  # key -> (expires, items)
+    self._user_keys = defaultdict(set)
+    # Invalidations are numbered; uid -> number of its last invalidation, in
+    # the order they happened
+    self._generations = OrderedDict()
+    self._n_invalidated = 0
+    self._floor = 0  # last invalidation of every user not in _generations
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+    self.invalidations = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _remove(self, key):
+    del self._entries[key]
+    keys = self._user_keys[key[0]]
+    keys.discard(key)
+    if not keys:
+      del self._user_keys[key[0]]
+
+  def get(self, uid, n, filter, version):
+    """Cached list or None"""
+    key = (uid, n, filter, version)
+    entry = self._entries.get(key)
+    if entry is not None and entry[0] <= self.clock():
+      self._remove(key)
+      self.expirations += 1
+      entry = None
+    if entry is None:
+      self.misses += 1
+      return None
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return entry[1]
+
+  def generation(self, uid):
+    """Token to pass to put() for a list computed from now on"""
+    return self._n_invalidated
+
+  def put(self, uid, n, filter, version, items, generation=None):
+    if generation is not None and \
+        generation < self._generations.get(uid, self._floor):
+      return
+    key = (uid, n, filter, version)
+    self._entries[key] = (self.clock() + self.ttl, items)
+    self._entries.move_to_end(key)
+    self._user_keys[uid].add(key)
+    while len(self._entries) > self.max_entries:
+      self._remove(next(iter(self._entries)))
+      self.evictions += 1
+
+  def invalidate_user(self, uid):
+    """Drop every list of uid; returns the number of lists dropped"""
+    self._n_invalidated += 1
+    self._generations[uid] = self._n_invalidated
+    self._generations.move_to_end(uid)
+    if len(self._generations) > self.max_entries:
+      _, self._floor = self._generations.popitem(last=False)
+    keys = self._user_keys.pop(uid, ())
+    for key in keys:
+      del self._entries[key]
+    self.invalidations += len(keys)
+    return len(keys)
+
+  def invalidate_all(self):
+    self.invalidations += len(self._entries)
+    self._n_invalidated += 1
+    self._floor = self._n_invalidated
+    self._generations.clear()
+    self._entries.clear()
+    self._user_keys.clear()
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'size': len(self._entries),
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / lookups if lookups else 0.0,
+      'evictions': self.evictions,
+      'expirations': self.expirations,
+      'invalidations': self.invalidations,
+    }